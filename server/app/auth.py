@@ -1,20 +1,18 @@
+import asyncio
 import bcrypt
 import jwt
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta 
 from fastapi import Depends, HTTPException, status # Depends is FastAPI’s way of saying: “Run this helper function before the route is called.”
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials # gives you a standard way to extract the token from a request's Authorization header
 from jwt import PyJWTError, decode 
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app import models, database
-import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-
-# loading this from .env
-JWT_SECRET = os.getenv("JWT_SECRET")
-JWT_ALGORITHM = os.getenv("JWT_ALGORITHM")
+from app import models, database, profiling
+from app.cache import TTLCache
+from app.config import get_settings
+from dataclasses import dataclass
+from functools import lru_cache
 
 
 def hash_password(plain_password: str) -> str: 
@@ -38,27 +36,109 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 
+"""
+bcrypt is slow on purpose (~250ms of CPU per call). Calling it straight from a route ties up
+one of the threads FastAPI uses for every plain `def` route, so a burst of logins used to
+stall the whole API. The async versions below hand the work to a separate, fixed-size pool
+of threads instead. bcrypt releases the GIL while hashing, so these threads really run in
+parallel, one per CPU core by default.
+
+If more than BCRYPT_MAX_PENDING hashes are already running or queued, the request is turned
+away with 503 and Retry-After right away, instead of piling up behind the others. Both
+BCRYPT_* knobs are in app/config.py.
+"""
+@lru_cache(maxsize=None)
+def bcrypt_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=get_settings().bcrypt_workers, thread_name_prefix="bcrypt")
+
+# only changed from the event loop thread, so it doesn't need a lock
+_bcrypt_pending = 0
+
+async def _run_bcrypt(func, *args):
+    global _bcrypt_pending
+    if _bcrypt_pending >= get_settings().bcrypt_max_pending:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again.",
+            headers={"Retry-After": "1"},
+        )
+    _bcrypt_pending += 1
+    try:
+        with profiling.timer("bcrypt"):
+            return await asyncio.get_running_loop().run_in_executor(bcrypt_pool(), func, *args)
+    finally:
+        _bcrypt_pending -= 1
+
+async def hash_password_async(plain_password: str) -> str:
+    return await _run_bcrypt(hash_password, plain_password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_bcrypt(verify_password, plain_password, hashed_password)
+
+# numbers for /api/status
+def bcrypt_stats() -> dict:
+    return {
+        "workers": get_settings().bcrypt_workers,
+        "max_pending": get_settings().bcrypt_max_pending,
+        "pending": _bcrypt_pending,
+    }
+
+
+# The user with this email (login and get_current_user), a lookup on the unique email index
+def user_by_email_query(email: str):
+    return select(models.User).where(models.User.email == email)
+
 # creating a token using encode from jwt
 def create_access_token(data: dict, expires_delta: int = 30):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes = expires_delta)
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    # JWT_SECRET and JWT_ALGORITHM, loaded from .env (see app/config.py)
+    settings = get_settings()
+    return jwt.encode(to_encode, settings.jwt_secret, algorithm=settings.jwt_algorithm)
 
 # This defines how FastAPI will look for the JWT in the request
 oauth2_scheme = HTTPBearer()
 
+"""
+The few user fields that almost every route needs. get_current_user returns this instead of
+the models.User row, so it can be cached between requests without holding on to a database
+session. Routes that need the rest of the profile use get_current_db_user.
+"""
+@dataclass(frozen=True)
+class UserSnapshot:
+    id: int
+    username: str
+    email: str
+
+"""
+Remembers the UserSnapshot of every token subject (the user's email) we have seen recently,
+so most requests don't have to run SELECT ... FROM users WHERE email = ? again.
+Anything that changes a user must call invalidate_user so the old snapshot isn't served.
+"""
+# USER_CACHE_TTL_SECONDS and USER_CACHE_MAX_SIZE, see app/config.py. Made on first use.
+@lru_cache(maxsize=None)
+def get_user_cache() -> TTLCache:
+    settings = get_settings()
+    return TTLCache(maxsize=settings.user_cache_max_size, ttl=settings.user_cache_ttl_seconds)
+
+def invalidate_user(email: str):
+    get_user_cache().delete(email)
+
 # Depends(oauth2_scheme): automatically extracts the Bearer token from the header.
-def get_current_user(
+# It's async and shares the request's session with the async routes, so a cache hit costs no
+# query, no connection from the pool and no trip to the threadpool.
+async def get_current_user(
         # Uses the oauth2_scheme to extract the Bearer token from the Authorization header of the request.
         # So, credentials will have credentials.scheme: should be 'Bearer' & credentials.credentials: the actual JWT token
         credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme),
-        # Automatically call the get_db() function and pass the result (a database session) into this function.
-        # This will get you make db an object that lets you query your database using SQLAlchemy.
-        db: Session = Depends(database.get_db)):
+        # The request's session (see database.get_async_db); it only gets a connection when
+        # the user isn't cached and has to be looked up.
+        db: database.AsyncDB = Depends(database.get_async_db)) -> UserSnapshot:
     try:
         token = credentials.credentials
-        payload = decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        settings = get_settings()
+        payload = decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
         user_email = payload.get("sub")
         if user_email is None:
             raise HTTPException(
@@ -66,18 +146,42 @@ def get_current_user(
                 detail="Invalid token: missing subject",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        user = db.query(models.User).filter(models.User.email == user_email).first()
+        cached_user = get_user_cache().get(user_email)
+        if cached_user is not None:
+            return cached_user
+
+        user = (await db.scalars(user_by_email_query(user_email))).first()
         if user is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="User not found",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        return user
+        snapshot = UserSnapshot(id=user.id, username=user.username, email=user.email)
+        get_user_cache().set(user_email, snapshot)
+        # ends the read-only transaction so its connection goes back to the pool now instead
+        # of when the request finishes, which for the notification stream could be hours
+        await db.rollback()
+        return snapshot
     
     except PyJWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
-        )
\ No newline at end of file
+        )
+
+# For routes that read or change the full profile (bio, avatar, ...): loads the user's row
+# by primary key in the request's own session, so it can be modified and committed.
+def get_current_db_user(
+        current_user: UserSnapshot = Depends(get_current_user),
+        db: Session = Depends(database.get_db)) -> models.User:
+    user = db.get(models.User, current_user.id)
+    if user is None:
+        invalidate_user(current_user.email)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
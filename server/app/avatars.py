@@ -0,0 +1,168 @@
+"""
+Resized copies of avatars for the app, so it doesn't download a full size photo just to
+draw a small circle.
+
+For every uploaded avatar we make a square copy in each size of AVATAR_SIZES, both as WebP
+and as JPEG, and store their URLs in User.avatar_variants:
+
+    {"64": {"webp": "/uploads/avatars/<hash>_64.webp", "jpeg": "/uploads/avatars/<hash>_64.jpg"},
+     "128": {...}, "256": {...}}
+
+upload_avatar doesn't wait for this. It queues queue_avatar_variants as a FastAPI background
+task, which runs after the response is sent and hands the image work to a small pool of
+worker processes, so resizing never competes with requests for the GIL.
+Avatars that never got their variants (e.g. uploaded before this existed, or while the
+server was restarting) can be filled in from the server folder with:
+
+    python -m app.avatars
+
+Replaced avatars nobody uses any more are deleted by the server every AVATAR_SWEEP_SECONDS
+(see start_sweeper), or by hand with:
+
+    python -m app.avatars --sweep
+
+Needs Pillow (pip install Pillow). Without it uploads still work, just without variants.
+"""
+import asyncio
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from . import models, database, storage
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+AVATAR_SIZES = (64, 128, 256)
+# format name used in URLs/JSON -> (file extension, Pillow format name, save options)
+AVATAR_FORMATS = {
+    "webp": (".webp", "WEBP", {"quality": 80, "method": 4}),
+    "jpeg": (".jpg", "JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+# created on first use, so importing this module (or running without uploads) costs nothing
+_process_pool = None
+
+
+def get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=get_settings().avatar_workers)
+    return _process_pool
+
+
+"""
+Makes all the resized copies of one stored avatar and returns their URLs.
+Runs in a worker process. Copies that already exist are not made again: the file names
+come from the hash of the original, so the same picture always gives the same copies.
+"""
+def render_avatar_variants(filename: str) -> dict:
+    from PIL import Image, ImageOps
+
+    digest = os.path.splitext(filename)[0]
+    variants = {}
+    with Image.open(os.path.join(storage.AVATAR_DIR, filename)) as original:
+        # respect the phone's rotation flag, then drop transparency (JPEG can't store it)
+        image = ImageOps.exif_transpose(original).convert("RGB")
+        for size in AVATAR_SIZES:
+            # crops the middle square out of the picture and scales it to size x size
+            square = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            variants[str(size)] = {}
+            for name, (extension, pil_format, options) in AVATAR_FORMATS.items():
+                variant_name = storage.avatar_variant_filename(digest, size, extension)
+                variant_path = os.path.join(storage.AVATAR_DIR, variant_name)
+                if not os.path.exists(variant_path):
+                    tmp_path = variant_path + ".tmp"
+                    square.save(tmp_path, pil_format, **options)
+                    os.replace(tmp_path, variant_path)
+                variants[str(size)][name] = storage.avatar_url(variant_name)
+    return variants
+
+
+# Makes the variants of `avatar_url` and saves them on the user, unless the user has
+# uploaded yet another avatar in the meantime.
+def generate_avatar_variants(user_id: int, avatar_url: str):
+    filename = os.path.basename(avatar_url)
+    try:
+        variants = get_process_pool().submit(render_avatar_variants, filename).result()
+    except Exception:
+        logger.exception("Could not make avatar variants for user %s (%s)", user_id, avatar_url)
+        return
+
+    db = database.SessionLocal()
+    try:
+        user = db.get(models.User, user_id)
+        if user is not None and user.avatar_url == avatar_url:
+            user.avatar_variants = variants
+            db.commit()
+    finally:
+        db.close()
+
+
+# Called by upload_avatar: runs generate_avatar_variants once the response has been sent
+def queue_avatar_variants(background_tasks, user_id: int, avatar_url: str):
+    background_tasks.add_task(generate_avatar_variants, user_id, avatar_url)
+
+
+# Deletes the avatar files no user has as their avatar any more, see storage.sweep_orphaned_avatars
+def sweep_avatars() -> int:
+    db = database.SessionLocal()
+    try:
+        used_urls = db.scalars(select(models.User.avatar_url).where(models.User.avatar_url.is_not(None)).distinct()).all()
+    finally:
+        db.close()
+    return storage.sweep_orphaned_avatars(used_urls)
+
+
+# Runs sweep_avatars every AVATAR_SWEEP_SECONDS until cancelled (started by main.py). With
+# several server processes each one sweeps; deleting a file twice does no harm.
+async def run_sweeper():
+    while True:
+        await asyncio.sleep(get_settings().avatar_sweep_seconds)
+        try:
+            removed = await run_in_threadpool(sweep_avatars)
+            if removed:
+                logger.info("Deleted %s unused avatar files", removed)
+        except Exception:
+            logger.exception("Sweeping unused avatars failed")
+
+
+_sweeper_task = None
+
+def start_sweeper():
+    global _sweeper_task
+    if get_settings().avatar_sweep_seconds > 0 and _sweeper_task is None:
+        _sweeper_task = asyncio.get_running_loop().create_task(run_sweeper())
+
+async def stop_sweeper():
+    global _sweeper_task
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+        try:
+            await _sweeper_task
+        except asyncio.CancelledError:
+            pass
+        _sweeper_task = None
+
+
+if __name__ == "__main__":
+    # loads .env, like main.py does for the API
+    get_settings()
+    if "--sweep" in sys.argv[1:]:
+        print(f"Deleted {sweep_avatars()} unused avatar files.")
+        sys.exit(0)
+    db = database.SessionLocal()
+    try:
+        missing = (
+            db.query(models.User.id, models.User.avatar_url)
+            .filter(models.User.avatar_url.like(storage.AVATAR_URL_PREFIX + "%"))
+            .filter(models.User.avatar_variants.is_(None))
+            .all()
+        )
+    finally:
+        db.close()
+    for user_id, avatar_url in missing:
+        generate_avatar_variants(user_id, avatar_url)
+    print(f"Made avatar variants for {len(missing)} users.")
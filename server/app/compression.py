@@ -0,0 +1,126 @@
+"""
+Compresses JSON and text responses for clients that ask for it (Accept-Encoding), with
+Brotli when the client accepts it and the brotli package is installed (pip install brotli),
+and gzip otherwise. Feed pages shrink to a fraction of their size, which matters most on
+mobile connections.
+
+- Responses smaller than COMPRESSION_MIN_SIZE bytes are sent as they are: below about a
+  network packet compressing them saves nothing and still costs CPU.
+- Only text-like content types are compressed; images are compressed already, and the
+  notification stream (text/event-stream) has to reach the client event by event.
+- Compressible responses get "Vary: Accept-Encoding" so caches keep the versions apart.
+- Strong ETags become weak ones (W/"..."), since the compressed bytes differ from the
+  uncompressed ones; the API's own ETags are weak already (see app/etags.py).
+
+Starlette's GZipMiddleware does gzip only, hence this one.
+"""
+import gzip
+from typing import Optional
+from .config import get_settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html", "text/css", "application/javascript")
+
+
+# The encoding to use for an Accept-Encoding header ("gzip, deflate, br;q=0.9"), or None
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+
+    def quality_of(encoding):
+        return accepted.get(encoding, accepted.get("*", 0.0))
+
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best = max(candidates, key=quality_of)
+    return best if quality_of(best) > 0 else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=get_settings().brotli_quality)
+    return gzip.compress(body, compresslevel=get_settings().gzip_level)
+
+
+def is_compressible(headers: dict) -> bool:
+    content_type = headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip().lower()
+    return content_type in COMPRESSIBLE_TYPES and b"content-encoding" not in headers
+
+
+"""
+Plain ASGI middleware: holds back the response start until the body is known, then sends
+it compressed or not. Responses that aren't compressible are passed through untouched, so
+streaming ones (files, the notification stream) aren't held back.
+"""
+class CompressionMiddleware:
+    # minimum_size defaults to COMPRESSION_MIN_SIZE (see app/config.py)
+    def __init__(self, app, minimum_size: Optional[int] = None):
+        self.app = app
+        self.minimum_size = get_settings().compression_min_size if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+        request_headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+
+        start_message = None
+        chunks = []
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", []))
+                if not is_compressible(headers) or message["status"] in (204, 304):
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            await send_response(start_message, b"".join(chunks), encoding)
+
+        async def send_response(start, body: bytes, encoding):
+            headers = [
+                (name, value) for name, value in start.get("headers", [])
+                if name not in (b"content-length", b"vary")
+            ]
+            vary = dict(start.get("headers", [])).get(b"vary")
+            headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+
+            if encoding is not None and len(body) >= self.minimum_size:
+                body = compress(body, encoding)
+                headers.append((b"content-encoding", encoding.encode("latin-1")))
+                headers = [
+                    (name, b"W/" + value if name == b"etag" and not value.startswith(b"W/") else value)
+                    for name, value in headers
+                ]
+            headers.append((b"content-length", str(len(body)).encode("latin-1")))
+            await send(dict(start, headers=headers))
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,197 @@
+"""
+All the server's settings: the database, its connection pool, the JWT secret, what to do on
+startup, and the tuning knobs of everything else (workers, caches, profiling, ...). They're
+read from the environment (and the .env file in the server folder) once, the first
+time get_settings() is called, and the same object is handed out after that:
+
+    from app.config import get_settings
+    settings = get_settings()
+    settings.database_url
+
+Nothing here runs when the module is imported, and the other modules only call
+get_settings() when they need a value, not at import. So importing app modules in scripts
+and benchmarks doesn't need a .env file or a database. main.py and the command line tools
+(python -m app.outbox, app.trending, app.reconcile, app.avatars, app.migrate) call
+get_settings() first thing, so a bad setting fails right at startup.
+"""
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+from dotenv import load_dotenv
+
+
+def env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+@dataclass(frozen=True)
+class Settings:
+    # the secret DB connection string
+    database_url: Optional[str]
+    # can be set on its own, e.g. to pass asyncpg specific options; made from database_url
+    # otherwise (see database.to_async_url)
+    async_database_url: Optional[str]
+    # DB_ASYNC_MODE=1 makes the post routes talk to the database through an asyncio driver
+    # (asyncpg for PostgreSQL, aiosqlite for SQLite) instead of a thread per query.
+    db_async_mode: bool
+
+    # Connection pool settings, used for both engines:
+    # - DB_POOL_SIZE: connections kept open all the time
+    # - DB_MAX_OVERFLOW: extra connections opened under load and closed again afterwards
+    # - DB_POOL_TIMEOUT: seconds a request waits for a free connection before failing
+    # - DB_POOL_RECYCLE: reconnect connections older than this many seconds (-1 = never)
+    # - DB_POOL_PRE_PING: check a connection is still alive before handing it out, so a
+    #   database restart doesn't turn into errors on the first requests afterwards
+    # - DB_POOL_PREWARM: connections to open on startup, so the first requests don't each
+    #   wait for a new connection (0 = open them as requests need them)
+    db_pool_size: int
+    db_max_overflow: int
+    db_pool_timeout: float
+    db_pool_recycle: int
+    db_pool_pre_ping: bool
+    db_pool_prewarm: int
+
+    jwt_secret: Optional[str]
+    jwt_algorithm: Optional[str]
+
+    # AUTO_MIGRATE=0: don't run the migrations on startup, see app/migrate.py
+    auto_migrate: bool
+
+    # Request profiling, see app/profiling.py:
+    # - PROFILING_ENABLED=1: query counts and timings per route, and GET /metrics
+    # - PROFILING_N_PLUS_ONE_THRESHOLD: the same statement this many times in one request is
+    #   logged as a possible N+1
+    # - PROFILING_DUMPS_ENABLED=1 plus a PROFILING_DUMP_TOKEN: requests sent with the header
+    #   "X-Profile: <token>" are profiled with pyinstrument, and the newest
+    #   PROFILING_MAX_DUMPS reports are kept in PROFILING_DUMP_DIR
+    profiling_enabled: bool
+    profiling_n_plus_one_threshold: int
+    profiling_dumps_enabled: bool
+    profiling_dump_token: Optional[str]
+    profiling_dump_dir: str
+    profiling_max_dumps: int
+
+    # Cached JSON responses, see app/response_cache.py: RESPONSE_CACHE_ENABLED=0 turns it
+    # off, RESPONSE_CACHE_URL=redis://... shares it between processes, otherwise each process
+    # keeps up to RESPONSE_CACHE_MAX_SIZE responses; either way for RESPONSE_CACHE_TTL_SECONDS
+    response_cache_enabled: bool
+    response_cache_url: str
+    response_cache_ttl_seconds: float
+    response_cache_max_size: int
+
+    # gzip/brotli for responses of COMPRESSION_MIN_SIZE bytes and up, see app/compression.py;
+    # BROTLI_QUALITY is 0-11, 4 is about as fast as gzip's default and still compresses better
+    compression_enabled: bool
+    compression_min_size: int
+    gzip_level: int
+    brotli_quality: int
+
+    # Avatars, see app/storage.py and app/avatars.py: the biggest upload accepted, how often
+    # the server sweeps unused files (AVATAR_SWEEP_SECONDS=0: never, e.g. when cron runs
+    # python -m app.avatars --sweep), how old an unused file must be before a sweep deletes
+    # it, and the processes making resized copies
+    max_avatar_bytes: int
+    avatar_sweep_seconds: float
+    avatar_sweep_min_age_seconds: float
+    avatar_workers: int
+
+    # likes (or comments) on the same post are merged into one unseen notification for this
+    # long, see app/notifications.py
+    notification_window_hours: float
+
+    # The outbox worker, see app/outbox.py:
+    # - OUTBOX_INLINE_WORKER=0: don't run the worker in the API process
+    # - OUTBOX_BATCH_SIZE: events handled per transaction
+    # - OUTBOX_POLL_SECONDS: how often an idle worker looks for new events (enqueue() wakes
+    #   the inline worker earlier)
+    # - OUTBOX_MAX_ATTEMPTS / OUTBOX_MAX_BACKOFF_SECONDS: retries of a failing event
+    # - OUTBOX_RETENTION_HOURS: processed events are kept this long (handy when debugging)
+    # - FEED_COUNTER_BUMP_SECONDS: how often new like/comment/bookmark counts may make the
+    #   feed's cache and ETags stale
+    outbox_inline_worker: bool
+    outbox_batch_size: int
+    outbox_poll_seconds: float
+    outbox_max_attempts: int
+    outbox_max_backoff_seconds: float
+    outbox_retention_hours: float
+    feed_counter_bump_seconds: float
+
+    # Trending scores, see app/trending.py: TRENDING_DECAY_SECONDS is how much newer a post
+    # must be to need 10 times less engagement, the others how often and how many scores the
+    # refresher redoes at once
+    trending_decay_seconds: float
+    trending_refresh_seconds: float
+    trending_batch_size: int
+
+    # PUBSUB_URL=redis://...: share notifications between processes, see app/pubsub.py;
+    # PUBSUB_QUEUE_SIZE: messages kept for a slow subscriber
+    pubsub_url: str
+    pubsub_queue_size: int
+
+    # The login path, see app/auth.py: the cache of users by token, and the bcrypt threads
+    # (one per CPU core by default) with how many hashes may wait for them
+    user_cache_ttl_seconds: float
+    user_cache_max_size: int
+    bcrypt_workers: int
+    bcrypt_max_pending: int
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        bcrypt_workers = int(os.getenv("BCRYPT_WORKERS", str(os.cpu_count() or 1)))
+        return cls(
+            database_url=os.getenv("DATABASE_URL"),
+            async_database_url=os.getenv("ASYNC_DATABASE_URL"),
+            db_async_mode=env_flag("DB_ASYNC_MODE", "0"),
+            db_pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            db_pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            db_pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            db_pool_pre_ping=env_flag("DB_POOL_PRE_PING", "1"),
+            db_pool_prewarm=int(os.getenv("DB_POOL_PREWARM", "0")),
+            jwt_secret=os.getenv("JWT_SECRET"),
+            jwt_algorithm=os.getenv("JWT_ALGORITHM"),
+            auto_migrate=env_flag("AUTO_MIGRATE", "1"),
+            profiling_enabled=env_flag("PROFILING_ENABLED", "0"),
+            profiling_n_plus_one_threshold=int(os.getenv("PROFILING_N_PLUS_ONE_THRESHOLD", "5")),
+            profiling_dumps_enabled=env_flag("PROFILING_DUMPS_ENABLED", "0"),
+            profiling_dump_token=os.getenv("PROFILING_DUMP_TOKEN"),
+            profiling_dump_dir=os.getenv("PROFILING_DUMP_DIR", "profiles"),
+            profiling_max_dumps=int(os.getenv("PROFILING_MAX_DUMPS", "20")),
+            response_cache_enabled=env_flag("RESPONSE_CACHE_ENABLED", "1"),
+            response_cache_url=os.getenv("RESPONSE_CACHE_URL", ""),
+            response_cache_ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30")),
+            response_cache_max_size=int(os.getenv("RESPONSE_CACHE_MAX_SIZE", "2000")),
+            compression_enabled=env_flag("COMPRESSION_ENABLED", "1"),
+            compression_min_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+            gzip_level=int(os.getenv("GZIP_LEVEL", "6")),
+            brotli_quality=int(os.getenv("BROTLI_QUALITY", "4")),
+            max_avatar_bytes=int(os.getenv("MAX_AVATAR_BYTES", str(5 * 1024 * 1024))),
+            avatar_sweep_seconds=float(os.getenv("AVATAR_SWEEP_SECONDS", "3600")),
+            avatar_sweep_min_age_seconds=float(os.getenv("AVATAR_SWEEP_MIN_AGE_SECONDS", "3600")),
+            avatar_workers=int(os.getenv("AVATAR_WORKERS", "1")),
+            notification_window_hours=float(os.getenv("NOTIFICATION_WINDOW_HOURS", "24")),
+            outbox_inline_worker=env_flag("OUTBOX_INLINE_WORKER", "1"),
+            outbox_batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "100")),
+            outbox_poll_seconds=float(os.getenv("OUTBOX_POLL_SECONDS", "1")),
+            outbox_max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10")),
+            outbox_max_backoff_seconds=float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "300")),
+            outbox_retention_hours=float(os.getenv("OUTBOX_RETENTION_HOURS", "24")),
+            feed_counter_bump_seconds=float(os.getenv("FEED_COUNTER_BUMP_SECONDS", "10")),
+            trending_decay_seconds=float(os.getenv("TRENDING_DECAY_SECONDS", "45000")),
+            trending_refresh_seconds=float(os.getenv("TRENDING_REFRESH_SECONDS", "30")),
+            trending_batch_size=int(os.getenv("TRENDING_BATCH_SIZE", "1000")),
+            pubsub_url=os.getenv("PUBSUB_URL", ""),
+            pubsub_queue_size=int(os.getenv("PUBSUB_QUEUE_SIZE", "100")),
+            user_cache_ttl_seconds=float(os.getenv("USER_CACHE_TTL_SECONDS", "60")),
+            user_cache_max_size=int(os.getenv("USER_CACHE_MAX_SIZE", "10000")),
+            bcrypt_workers=bcrypt_workers,
+            bcrypt_max_pending=int(os.getenv("BCRYPT_MAX_PENDING", str(bcrypt_workers * 4))),
+        )
+
+
+# Loads .env (variables that are already set win) and reads the settings, only the first time
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    load_dotenv()
+    return Settings.from_env()
@@ -1,27 +1,299 @@
+"""
+The database engines and sessions. Nothing connects when this module is imported: the
+engines are created the first time something needs them (get_engine(), or the old
+module attributes database.engine / database.SessionLocal, which still work), with the
+settings from app/config.py. main.py's lifespan then opens DB_POOL_PREWARM connections on
+startup (prewarm_pools) and closes everything on shutdown (dispose_engines).
+"""
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-import os
-from dotenv import load_dotenv
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+import contextlib
+import threading
+import time
+from typing import Any
+from .config import get_settings
 
-# Load environment variables from .env file
-load_dotenv()
-# saving the secret DB connection string into a python variable
-DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Create SQLAlchemy engine that creates a connection to your database
-engine = create_engine(DATABASE_URL)
+# Turns "postgresql://..." into "postgresql+asyncpg://..." (and sqlite into sqlite+aiosqlite)
+def to_async_url(url: str) -> str:
+    if url.startswith("postgresql://") or url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
 
-# Create session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+"""
+Keeps track of how long requests wait to get a connection out of the pool.
+If the wait grows, the pool is too small for the load (or queries hold connections too long).
+"""
+class CheckoutTimingMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._timing_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    # _do_get is where QueuePool waits for a free connection (or opens a new one)
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._timing_lock:
+                self.checkout_timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._timing_lock:
+                self.checkouts += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+
+class TimedQueuePool(CheckoutTimingMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# Pool arguments for create_engine/create_async_engine (see the DB_POOL_* settings in
+# app/config.py). SQLite opens connections to a local file (or memory), so it keeps
+# SQLAlchemy's default pool for it.
+def pool_options(url: str, poolclass) -> dict:
+    if url.startswith("sqlite"):
+        return {}
+    settings = get_settings()
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+_engine = None
+_session_factory = None
+_async_engine = None
+_async_session_factory = None
+_engines_lock = threading.Lock()
+
+# Create SQLAlchemy engine that creates a connection to your database (the first time only)
+def get_engine():
+    global _engine, _session_factory
+    if _engine is None:
+        with _engines_lock:
+            if _engine is None:
+                url = get_settings().database_url
+                if not url:
+                    raise RuntimeError("DATABASE_URL is not set (in the environment or in server/.env)")
+                engine = create_engine(url, **pool_options(url, TimedQueuePool))
+                _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                _engine = engine
+    return _engine
+
+def get_session_factory():
+    get_engine()
+    return _session_factory
+
+# The async engine is only created in async mode, so the asyncio extras (greenlet and the
+# asyncpg/aiosqlite drivers) stay optional. Returns None when DB_ASYNC_MODE is off.
+# expire_on_commit=False keeps the loaded values of objects after commit, since an
+# AsyncSession can't reload them lazily when a response reads them.
+def get_async_engine():
+    global _async_engine, _async_session_factory
+    settings = get_settings()
+    if not settings.db_async_mode:
+        return None
+    if _async_engine is None:
+        with _engines_lock:
+            if _async_engine is None:
+                from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+                url = settings.async_database_url or to_async_url(settings.database_url)
+                engine = create_async_engine(url, **pool_options(url, TimedAsyncQueuePool))
+                _async_session_factory = sessionmaker(
+                    bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+                )
+                _async_engine = engine
+    return _async_engine
+
+def get_async_session_factory():
+    if get_async_engine() is None:
+        return None
+    return _async_session_factory
+
+
+# engine, SessionLocal, async_engine and AsyncSessionLocal used to be made when this module
+# was imported, and a lot of code uses them as `database.engine` etc. Looking them up now
+# creates them on first use (a module level __getattr__ runs for names the module doesn't have).
+_LAZY_ATTRIBUTES = {
+    "engine": get_engine,
+    "SessionLocal": get_session_factory,
+    "async_engine": get_async_engine,
+    "AsyncSessionLocal": get_async_session_factory,
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+"""
+Opens `count` connections of each engine at once and hands them back to the pool, so they
+are there, logged in and checked, when the first requests come in. Without this every worker
+opens its connections one by one during its first requests, each one costing a network round
+trip or several (plus TLS and authentication with a remote PostgreSQL).
+At most pool_size connections stay open, the pool closes any extra ones again.
+"""
+def prewarm_pool(count: int) -> int:
+    engine = get_engine()
+    pool_size = engine.pool.size() if isinstance(engine.pool, QueuePool) else count
+    count = min(count, pool_size)
+    with contextlib.ExitStack() as stack:
+        for _ in range(count):
+            stack.enter_context(engine.connect())
+    return count
+
+async def prewarm_async_pool(count: int) -> int:
+    engine = get_async_engine()
+    if engine is None:
+        return 0
+    pool = engine.sync_engine.pool
+    count = min(count, pool.size() if isinstance(pool, QueuePool) else count)
+    async with contextlib.AsyncExitStack() as stack:
+        for _ in range(count):
+            await stack.enter_async_context(engine.connect())
+    return count
+
+async def prewarm_pools(count: int):
+    await run_in_threadpool(prewarm_pool, count)
+    await prewarm_async_pool(count)
+
+
+# Closes the pooled connections (on shutdown). The engines stay usable and reconnect if used again.
+async def dispose_engines():
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+
+
+# What the pool of an engine is doing right now, for /api/status
+def pool_stats(pool) -> dict:
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            # negative while fewer than pool_size connections have been opened so far
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+        })
+    if isinstance(pool, CheckoutTimingMixin):
+        with pool._timing_lock:
+            stats.update({
+                "checkouts": pool.checkouts,
+                "checkout_timeouts": pool.checkout_timeouts,
+                "avg_checkout_wait_ms": round(pool.total_wait / pool.checkouts * 1000, 3) if pool.checkouts else 0.0,
+                "max_checkout_wait_ms": round(pool.max_wait * 1000, 3),
+            })
+    return stats
+
+def pool_status() -> dict:
+    status = {"sync": pool_stats(get_engine().pool)}
+    async_engine = get_async_engine()
+    if async_engine is not None:
+        status["async"] = pool_stats(async_engine.sync_engine.pool)
+    return status
 
 # Base class for all models
 Base = declarative_base()
 
 # Dependency to get DB session
 def get_db():
-    db = SessionLocal()
+    db = get_session_factory()()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+"""
+Gives a normal (blocking) Session the same `await db.execute(...)` interface as AsyncSession.
+Every call that talks to the database runs on FastAPI's thread pool, so `async def` routes
+can use it without blocking the event loop. This is what get_async_db hands out when
+DB_ASYNC_MODE is off, so the async routes work the same way in both modes.
+"""
+class ThreadedSession:
+    def __init__(self, session):
+        self.sync_session = session
+
+    @property
+    def bind(self):
+        return self.sync_session.bind
+
+    # add/add_all only mark objects for saving, they don't touch the database
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, statement, params, **kwargs)
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params, **kwargs)
+
+    async def scalars(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalars, statement, params, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+# What get_async_db hands out: an AsyncSession or a ThreadedSession, which have the same
+# awaitable methods. Used to annotate `db` in the async routes.
+AsyncDB = Any
+
+# A new AsyncSession in async mode, otherwise a ThreadedSession. The caller must close it.
+def new_async_session():
+    async_session_factory = get_async_session_factory()
+    if async_session_factory is not None:
+        return async_session_factory()
+    return ThreadedSession(get_session_factory()(expire_on_commit=False))
+
+# Dependency for the async routes: an AsyncSession in async mode, otherwise a ThreadedSession
+async def get_async_db():
+    db = new_async_session()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
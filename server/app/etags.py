@@ -0,0 +1,119 @@
+"""
+Weak ETags and conditional GETs for the JSON endpoints the mobile client keeps reloading, so
+an unchanged response costs a 304 Not Modified instead of the whole body again:
+
+    GET /posts/?limit=20                          -> 200, ETag: W/"5c0f..."
+    GET /posts/?limit=20  If-None-Match: W/"5c0f..."  -> 304, no body
+
+Each ETag is made from a cheap "version marker" of what the response shows, read with one
+small query, so a 304 is answered before the response's real query runs:
+- GET /posts/: the "posts" row of content_versions (models.ContentVersion), one primary key
+  lookup. Everything that changes the feed bumps it in its own transaction (bump_version);
+  like, comment and bookmark counts at most every FEED_COUNTER_BUMP_SECONDS (app/outbox.py).
+- GET /posts/{post_id}/comments: how many comments the post has and the highest comment id.
+  Comments are never edited, only added (or removed together with their post).
+- GET /posts/notifications: the user's own "notifications:<user_id>" row of content_versions,
+  bumped by everything that changes their list (bump_notifications): a new notification, a
+  like or comment joining one, marking some as seen, and deleting a post, which takes its
+  notifications with it. A version only ever goes up, so an old ETag never matches again,
+  even after the unseen ones are back to what they were.
+- GET /me/profile: that's a single primary key lookup already, so its ETag is just a hash of
+  the body and a 304 only saves the download.
+
+The marker is hashed together with the response model's schema, so a release that changes
+the response format doesn't answer 304 for copies in the old format. The ETags are weak
+(W/"...") because app/compression.py may send the same content as different bytes.
+"""
+import hashlib
+import json
+from typing import Optional
+from fastapi.responses import Response
+from sqlalchemy import func, select, update
+from . import models, upsert
+
+FEED = "posts"
+# answers with an ETag have to be checked with the server before they are reused
+PUBLIC_CACHE_CONTROL = "no-cache"
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+
+# UPDATE content_versions SET version = version + 1 WHERE name = 'posts'. Run it in the same
+# transaction as the change (await db.execute(...) in the async routes).
+def bump_version(name: str = FEED):
+    table = models.ContentVersion.__table__
+    return (
+        update(table)
+        .where(table.c.name == name)
+        .values(version=table.c.version + 1)
+    )
+
+
+def schema_fingerprint(*response_models) -> str:
+    schemas_json = json.dumps([model.schema() for model in response_models], sort_keys=True)
+    return hashlib.sha1(schemas_json.encode("utf-8")).hexdigest()[:12]
+
+
+def weak_etag(*parts) -> str:
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def body_etag(body: bytes) -> str:
+    return 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+# If-None-Match can list several ETags or be "*"; weak comparison ignores the W/ prefix.
+# Also used for the avatar files in app/static.py.
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    wanted = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == wanted:
+            return True
+    return False
+
+
+def headers(etag: str, private: bool = False) -> dict:
+    return {"ETag": etag, "Cache-Control": PRIVATE_CACHE_CONTROL if private else PUBLIC_CACHE_CONTROL}
+
+
+def not_modified(etag: str, private: bool = False) -> Response:
+    return Response(status_code=304, headers=headers(etag, private))
+
+
+# The version markers, see the top of this file
+
+async def feed_version(db) -> int:
+    result = await db.execute(select(models.ContentVersion.version).where(models.ContentVersion.name == FEED))
+    return result.scalar() or 0
+
+
+# (comment count, highest comment id), or None if the post doesn't exist
+async def comments_marker(db, post_id: int):
+    Comment = models.Comment
+    count = select(func.count()).select_from(Comment).where(Comment.post_id == post_id).scalar_subquery()
+    last_id = select(func.max(Comment.id)).where(Comment.post_id == post_id).scalar_subquery()
+    result = await db.execute(select(count, last_id).where(
+        select(models.Post.id).where(models.Post.id == post_id).exists()
+    ))
+    row = result.first()
+    return tuple(row) if row is not None else None
+
+
+def notifications_key(user_id: int) -> str:
+    return f"notifications:{user_id}"
+
+
+# Adds 1 to the user's notifications version, in the caller's transaction. The row is created
+# the first time, so it's an upsert (app/upsert.py) instead of bump_version's UPDATE.
+async def bump_notifications(db, user_id: int):
+    await upsert.increment(db, models.ContentVersion, {"name": notifications_key(user_id)}, version=1)
+
+
+async def notifications_marker(db, user_id: int) -> int:
+    result = await db.execute(
+        select(models.ContentVersion.version).where(models.ContentVersion.name == notifications_key(user_id))
+    )
+    return result.scalar() or 0
@@ -0,0 +1,122 @@
+"""
+Runs the Alembic migrations in server/migrations, which replace Base.metadata.create_all().
+
+main.py's lifespan calls upgrade_to_head() on startup when AUTO_MIGRATE is on (the default,
+see app/config.py), so a fresh database gets the whole schema and an existing one gets the
+migrations it is missing.
+With several server processes, or when deploys should migrate in a separate step, set
+AUTO_MIGRATE=0 and run from the server folder:
+
+    python -m app.migrate
+
+A database that was created by the old create_all() call has the tables but no
+alembic_version, and misses everything added to the models since: the like/comment/bookmark
+counters and hot_score on posts, newer tables like user_stats, and the indexes. Marking it
+with `alembic stamp head` would leave all of that out, and `alembic upgrade head` would
+fail on tables that exist already. So upgrade_to_head() first brings such a database up to
+date itself (adopt_create_all_database) and stamps it; from then on it's upgraded like any
+other. Once a database has alembic_version, plain `alembic upgrade head` does the same as
+python -m app.migrate.
+"""
+import logging
+import os
+from alembic import command
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import Session
+from . import models, database, etags, reconcile, trending
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# The revision whose schema is all in app/models.py. adopt_create_all_database() makes the
+# database look like it and stamps it; the migrations after it add what the models don't
+# have (0004: the search column on PostgreSQL) and run as usual. Move it up when a
+# migration only brings the database in line with the models again.
+ADOPTED_REVISION = "0003"
+
+# server/alembic.ini
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+
+def alembic_config() -> Config:
+    config = Config(ALEMBIC_INI)
+    # keep the server's own logging setup
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def upgrade_to_head():
+    engine = database.get_engine()
+    if is_create_all_database(engine):
+        adopt_create_all_database(engine)
+    command.upgrade(alembic_config(), "head")
+
+
+# Tables but no alembic_version: made by create_all() before there were migrations
+def is_create_all_database(engine) -> bool:
+    tables = set(inspect(engine).get_table_names())
+    return "users" in tables and "alembic_version" not in tables
+
+
+"""
+Adds the tables, columns and indexes of app/models.py that the database doesn't have, and the
+feed's content_versions row (migration 0002 adds it), then stamps the database with
+ADOPTED_REVISION.
+The new counters start at 0, so they are filled in from the rows afterwards, the same way
+python -m app.reconcile and python -m app.trending --all do.
+On PostgreSQL, old columns whose type has changed since (users.name and notifications.type
+used to be integers) get the models' type. SQLite doesn't hold a column to its type, so
+there they're left alone. The foreign keys of the old tables keep no ON DELETE CASCADE;
+delete_post deletes a post's likes, comments, notifications and bookmarks itself.
+"""
+def adopt_create_all_database(engine):
+    logger.warning("The database was made by create_all(), adding what it misses before migrating")
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        operations = Operations(MigrationContext.configure(connection))
+        for table in models.Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                table.create(connection)
+                continue
+            columns = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    operations.add_column(table.name, column._copy())
+                elif connection.dialect.name == "postgresql" and type_changed(columns[column.name], column.type):
+                    new_type = column.type.compile(dialect=connection.dialect)
+                    operations.alter_column(
+                        table.name, column.name, type_=column.type, existing_type=columns[column.name],
+                        postgresql_using=f"{column.name}::{new_type}",
+                    )
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+
+        versions = models.ContentVersion.__table__
+        if connection.scalar(select(versions.c.name).where(versions.c.name == etags.FEED)) is None:
+            connection.execute(versions.insert().values(name=etags.FEED, version=0))
+    command.stamp(alembic_config(), ADOPTED_REVISION)
+
+    with Session(engine) as db:
+        reconcile.reconcile_post_counters(db)
+        reconcile.reconcile_user_stats(db)
+        trending.refresh_stale_scores(db, everything=True)
+
+
+# Compares what the values are in Python, so e.g. VARCHAR and TEXT count as the same
+def type_changed(old_type, new_type) -> bool:
+    try:
+        return old_type.python_type is not new_type.python_type
+    except NotImplementedError:
+        return False
+
+
+if __name__ == "__main__":
+    # loads .env (DATABASE_URL), like main.py does for the API
+    get_settings()
+    logging.basicConfig(level=logging.INFO)
+    upgrade_to_head()
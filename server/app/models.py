@@ -1,5 +1,5 @@
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, ForeignKey, PrimaryKeyConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import func, Column, String, Integer, Boolean, DateTime, Text, ForeignKey, PrimaryKeyConstraint, Index, JSON, Float, Date, true
+from sqlalchemy.orm import relationship, backref
 from .database import Base
 from datetime import datetime
 
@@ -17,12 +17,15 @@ class User(Base):
     email = Column(String, unique=True, nullable=False, index=True)
     username = Column(String, unique=True, nullable=False)
     password = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
     
-    name = Column(Integer, nullable= True)
+    name = Column(String, nullable= True)
     bio = Column(Text, nullable=True)
     favourite_genre = Column (String , nullable = True)
     avatar_url = Column (String, nullable = True)
+    # URLs of the resized copies of the avatar, filled in the background by app/avatars.py
+    # {"64": {"webp": url, "jpeg": url}, "128": {...}, "256": {...}}, NULL until they are ready
+    avatar_variants = Column (JSON(none_as_null=True), nullable = True)
     # links the user to all the posts made by him, by going to Post class. 
     posts = relationship("Post", back_populates="owner")
 
@@ -41,6 +44,16 @@ class Post(Base):
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     visibility = Column(String, nullable=False, default="public")
+    # Running totals kept up to date by the outbox worker (app/outbox.py), so feeds and
+    # analytics can read them straight from the post instead of counting rows every time.
+    # app/reconcile.py can recompute them from the PostLike/Comment/PostBookmark tables.
+    like_count = Column(Integer, nullable=False, default=0, server_default="0")
+    comment_count = Column(Integer, nullable=False, default=0, server_default="0")
+    bookmark_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Ranking for sort=trending, computed from the counters above by app/trending.py.
+    # hot_score_stale is set when the counters change and cleared once the score is redone.
+    hot_score = Column(Float, nullable=False, default=0, server_default="0")
+    hot_score_stale = Column(Boolean, nullable=False, default=True, server_default=true())
     #  Links this post to the user who created it
     owner_id = Column(Integer, ForeignKey("users.id"))
     """
@@ -50,15 +63,35 @@ class Post(Base):
     """
     owner = relationship("User", back_populates="posts")
 
+    # Serves the public feed pages: filter on visibility, then walk (created_at, id) in order
+    # for keyset pagination (see app/pagination.py) without sorting the whole table.
+    # The trending feed walks hot_score the same way, and the refresh job only looks at the
+    # (few) stale posts. "My posts" walks one owner's posts the same way.
+    __table_args__ = (
+        Index("ix_posts_visibility_created_at_id", "visibility", "created_at", "id"),
+        Index("ix_posts_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        Index("ix_posts_visibility_hot_score_id", "visibility", "hot_score", "id"),
+        Index(
+            "ix_posts_hot_score_stale", "id",
+            postgresql_where=(hot_score_stale == True),
+            sqlite_where=(hot_score_stale == True),
+        ),
+    )
+
 # New table in the PostgreSQL database, that connects the user and the post, if its liked by the user
 class PostLike(Base):
-    _tablename_ = "post_likes"
+    __tablename__ = "post_likes"
     # both user and post _id create many-to-one relation with User and Post model repectively. 
     user_id = Column(Integer, ForeignKey("users.id"))
-    post_id = Column(Integer, ForeignKey("posts.id"))
+    # ondelete="CASCADE": deleting a post deletes its likes, comments, notifications and
+    # bookmarks in the database too (see delete_post in app/routes/post.py)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"))
     # prevents duplicates,a user can only like a specific post once
+    # The primary key starts with user_id, which serves "did I like these posts?". Counting or
+    # listing the likes of one post needs post_id first, hence the second index.
     __table_args__ = (
         PrimaryKeyConstraint("user_id", "post_id"),
+        Index("ix_post_likes_post_id_user_id", "post_id", "user_id"),
     )
     # This also adds a new property to the User Model, i.e. user.liked_posts which gives all 
     # the likes that user had made. 
@@ -66,20 +99,23 @@ class PostLike(Base):
 
     # This also adds a new property to the Post Model, i.e. post.likes whihc is a list of all 
     # PostLike objects pointing to this post.
-    post = relationship("Post", backref="likes")
+    # passive_deletes=True leaves them to the database's ON DELETE CASCADE when a post is
+    # deleted, instead of loading them all to set their post_id to NULL (which fails, it's
+    # part of the primary key). The other backrefs to Post below do the same.
+    post = relationship("Post", backref=backref("likes", cascade="all, delete-orphan", passive_deletes=True))
 
 
 
 class Comment(Base): 
     # name of the table in database
-    _tablename_ = "comments"
+    __tablename__ = "comments"
     # comment's features
     id = Column (Integer, primary_key=True, index = True)
     content = Column (Text, nullable = False)
     created_at = Column (DateTime, default= datetime.utcnow)
     # connecting the comment to the post, and the user
     user_id = Column (Integer, ForeignKey("users.id"), nullable = False)
-    post_id = Column (Integer, ForeignKey("posts.id"), nullable=False)
+    post_id = Column (Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False)
     
     """
     - sets up relation between the Comment model and the User, Post modal 
@@ -89,34 +125,148 @@ class Comment(Base):
     So, backref creates the reverse property automatically.
     """
     user = relationship ("User" , backref= "comments")
-    post = relationship ("Post", backref= "comments")
+    post = relationship ("Post", backref= backref("comments", cascade="all, delete-orphan", passive_deletes=True))
+
+    # the comments of a post, oldest first (and keyset pages of them)
+    __table_args__ = (
+        Index("ix_comments_post_id_created_at_id", "post_id", "created_at", "id"),
+    )
 
 
 
 class Notification(Base): 
-    _tablename_ = "notifications"
+    __tablename__ = "notifications"
 
     id = Column(Integer, primary_key= True, index = True)
     # user id of the post owner who will receive the notification
-    user_id = Column(Integer, ForeignKey  = "users.id", nullable= False)
-    post_id = Column(Integer, ForeignKey  = "posts.id", nullable= False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable= False)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable= False)
     # maybe like or comment
-    type = Column(Integer, nullable= False)
+    type = Column(String, nullable= False)
     # whether the user has read the notification
     seen = Column(Boolean, default= False)
     created_at = Column(DateTime, default = datetime.utcnow)
+    # Likes/comments on the same post within NOTIFICATION_WINDOW_HOURS are merged into one
+    # notification ("12 people liked your post"), see app/notifications.py.
+    # actor_count is how many different people it stands for, updated_at when the last joined.
+    actor_count = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, default = datetime.utcnow)
 
     user = relationship("User", backref="notifications")
-    post = relationship("Post", backref="notifications")
+    post = relationship("Post", backref=backref("notifications", cascade="all, delete-orphan", passive_deletes=True))
+
+    # Partial index over just the unseen notifications, which is all the unseen count, the
+    # coalescing lookup and "mark as seen" ever need to look at. Seen rows, the vast
+    # majority over time, don't make it any bigger.
+    # The other one serves the user's notification list, newest first.
+    __table_args__ = (
+        Index("ix_notifications_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index(
+            "ix_notifications_user_id_seen", "user_id", "seen",
+            postgresql_where=(seen == False),
+            sqlite_where=(seen == False),
+        ),
+    )
+
+
+# Who is behind each coalesced notification, so the same person liking, unliking and liking
+# again is only counted once.
+class NotificationActor(Base):
+    __tablename__ = "notification_actors"
+
+    notification_id = Column(Integer, ForeignKey("notifications.id", ondelete="CASCADE"), nullable=False)
+    actor_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("notification_id", "actor_id"),
+    )
+
+
+"""
+Running totals for GET /me/analytics, one row per user, so the endpoint reads a single row
+instead of counting posts, likes and bookmarks on every call. Kept up to date by the outbox
+worker (app/outbox.py); app/reconcile.py can rebuild them from scratch.
+"""
+class UserStats(Base):
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    post_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # likes on this user's posts
+    likes_received = Column(Integer, nullable=False, default=0, server_default="0")
+    # posts this user has bookmarked
+    bookmark_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+# New likes each user's posts got per day (UTC), for the likes_per_day series of
+# /me/analytics. Unlikes later on don't change past days.
+class UserDailyStats(Base):
+    __tablename__ = "user_daily_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    day = Column(Date, nullable=False)
+    likes_received = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        PrimaryKeyConstraint("user_id", "day"),
+    )
+
+
+"""
+Version numbers of things that change often, for the ETags of GET /posts/ (see app/etags.py).
+"posts" goes up in the same transaction as any change to what the feed shows: a post being
+created, edited or deleted, its counters changing or its trending score being redone.
+So a client's ETag can be checked with one primary key lookup instead of the feed query.
+"""
+class ContentVersion(Base):
+    __tablename__ = "content_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+"""
+Side effects of a write that don't have to happen inside the request (notifications,
+counters, ...). A route saves one OutboxEvent in the same transaction as the write itself,
+so the event exists exactly when the write does, and app/outbox.py carries it out later.
+"""
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True)
+    # what happened, e.g. "like.created", which picks the handler in app/outbox.py
+    topic = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # not picked up before this time, pushed back after every failed attempt
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    last_error = Column(Text, nullable=True)
+    # set once the handler has run, NULL while the event is waiting
+    processed_at = Column(DateTime, nullable=True)
+
+    # the worker only ever looks for waiting events, oldest first
+    __table_args__ = (
+        Index(
+            "ix_outbox_events_pending", "available_at", "id",
+            postgresql_where=processed_at.is_(None),
+            sqlite_where=processed_at.is_(None),
+        ),
+    )
 
 
 class PostBookmark(Base): 
-    _tablename_ = "post_bookmarks" 
+    __tablename__ = "post_bookmarks" 
 
-    user_id = Column(Integer, ForeignKey = "users.id", nullable = False)
-    post_id = Column (Integer, ForeignKey = "posts.id", nullable= False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable = False)
+    post_id = Column (Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable= False)
     created_at = Column (DateTime, default=datetime.utcnow)
+    # a user can bookmark a post only once; starting with user_id it also serves "my bookmarks"
+    __table_args__ = (
+        PrimaryKeyConstraint("user_id", "post_id"),
+        Index("ix_post_bookmarks_post_id", "post_id"),
+    )
     # From the User model, I can now access all posts this user has bookmarked.
     user = relationship("User", backref="bookmarked_posts")
     # The backref="bookmarked_by" creates a way to get all users who have bookmarked a given post
-    post = relationship("Post", backref="bookmarked_by")
+    post = relationship("Post", backref=backref("bookmarked_by", cascade="all, delete-orphan", passive_deletes=True))
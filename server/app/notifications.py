@@ -0,0 +1,84 @@
+"""
+Live notifications. Every user has a pub/sub channel (see app/pubsub.py); when a
+notification is saved it is also published there, and GET /posts/notifications/stream
+forwards it to the user's open connections right away, so the app doesn't need to poll
+GET /posts/notifications to find out about new likes and comments.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select
+from . import models, schemas, pubsub, database, etags
+from .config import get_settings
+
+# seconds between the comment lines the stream sends to keep idle connections (and the
+# proxies in between) from timing out
+HEARTBEAT_SECONDS = 15
+
+
+"""
+Records that `actor_id` liked or commented on (`type`) the post `post_id` of user `user_id`.
+Instead of a new row every time, it joins the user's unseen notification of the same type
+for that post if one was started in the last NOTIFICATION_WINDOW_HOURS, and bumps its
+actor_count, so a popular post gives one "12 people liked your post" notification.
+Each person is only counted once per notification (see models.NotificationActor), so liking
+and unliking over and over no longer piles up notifications.
+
+Runs inside the caller's transaction. Returns the notification that was created or changed,
+to publish once committed, or None when this person was already counted.
+"""
+async def notify(db: database.AsyncDB, user_id: int, post_id: int, actor_id: int, type: str) -> Optional[models.Notification]:
+    now = datetime.utcnow()
+    result = await db.execute(
+        select(models.Notification)
+        .where(
+            models.Notification.user_id == user_id,
+            models.Notification.seen == False,
+            models.Notification.post_id == post_id,
+            models.Notification.type == type,
+            models.Notification.created_at >= now - timedelta(hours=get_settings().notification_window_hours),
+        )
+        .order_by(models.Notification.id.desc())
+        .limit(1)
+    )
+    notification = result.scalars().first()
+
+    if notification is None:
+        notification = models.Notification(
+            user_id=user_id, post_id=post_id, type=type, seen=False,
+            actor_count=1, created_at=now, updated_at=now
+        )
+        db.add(notification)
+        # gives the notification its id, needed for the actor row below
+        await db.flush()
+    else:
+        already_counted = await db.get(models.NotificationActor, (notification.id, actor_id))
+        if already_counted is not None:
+            return None
+        notification.actor_count += 1
+        notification.updated_at = now
+
+    db.add(models.NotificationActor(notification_id=notification.id, actor_id=actor_id))
+    # the session doesn't autoflush, and db.get above only finds the actor rows that are
+    # flushed, so a second event of the same actor in the outbox batch would insert it again
+    await db.flush()
+    # changes the ETag of the user's GET /posts/notifications (app/etags.py)
+    await etags.bump_notifications(db, user_id)
+    return notification
+
+
+def channel_for(user_id: int) -> str:
+    return f"notifications:{user_id}"
+
+
+# One notification in the text/event-stream format, using its id as the event id so a
+# client that reconnects can tell which ones it has already seen
+def format_event(notification: models.Notification) -> str:
+    data = schemas.NotificationOut.from_orm(notification).json()
+    return f"event: notification\nid: {notification.id}\ndata: {data}\n\n"
+
+
+# Sends a saved notification to its receiver's stream. Call it after the commit, so clients
+# never hear about a notification that then gets rolled back.
+# The message is published already formatted, so the streams just write it out.
+async def publish_notification(notification: models.Notification):
+    await pubsub.get_broker().publish(channel_for(notification.user_id), format_event(notification))
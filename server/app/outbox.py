@@ -0,0 +1,414 @@
+"""
+The outbox: side effects of posts, likes, comments and bookmarks, done after the request.
+
+Routes only make the change the user asked for (e.g. insert the PostLike row) and, in the
+same transaction, save an OutboxEvent describing it with enqueue(). The worker below then
+picks the events up in batches and runs their handler: bumping the post's counters and the
+owner's user_stats, creating or coalescing the notification and publishing it to the
+user's stream.
+So a like costs one small INSERT more instead of every side effect we add over time.
+
+- Handlers are idempotent: an event is marked processed in the same transaction as its
+  handler's changes, so it is never applied twice, even if the worker dies halfway.
+- A failing event is retried later with exponential backoff (up to OUTBOX_MAX_ATTEMPTS
+  times) without holding up the events behind it.
+- queue_stats() reports how many events are waiting and how old the oldest one is
+  (the lag), shown in /api/status.
+
+The worker runs inside the API process by default (started in main.py). To run it as a
+separate process instead, set OUTBOX_INLINE_WORKER=0 for the API and start, from the
+server folder:
+
+    python -m app.outbox
+
+Several workers can run at once against PostgreSQL: each batch is claimed with
+FOR UPDATE SKIP LOCKED.
+"""
+import asyncio
+import inspect
+import logging
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func
+from . import models, database, notifications, response_cache, upsert, etags
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# the OUTBOX_* and FEED_COUNTER_BUMP_SECONDS knobs are in app/config.py
+
+
+# Saves an event in the caller's transaction. It is carried out once the caller commits.
+def enqueue(db, topic: str, **payload):
+    db.add(models.OutboxEvent(topic=topic, payload=payload))
+
+
+# topic -> handler, filled in by the @handler decorator below
+HANDLERS = {}
+
+"""
+Registers `func` as the handler of `topic`. Handlers are called as
+    await func(db, payload, after_commit)
+and make their changes in `db` without committing. Anything that must only happen once the
+changes are saved (like publishing to a stream) goes into the `after_commit` list as a
+function without arguments, plain or async (run_after_commit awaits what it returns).
+"""
+def handler(topic: str):
+    def register(func):
+        HANDLERS[topic] = func
+        return func
+    return register
+
+
+# Adds `amount` to one of the post's counters (like_count, comment_count, bookmark_count).
+# This runs as a single "UPDATE posts SET x = x + 1", so two events for the same post
+# can't overwrite each other's count.
+# The new count shows up in the feed, so its cached pages are made stale (see
+# bump_feed_for_counters), and it changes the post's trending score, which app/trending.py
+# redoes shortly after.
+# Returns False if the post has been deleted since, then the handler has nothing left to do.
+async def bump_post_counter(db: database.AsyncDB, post_id: int, counter, after_commit: list, amount: int = 1) -> bool:
+    result = await db.execute(
+        update(models.Post)
+        .where(models.Post.id == post_id)
+        .values({counter: counter + amount, models.Post.hot_score_stale: True})
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        return False
+    await bump_feed_for_counters(db, after_commit)
+    return True
+
+
+"""
+A busy site changes some count every few seconds, and each change would make every cached
+feed page (and its ETag, app/etags.py) stale. So changed counts bump the feed's version at
+most once every FEED_COUNTER_BUMP_SECONDS, and the counts in a cached page can be that much
+behind. A change that comes too soon is remembered, and flush_counter_bump() in the worker
+loop bumps the version once the time is up, so the last changes are never left out.
+New, edited and deleted posts don't wait: their routes bump the version right away.
+"""
+_last_counter_bump = 0.0
+_counter_bump_pending = False
+
+async def bump_feed_for_counters(db, after_commit: list):
+    global _last_counter_bump, _counter_bump_pending
+    now = time.monotonic()
+    if now - _last_counter_bump < get_settings().feed_counter_bump_seconds:
+        _counter_bump_pending = True
+        return
+    _last_counter_bump, _counter_bump_pending = now, False
+    await db.execute(etags.bump_version())
+    after_commit.append(response_cache.bump_posts)
+
+async def flush_counter_bump(db):
+    if not _counter_bump_pending or time.monotonic() - _last_counter_bump < get_settings().feed_counter_bump_seconds:
+        return
+    after_commit = []
+    await bump_feed_for_counters(db, after_commit)
+    await db.commit()
+    await run_after_commit(after_commit)
+
+
+async def notify_owner(db, payload: dict, type: str, after_commit: list):
+    # nobody gets notified about their own likes and comments
+    if payload["user_id"] == payload["owner_id"]:
+        return
+    notification = await notifications.notify(db, payload["owner_id"], payload["post_id"], payload["user_id"], type)
+    if notification is not None:
+        after_commit.append(lambda: notifications.publish_notification(notification))
+
+
+# Adds to the user's totals in user_stats (see models.UserStats)
+async def bump_user_stats(db, user_id: int, **increments):
+    await upsert.increment(db, models.UserStats, {"user_id": user_id}, **increments)
+
+
+@handler("post.created")
+async def handle_post_created(db, payload: dict, after_commit: list):
+    await bump_user_stats(db, payload["owner_id"], post_count=1)
+
+
+"""
+The post's likes no longer count towards its owner's total once it's gone, and the people who
+had bookmarked it have one bookmark less.
+like_count is the count the post had when it was deleted, so it covers the like events
+handled before that; like and comment events of the post still waiting in the queue are
+skipped (their bump_post_counter finds no post). bookmarked_by are the bookmarks that
+existed at that moment, so bookmark events still waiting do change their user's total:
+a bookmark.created undoes the -1 below, and a bookmark.deleted is for a bookmark that
+wasn't in bookmarked_by.
+"""
+@handler("post.deleted")
+async def handle_post_deleted(db, payload: dict, after_commit: list):
+    await bump_user_stats(db, payload["owner_id"], post_count=-1, likes_received=-payload["like_count"])
+    for user_id in payload.get("bookmarked_by", []):
+        await bump_user_stats(db, user_id, bookmark_count=-1)
+
+
+@handler("like.created")
+async def handle_like_created(db, payload: dict, after_commit: list):
+    if not await bump_post_counter(db, payload["post_id"], models.Post.like_count, after_commit):
+        return
+    await bump_user_stats(db, payload["owner_id"], likes_received=1)
+    await upsert.increment(
+        db, models.UserDailyStats,
+        {"user_id": payload["owner_id"], "day": payload["event_time"].date()},
+        likes_received=1,
+    )
+    # the like may already be gone again by the time we get here, no need to tell anyone then
+    like = await db.get(models.PostLike, (payload["user_id"], payload["post_id"]))
+    if like is not None:
+        await notify_owner(db, payload, "like", after_commit)
+
+
+@handler("like.deleted")
+async def handle_like_deleted(db, payload: dict, after_commit: list):
+    if not await bump_post_counter(db, payload["post_id"], models.Post.like_count, after_commit, -1):
+        return
+    await bump_user_stats(db, payload["owner_id"], likes_received=-1)
+
+
+@handler("comment.created")
+async def handle_comment_created(db, payload: dict, after_commit: list):
+    if not await bump_post_counter(db, payload["post_id"], models.Post.comment_count, after_commit):
+        return
+    await notify_owner(db, payload, "comment", after_commit)
+
+
+@handler("bookmark.created")
+async def handle_bookmark_created(db, payload: dict, after_commit: list):
+    await bump_post_counter(db, payload["post_id"], models.Post.bookmark_count, after_commit)
+    await bump_user_stats(db, payload["user_id"], bookmark_count=1)
+
+
+@handler("bookmark.deleted")
+async def handle_bookmark_deleted(db, payload: dict, after_commit: list):
+    await bump_post_counter(db, payload["post_id"], models.Post.bookmark_count, after_commit, -1)
+    await bump_user_stats(db, payload["user_id"], bookmark_count=-1)
+
+
+async def run_handler(db, event: models.OutboxEvent, after_commit: list):
+    func = HANDLERS.get(event.topic)
+    if func is None:
+        raise LookupError(f"No outbox handler for {event.topic!r}")
+    # handlers get when the event happened as payload["event_time"], e.g. for daily rollups
+    await func(db, dict(event.payload, event_time=event.created_at), after_commit)
+
+
+# Counters since the worker started, for /api/status
+worker_stats = {
+    "processed": 0,
+    "failed_attempts": 0,
+    "batches": 0,
+    "last_batch_at": None,
+}
+
+
+def claim_batch_query(now: datetime):
+    return (
+        select(models.OutboxEvent)
+        .where(
+            models.OutboxEvent.processed_at.is_(None),
+            models.OutboxEvent.available_at <= now,
+            models.OutboxEvent.attempts < get_settings().outbox_max_attempts,
+        )
+        .order_by(models.OutboxEvent.available_at, models.OutboxEvent.id)
+        .limit(get_settings().outbox_batch_size)
+        .with_for_update(skip_locked=True)
+    )
+
+# Claims up to OUTBOX_BATCH_SIZE waiting events, oldest first
+async def claim_batch(db, now: datetime):
+    result = await db.execute(claim_batch_query(now))
+    return result.scalars().all()
+
+
+# Runs the after-commit actions of a batch. The same function added by several events (like
+# response_cache.bump_posts) runs only once, so 100 likes cost one cache invalidation.
+async def run_after_commit(after_commit: list):
+    for callback in dict.fromkeys(after_commit):
+        try:
+            result = callback()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception("Outbox after-commit action failed")
+
+
+"""
+Processes one batch and returns how many events it handled.
+The whole batch is tried in a single transaction first, which is one commit for up to
+OUTBOX_BATCH_SIZE events. If any of them fails, that transaction is rolled back and the
+events are redone one per transaction, so the good ones still go through and only the
+failing ones are pushed back.
+"""
+async def process_batch(db) -> int:
+    now = datetime.utcnow()
+    events = await claim_batch(db, now)
+    if not events:
+        await db.rollback()
+        return 0
+    event_ids = [event.id for event in events]
+
+    after_commit = []
+    try:
+        for event in events:
+            await run_handler(db, event, after_commit)
+            event.processed_at = now
+        await db.commit()
+        processed = len(event_ids)
+    except Exception:
+        await db.rollback()
+        after_commit = []
+        processed = 0
+        for event_id in event_ids:
+            if await process_one(db, event_id, after_commit):
+                processed += 1
+    await run_after_commit(after_commit)
+
+    worker_stats["processed"] += processed
+    worker_stats["batches"] += 1
+    worker_stats["last_batch_at"] = now.isoformat()
+    return len(event_ids)
+
+
+# Runs a single event in its own transaction, recording the failure if it raises.
+# Returns True when the event was processed.
+async def process_one(db, event_id: int, after_commit: list) -> bool:
+    event = await db.get(models.OutboxEvent, event_id, with_for_update={"skip_locked": True})
+    if event is None or event.processed_at is not None:
+        await db.rollback()
+        return False
+    # read now: the rollback below expires the event
+    topic, attempts = event.topic, event.attempts + 1
+    own_after_commit = []
+    try:
+        await run_handler(db, event, own_after_commit)
+        event.processed_at = datetime.utcnow()
+        await db.commit()
+        after_commit.extend(own_after_commit)
+        return True
+    except Exception as error:
+        await db.rollback()
+        backoff = min(get_settings().outbox_max_backoff_seconds, 2 ** attempts)
+        logger.warning("Outbox event %s (%s) failed, attempt %s: %r", event_id, topic, attempts, error)
+        await db.execute(
+            update(models.OutboxEvent)
+            .where(models.OutboxEvent.id == event_id)
+            .values(
+                attempts=attempts,
+                last_error=repr(error)[:2000],
+                available_at=datetime.utcnow() + timedelta(seconds=backoff),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        worker_stats["failed_attempts"] += 1
+        return False
+
+
+# Deletes processed events older than OUTBOX_RETENTION_HOURS
+async def purge_processed(db):
+    cutoff = datetime.utcnow() - timedelta(hours=get_settings().outbox_retention_hours)
+    await db.execute(
+        delete(models.OutboxEvent)
+        .where(models.OutboxEvent.processed_at.is_not(None), models.OutboxEvent.processed_at < cutoff)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+# set by enqueue-ing routes through wake(), so the inline worker doesn't wait for the next poll
+_wakeup = None
+
+def wake():
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+"""
+Drains the outbox until cancelled: keeps processing full batches while there are any, then
+sleeps until woken up by wake() or OUTBOX_POLL_SECONDS have passed.
+"""
+async def run_worker():
+    global _wakeup
+    _wakeup = asyncio.Event()
+    last_purge = 0.0
+    while True:
+        db = database.new_async_session()
+        try:
+            while await process_batch(db) == get_settings().outbox_batch_size:
+                pass
+            await flush_counter_bump(db)
+            if time.monotonic() - last_purge > 3600:
+                await purge_processed(db)
+                last_purge = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Outbox worker failed, retrying")
+        finally:
+            await db.close()
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), get_settings().outbox_poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+_worker_task = None
+
+# Called on startup by main.py: runs the worker in the API's event loop unless disabled
+def start_inline_worker():
+    global _worker_task
+    if get_settings().outbox_inline_worker and _worker_task is None:
+        _worker_task = asyncio.get_running_loop().create_task(run_worker())
+
+async def stop_inline_worker():
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+# How far behind the outbox is, for /api/status. Uses a normal (blocking) session.
+def queue_stats() -> dict:
+    db = database.SessionLocal()
+    try:
+        waiting = models.OutboxEvent.processed_at.is_(None)
+        pending, oldest = db.execute(
+            select(func.count(), func.min(models.OutboxEvent.created_at))
+            .where(waiting, models.OutboxEvent.attempts < get_settings().outbox_max_attempts)
+        ).one()
+        # events that failed OUTBOX_MAX_ATTEMPTS times and are no longer retried
+        dead = db.scalar(
+            select(func.count())
+            .select_from(models.OutboxEvent)
+            .where(waiting, models.OutboxEvent.attempts >= get_settings().outbox_max_attempts)
+        )
+    finally:
+        db.close()
+    return {
+        "pending": pending,
+        "lag_seconds": round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0.0,
+        "dead": dead,
+        "inline_worker": _worker_task is not None,
+        **worker_stats,
+    }
+
+
+if __name__ == "__main__":
+    # loads .env, like main.py does for the API
+    get_settings()
+    logging.basicConfig(level=logging.INFO)
+    print("Outbox worker running, press Ctrl+C to stop.")
+    try:
+        asyncio.run(run_worker())
+    except KeyboardInterrupt:
+        pass
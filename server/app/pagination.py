@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Instead of skipping `offset` rows, each page remembers the (created_at, id) of its last row
+and the next page starts right after it:
+
+    WHERE created_at < :last_created_at OR (created_at = :last_created_at AND id < :last_id)
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit
+
+With an index on (created_at, id) the database jumps straight to the start of the page, so
+page 500 costs the same as page 1, and posts inserted while the user scrolls can't make a
+row show up twice or get skipped.
+The (created_at, id) pair is handed to the client as an opaque base64 string, the cursor.
+"""
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, Query
+from sqlalchemy import and_, or_
+
+# page size used in cursor mode when the client doesn't send a limit
+DEFAULT_PAGE_SIZE = 20
+# the biggest `limit` the routes accept (see page_limit)
+MAX_PAGE_SIZE = 100
+
+
+# The `limit` query parameter of the list routes: 1 to MAX_PAGE_SIZE, anything else is a 422
+def page_limit(default: int = DEFAULT_PAGE_SIZE):
+    return Query(default, ge=1, le=MAX_PAGE_SIZE)
+
+
+# Packs the position of the last row of a page into an opaque string for the client
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("utf-8")
+
+
+# Unpacks a cursor sent back by the client, rejecting anything we didn't hand out
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("utf-8"))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+"""
+Turns `statement` (a select() of some columns, see app/fast_json.py) into the query of one
+page ordered by (created_col, id_col), starting after `cursor`. Both columns have to be among
+the selected ones.
+- descending = True gives newest first, False gives oldest first.
+- One extra row is fetched to know if there is a next page without running a COUNT.
+app/query_plans.py explains these statements too.
+"""
+def keyset_statement(statement, created_col, id_col, cursor: str, limit: int, descending: bool = True):
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        if descending:
+            statement = statement.where(or_(
+                created_col < created_at,
+                and_(created_col == created_at, id_col < row_id)
+            ))
+        else:
+            statement = statement.where(or_(
+                created_col > created_at,
+                and_(created_col == created_at, id_col > row_id)
+            ))
+
+    if descending:
+        statement = statement.order_by(created_col.desc(), id_col.desc())
+    else:
+        statement = statement.order_by(created_col.asc(), id_col.asc())
+    return statement.limit(limit + 1)
+
+
+# Runs keyset_statement and returns the rows of the page and the cursor of the next page
+# (None on the last page)
+async def keyset_page(db, statement, created_col, id_col, cursor: str, limit: int, descending: bool = True):
+    # the routes already check this (page_limit); a page of 0 rows would have no last row
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1.")
+    result = await db.execute(keyset_statement(statement, created_col, id_col, cursor, limit, descending))
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_col.key), getattr(last, id_col.key))
+    return rows, next_cursor
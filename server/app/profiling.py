@@ -0,0 +1,347 @@
+"""
+Opt-in request profiling (PROFILING_ENABLED=1): shows where the time of a slow endpoint goes,
+SQL (how many queries and how long), serializing the response or bcrypt.
+
+For every request it records:
+- the SQL statements it ran and their total time, through SQLAlchemy event hooks on the
+  engines, plus the slowest statement
+- time spent serializing the response (FastAPI's response_model handling and
+  fast_json.dumps) and waiting for bcrypt (app/auth.py)
+- N+1 patterns: the same statement running PROFILING_N_PLUS_ONE_THRESHOLD or more times in
+  one request, which is what lazy loads in a loop look like (e.g. reading `post.likes` for
+  every post of a page). These are logged as warnings and counted per route.
+
+and adds it up per route (e.g. "GET /posts/{post_id}/comments"). The numbers show up:
+- in the Server-Timing header of every response, which the browser devtools show in the
+  network tab:  Server-Timing: db;dur=12.4;desc="7 queries", serialize;dur=1.3, app;dur=20.1
+- at GET /metrics, per route, in the Prometheus text format
+
+With PROFILING_DUMPS_ENABLED=1 and a PROFILING_DUMP_TOKEN set (see app/config.py), a
+request sent with the header "X-Profile: <that token>" is also run under the pyinstrument
+sampling profiler (pip install pyinstrument, optional) and its report saved as HTML in
+PROFILING_DUMP_DIR; the response's X-Profile-Dump header names the file. Only one request is profiled at a time
+(others asking meanwhile are answered normally, unprofiled), and only the newest
+PROFILING_MAX_DUMPS reports are kept. pyinstrument only samples the event loop thread, so
+work done in the threadpool shows up as time spent awaiting it.
+
+Everything here is off unless PROFILING_ENABLED=1, since the hooks cost a little on every
+query and /metrics shouldn't be public by accident.
+"""
+import contextlib
+import contextvars
+import glob
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from fastapi import routing as fastapi_routing
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# statements are cut to this many characters in /metrics and the logs
+MAX_STATEMENT_LENGTH = 300
+
+
+# What one request has done so far. Shared with the threadpool threads it uses (context
+# variables are copied into them), which only run one at a time for a request.
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()
+        # other measured parts, e.g. {"serialize": 0.002, "bcrypt": 0.25}
+        self.timings = {}
+
+    def add_query(self, statement: str, seconds: float):
+        self.queries += 1
+        self.db_seconds += seconds
+        self.statements[statement] += 1
+        if seconds >= self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+    def repeated_statements(self) -> list:
+        threshold = get_settings().profiling_n_plus_one_threshold
+        return [
+            (statement, count) for statement, count in self.statements.items()
+            if count >= threshold
+        ]
+
+    def server_timing(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        parts = [f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"']
+        for name, seconds in self.timings.items():
+            parts.append(f"{name};dur={seconds * 1000:.1f}")
+        parts.append(f"app;dur={elapsed * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current = contextvars.ContextVar("request_profile", default=None)
+
+
+# Adds the time spent inside the with-block to the current request's `name` timing.
+# Does nothing outside a profiled request, so it can stay in the code when profiling is off.
+@contextlib.contextmanager
+def timer(name: str):
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.timings[name] = profile.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def shorten(statement: str) -> str:
+    statement = " ".join(statement.split())
+    if len(statement) > MAX_STATEMENT_LENGTH:
+        return statement[:MAX_STATEMENT_LENGTH] + "..."
+    return statement
+
+
+"""
+Totals per route since the server started, for /metrics.
+"""
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_seconds = 0.0
+        self.timings = {}
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+        self.n_plus_one = 0
+
+    def add(self, profile: RequestProfile, seconds: float, n_plus_one: bool):
+        self.requests += 1
+        self.seconds += seconds
+        self.queries += profile.queries
+        self.max_queries = max(self.max_queries, profile.queries)
+        self.db_seconds += profile.db_seconds
+        for name, value in profile.timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + value
+        if profile.slowest_statement is not None and profile.slowest_seconds >= self.slowest_seconds:
+            self.slowest_seconds = profile.slowest_seconds
+            self.slowest_statement = shorten(profile.slowest_statement)
+        self.n_plus_one += n_plus_one
+
+
+_routes = {}
+_routes_lock = threading.Lock()
+
+
+# SQLAlchemy hooks: time every statement and add it to the request that ran it (if any,
+# background workers run outside of requests and aren't counted)
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._profiling_start = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    start = getattr(context, "_profiling_start", None)
+    if profile is not None and start is not None:
+        profile.add_query(statement, time.perf_counter() - start)
+
+
+# endpoint function -> its path, filled in as requests come in
+_route_paths = {}
+
+# "GET /posts/{post_id}" for the route that handled the request, so all posts add up together
+def route_name(app, scope) -> str:
+    endpoint = scope.get("endpoint")
+    if endpoint is not None and endpoint not in _route_paths:
+        for route in app.routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                _route_paths[endpoint] = route.path
+                break
+    return f"{scope['method']} {_route_paths.get(endpoint) or 'unmatched'}"
+
+
+def dump_path() -> str:
+    dump_dir = get_settings().profiling_dump_dir
+    os.makedirs(dump_dir, exist_ok=True)
+    return os.path.join(dump_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{time.perf_counter_ns() % 10**6}.html")
+
+
+"""
+Plain ASGI middleware (not BaseHTTPMiddleware) so the scope it sees is the one the router
+fills in with the matched endpoint, and streaming responses aren't buffered.
+"""
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        headers = dict(scope.get("headers") or [])
+        dump = dump_path() if wants_dump(headers.get(b"x-profile")) else None
+        profiler = start_profiler() if dump is not None else None
+        if profiler is None:
+            dump = None
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                extra = [(b"server-timing", profile.server_timing().encode())]
+                if dump is not None:
+                    extra.append((b"x-profile-dump", os.path.basename(dump).encode()))
+                message = dict(message, headers=list(message.get("headers", [])) + extra)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if profiler is not None:
+                save_profile(profiler, dump)
+            self.record(scope, profile)
+
+    def record(self, scope, profile: RequestProfile):
+        name = route_name(scope["app"], scope)
+        repeated = profile.repeated_statements()
+        for statement, count in repeated:
+            logger.warning("Possible N+1 in %s: the same query ran %d times: %s", name, count, shorten(statement))
+        with _routes_lock:
+            stats = _routes.setdefault(name, RouteStats())
+            stats.add(profile, time.perf_counter() - profile.started, bool(repeated))
+
+
+# Does the X-Profile header ask for a dump, with the right token? Dumps cost CPU and disk,
+# so they're off unless the settings turn them on and set a token
+def wants_dump(header_value) -> bool:
+    if not header_value:
+        return False
+    settings = get_settings()
+    if not settings.profiling_dumps_enabled or not settings.profiling_dump_token:
+        return False
+    return hmac.compare_digest(header_value, settings.profiling_dump_token.encode())
+
+
+_warned_no_pyinstrument = False
+# pyinstrument can only run one profiler per thread, and every request runs on the event
+# loop's thread, so only one request is profiled at a time
+_profiler_lock = threading.Lock()
+
+# Starts a profiler, or returns None (and the request runs unprofiled) if it can't
+def start_profiler():
+    global _warned_no_pyinstrument
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        if not _warned_no_pyinstrument:
+            logger.warning("X-Profile was asked for but pyinstrument isn't installed (pip install pyinstrument)")
+            _warned_no_pyinstrument = True
+        return None
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+    try:
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        return profiler
+    except Exception:
+        _profiler_lock.release()
+        logger.exception("Could not start the profiler, answering the request without it")
+        return None
+
+# The response is sent already, so a failure here is only logged
+def save_profile(profiler, path: str):
+    try:
+        profiler.stop()
+        with open(path, "w") as f:
+            f.write(profiler.output_html())
+        logger.info("Saved the profile of a request to %s", path)
+        remove_old_dumps()
+    except Exception:
+        logger.exception("Could not save the profile of a request to %s", path)
+    finally:
+        _profiler_lock.release()
+
+# Keeps only the newest PROFILING_MAX_DUMPS reports
+def remove_old_dumps():
+    settings = get_settings()
+    dumps = sorted(glob.glob(os.path.join(settings.profiling_dump_dir, "profile-*.html")), key=os.path.getmtime)
+    max_dumps = settings.profiling_max_dumps
+    for path in dumps[:-max_dumps] if max_dumps > 0 else dumps:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+# GET /metrics: the per route totals in the Prometheus text format
+def metrics():
+    with _routes_lock:
+        routes = sorted(_routes.items())
+        lines = []
+
+        def metric(name, kind, help_text, values):
+            lines.append(f"# HELP movieshare_{name} {help_text}")
+            lines.append(f"# TYPE movieshare_{name} {kind}")
+            for labels, value in values:
+                label_text = ",".join(f'{key}="{escape_label(str(val))}"' for key, val in labels.items())
+                lines.append(f"movieshare_{name}{{{label_text}}} {value}")
+
+        metric("requests_total", "counter", "Requests handled.",
+               [({"route": name}, stats.requests) for name, stats in routes])
+        metric("request_seconds_total", "counter", "Time spent handling requests.",
+               [({"route": name}, round(stats.seconds, 6)) for name, stats in routes])
+        metric("db_queries_total", "counter", "SQL statements run by requests.",
+               [({"route": name}, stats.queries) for name, stats in routes])
+        metric("db_queries_max", "gauge", "Most SQL statements a single request ran.",
+               [({"route": name}, stats.max_queries) for name, stats in routes])
+        metric("db_seconds_total", "counter", "Time spent in SQL statements.",
+               [({"route": name}, round(stats.db_seconds, 6)) for name, stats in routes])
+        metric("phase_seconds_total", "counter", "Time spent serializing responses, waiting for bcrypt, ...",
+               [({"route": name, "phase": phase}, round(seconds, 6))
+                for name, stats in routes for phase, seconds in sorted(stats.timings.items())])
+        metric("slowest_query_seconds", "gauge", "The slowest SQL statement seen so far.",
+               [({"route": name, "statement": stats.slowest_statement}, round(stats.slowest_seconds, 6))
+                for name, stats in routes if stats.slowest_statement is not None])
+        metric("n_plus_one_requests_total", "counter", "Requests that ran the same statement many times (N+1).",
+               [({"route": name}, stats.n_plus_one) for name, stats in routes])
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+"""
+Turns profiling on for `app` (called by main.py when PROFILING_ENABLED is set): hooks the
+engines, wraps FastAPI's response serialization to time it, adds the middleware and the
+/metrics endpoint.
+"""
+def install(app):
+    # listening on the Engine class covers both engines (the async one runs its statements
+    # through a sync Engine too) without creating them here, they're made on first use
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+    # FastAPI looks serialize_response up on its module for every request, so timing it here
+    # covers every route with a response_model
+    serialize_response = fastapi_routing.serialize_response
+
+    async def timed_serialize_response(*args, **kwargs):
+        with timer("serialize"):
+            return await serialize_response(*args, **kwargs)
+
+    fastapi_routing.serialize_response = timed_serialize_response
+
+    app.add_middleware(ProfilingMiddleware)
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
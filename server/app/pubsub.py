@@ -0,0 +1,158 @@
+"""
+Publish/subscribe used to push events (like new notifications) to the clients that are
+connected to a stream, see GET /posts/notifications/stream.
+
+get_broker() hands out this process's broker, made the first time it's asked for:
+
+- `await broker.publish(channel, message)` sends a message (a JSON string) to everyone
+  subscribed to that channel. It never blocks the event loop: the Redis broker talks to
+  Redis through redis.asyncio.
+- `async with broker.subscribe(channel) as subscription:` then `await subscription.get()`
+  waits for the next message.
+
+By default everything stays inside this process (MemoryBroker): each subscriber is just an
+asyncio.Queue, so thousands of idle streams cost a few KB each. With several server
+processes, set PUBSUB_URL to a Redis (or Redis-compatible) server and messages published
+by one process reach the subscribers of all of them.
+"""
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+
+class Subscription:
+    def __init__(self, loop, queue_size: int):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    # runs on the subscriber's event loop
+    def deliver(self, message: str):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+
+class MemoryBroker:
+    # queue_size: messages a slow subscriber may have waiting before the oldest ones get dropped
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        # channel -> set of Subscription
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    # Hands the message to this process's subscribers and returns how many there were.
+    # Plain function, safe to call from any thread (RedisBroker's listener uses it).
+    def publish_local(self, channel: str, message: str) -> int:
+        with self._lock:
+            subscriptions = list(self._channels.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # that subscriber's event loop is already closed
+                pass
+        return len(subscriptions)
+
+    async def publish(self, channel: str, message: str) -> int:
+        return self.publish_local(channel, message)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "channels": len(self._channels),
+                "subscribers": sum(len(subscribers) for subscribers in self._channels.values()),
+            }
+
+
+"""
+Shares messages between server processes through Redis PUBLISH/PSUBSCRIBE.
+Each process keeps a single Redis connection listening to all channels and hands what it
+receives to its local subscribers through a MemoryBroker, so the number of open streams
+doesn't turn into the number of Redis connections. Needs the redis package.
+"""
+class RedisBroker:
+    def __init__(self, url: str, queue_size: int):
+        self.url = url
+        self._publisher = None
+        self._publisher_loop = None
+        self._local = MemoryBroker(queue_size)
+        self._listener = None
+
+    # An asyncio client belongs to the event loop it was made on, so one is made per loop
+    def publisher(self):
+        import redis.asyncio
+
+        loop = asyncio.get_running_loop()
+        if self._publisher is None or self._publisher_loop is not loop:
+            self._publisher = redis.asyncio.Redis.from_url(self.url)
+            self._publisher_loop = loop
+        return self._publisher
+
+    async def publish(self, channel: str, message: str) -> int:
+        return await self.publisher().publish(channel, message)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        async with self._local.subscribe(channel) as subscription:
+            yield subscription
+
+    # forwards everything published on Redis to the local subscribers, reconnecting on errors
+    async def _listen(self):
+        import redis.asyncio
+
+        while True:
+            client = redis.asyncio.Redis.from_url(self.url, decode_responses=True)
+            try:
+                pubsub = client.pubsub()
+                await pubsub.psubscribe("*")
+                async for item in pubsub.listen():
+                    if item["type"] == "pmessage":
+                        self._local.publish_local(item["channel"], item["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lost the connection to the pub/sub server, reconnecting")
+                await asyncio.sleep(1)
+            finally:
+                await client.close()
+
+    def stats(self) -> dict:
+        stats = self._local.stats()
+        stats["backend"] = "redis"
+        return stats
+
+
+# PUBSUB_URL and PUBSUB_QUEUE_SIZE, see app/config.py. Made on first use, not on import.
+@lru_cache(maxsize=None)
+def get_broker():
+    settings = get_settings()
+    if settings.pubsub_url:
+        return RedisBroker(settings.pubsub_url, settings.pubsub_queue_size)
+    return MemoryBroker(settings.pubsub_queue_size)
@@ -0,0 +1,138 @@
+"""
+Checks that the queries behind the busiest endpoints are answered from an index.
+
+For each query of hot_queries() it asks the database for its plan (EXPLAIN QUERY PLAN on
+SQLite, EXPLAIN (FORMAT JSON) on PostgreSQL) and fails if any table is read with a full scan.
+On PostgreSQL the check runs with enable_seqscan=off: a small test table would otherwise be
+read sequentially just because that's cheaper, so a sequential scan in the plan really means
+no usable index exists.
+
+Run it from the server folder against a migrated database (e.g. in CI after
+`alembic upgrade head`). It prints every plan and exits with status 1 if a query does a scan:
+
+    python -m app.query_plans
+
+tests/test_query_plans.py does the same check against a freshly migrated SQLite database.
+"""
+import json
+import sys
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from . import models, database, pagination
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def compile_explain(element, compiler, **kw):
+    if compiler.dialect.name == "postgresql":
+        prefix = "EXPLAIN (FORMAT JSON) "
+    else:
+        prefix = "EXPLAIN QUERY PLAN "
+    return prefix + compiler.process(element.statement, **kw)
+
+
+"""
+name -> the statement an endpoint (or worker) runs, with example values. They are built with
+the same functions the routes and workers use (app/routes/post.py, app/pagination.py, ...),
+so the check sees the real SQL, and a route that changes its query changes it here too.
+"""
+def hot_queries(dialect: str) -> dict:
+    from .routes import post
+    from . import auth, outbox, reconcile, trending
+    Post, Comment, Notification = models.Post, models.Comment, models.Notification
+    page = 20
+
+    def cursor_page(query, created_col, id_col, descending=True):
+        return pagination.keyset_statement(query, created_col, id_col, None, page, descending)
+
+    feed, rank = post.feed_query(None, dialect)
+    return {
+        "feed, newest (GET /posts/)": post.feed_offset_statement(feed, rank, "newest", page, 0),
+        "feed, newest, cursor (GET /posts/?paginate=cursor)": cursor_page(feed, Post.created_at, Post.id),
+        "feed, trending (GET /posts/?sort=trending)": post.feed_offset_statement(feed, rank, "trending", page, 0),
+        "my posts (GET /posts/me?paginate=cursor)": cursor_page(post.my_posts_query(1), Post.created_at, Post.id),
+        "comments of a post (GET /posts/{id}/comments?paginate=cursor)": cursor_page(
+            post.comments_query(1), Comment.created_at, Comment.id, descending=False
+        ),
+        "notifications (GET /posts/notifications?paginate=cursor)": cursor_page(
+            post.notifications_query(1), Notification.created_at, Notification.id
+        ),
+        "unseen count (GET /posts/notifications/unseen_count)": post.unseen_count_query(1),
+        "likes of a post (app/reconcile.py)": select(reconcile.count_for_post(models.PostLike))
+            .select_from(Post).where(Post.id == 1),
+        "my bookmarks (GET /posts/bookmarks?paginate=cursor)": cursor_page(post.bookmarks_query(1), Post.created_at, Post.id),
+        "engagement (GET /posts/engagement)": post.engagement_query(1, [1, 2, 3]),
+        "login (POST /login)": auth.user_by_email_query("someone@example.com"),
+        "outbox batch (app/outbox.py)": outbox.claim_batch_query(datetime.utcnow()),
+        "stale trending scores (app/trending.py)": trending.score_batch_query(0),
+    }
+
+
+# SQLite: rows of (id, parent, notused, detail); "SCAN posts" without an index is a full scan
+def sqlite_scans(rows) -> list:
+    scans = []
+    for row in rows:
+        detail = row[-1]
+        if detail.startswith("SCAN ") and " USING " not in detail:
+            scans.append(detail)
+    return scans
+
+
+# PostgreSQL: walks the JSON plan tree looking for "Seq Scan" nodes
+def postgres_scans(rows) -> list:
+    plan = rows[0][0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scans = []
+
+    def walk(node):
+        if node.get("Node Type") == "Seq Scan":
+            scans.append(f"Seq Scan on {node.get('Relation Name')}")
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return scans
+
+
+"""
+Explains every hot query and returns {name: (plan lines, full scans found)}.
+"""
+def check_plans(engine) -> dict:
+    results = {}
+    with engine.connect() as connection:
+        is_postgres = connection.dialect.name == "postgresql"
+        if is_postgres:
+            connection.exec_driver_sql("SET enable_seqscan = off")
+        for name, statement in hot_queries(connection.dialect.name).items():
+            rows = connection.execute(Explain(statement)).all()
+            if is_postgres:
+                plan_lines = [json.dumps(rows[0][0], indent=1) if not isinstance(rows[0][0], str) else rows[0][0]]
+                scans = postgres_scans(rows)
+            else:
+                plan_lines = [row[-1] for row in rows]
+                scans = sqlite_scans(rows)
+            results[name] = (plan_lines, scans)
+        connection.rollback()
+    return results
+
+
+if __name__ == "__main__":
+    results = check_plans(database.engine)
+    failed = 0
+    for name, (plan_lines, scans) in results.items():
+        print(("FAIL " if scans else "ok   ") + name)
+        if scans or "-v" in sys.argv[1:]:
+            for line in plan_lines:
+                print("       " + line.replace("\n", "\n       "))
+        failed += bool(scans)
+    print(f"{len(results) - failed} of {len(results)} hot queries use an index.")
+    sys.exit(1 if failed else 0)
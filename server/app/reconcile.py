@@ -0,0 +1,119 @@
+"""
+Recomputes the like/comment/bookmark counters stored on every post from the rows in the
+PostLike, Comment and PostBookmark tables, and every user's totals in user_stats.
+
+The outbox worker (app/outbox.py) keeps these counters up to date as likes, comments and
+bookmarks come in, so this is only needed to repair them, e.g. after rows were deleted by
+hand or a backfill.
+Run it from the server folder with:
+
+    python -m app.reconcile
+
+The outbox events that are still waiting would be counted twice: once here, since their
+likes and comments are in the tables already, and again when the worker applies them. So
+each recount first checks, in its own transaction, that no event is waiting, and refuses to
+run otherwise (stop the API or wait until /api/status shows the outbox is empty). On
+PostgreSQL that transaction is REPEATABLE READ, so the check and the recount see the same
+rows: a like committed after the check belongs to an event the worker applies afterwards.
+Events that failed OUTBOX_MAX_ATTEMPTS times are never applied, so they don't count.
+"""
+import sys
+from sqlalchemy import func, select, update, delete, insert, true
+from sqlalchemy.orm import Session
+from . import models, database, etags, upsert
+from .config import get_settings
+
+
+# Builds "SELECT count(*) FROM <table> WHERE <table>.post_id = posts.id" for one counter
+def count_for_post(model):
+    return (
+        select(func.count())
+        .where(model.post_id == models.Post.id)
+        .correlate(models.Post)
+        .scalar_subquery()
+    )
+
+
+# Starts the recount's transaction, raises RuntimeError if outbox events are still waiting
+def begin_recount(db: Session):
+    if db.bind.dialect.name == "postgresql":
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    waiting = db.scalar(
+        select(func.count())
+        .select_from(models.OutboxEvent)
+        .where(
+            models.OutboxEvent.processed_at.is_(None),
+            models.OutboxEvent.attempts < get_settings().outbox_max_attempts,
+        )
+    )
+    if waiting:
+        db.rollback()
+        raise RuntimeError(f"{waiting} outbox events are still waiting, reconcile once the worker has caught up")
+
+
+# Resets every post's counters in one UPDATE statement and returns how many posts were touched
+def reconcile_post_counters(db: Session) -> int:
+    begin_recount(db)
+    result = db.execute(
+        update(models.Post).values(
+            like_count=count_for_post(models.PostLike),
+            comment_count=count_for_post(models.Comment),
+            bookmark_count=count_for_post(models.PostBookmark),
+        )
+    )
+    db.execute(etags.bump_version())
+    db.commit()
+    return result.rowcount
+
+
+"""
+Rebuilds user_stats from scratch (one INSERT ... SELECT with a subquery per total) and returns
+how many users it wrote. It's an upsert (ON CONFLICT (user_id) DO UPDATE), so the worker's
+own upserts into user_stats never find a user's row missing halfway. user_daily_stats is
+not rebuilt, since likes don't store when they were made.
+"""
+def reconcile_user_stats(db: Session) -> int:
+    begin_recount(db)
+    user_id = models.User.id
+    post_count = select(func.count()).where(models.Post.owner_id == user_id).correlate(models.User).scalar_subquery()
+    likes_received = (
+        select(func.count())
+        .select_from(models.PostLike)
+        .join(models.Post, models.Post.id == models.PostLike.post_id)
+        .where(models.Post.owner_id == user_id)
+        .correlate(models.User)
+        .scalar_subquery()
+    )
+    bookmark_count = select(func.count()).where(models.PostBookmark.user_id == user_id).correlate(models.User).scalar_subquery()
+
+    columns = ["user_id", "post_count", "likes_received", "bookmark_count"]
+    # SQLite needs a WHERE in the SELECT of an INSERT ... SELECT ... ON CONFLICT
+    totals = select(user_id, post_count, likes_received, bookmark_count).where(true())
+    dialect_insert_func = upsert.dialect_insert(db.bind.dialect.name)
+    if dialect_insert_func is not None:
+        statement = dialect_insert_func(models.UserStats).from_select(columns, totals)
+        statement = statement.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={name: statement.excluded[name] for name in columns[1:]},
+        )
+    else:
+        db.execute(delete(models.UserStats))
+        statement = insert(models.UserStats).from_select(columns, totals)
+    result = db.execute(statement)
+    db.commit()
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    # loads .env (DATABASE_URL), like main.py does for the API
+    get_settings()
+    db = database.SessionLocal()
+    try:
+        updated = reconcile_post_counters(db)
+        print(f"Reconciled counters for {updated} posts.")
+        users = reconcile_user_stats(db)
+        print(f"Rebuilt user_stats for {users} users.")
+    except RuntimeError as error:
+        sys.exit(str(error))
+    finally:
+        db.close()
@@ -0,0 +1,158 @@
+"""
+Read-through cache of whole JSON responses for the public lists that everybody asks for:
+the feed (GET /posts/) and the comments of a post. These look the same for every caller, so
+the same page is built once and then served as ready-made bytes until something changes.
+
+Invalidation works with version numbers instead of deleting keys. Every namespace ("posts",
+"comments:<post_id>") has a version that is part of each cache key:
+
+    posts:v12:feed_version=40&limit=10&paginate=offset&sort=newest
+
+Only the first pages are cached (see is_cached_feed_page in app/routes/post.py), so the
+number of keys doesn't grow with what clients put in the query string.
+
+Anything that changes what a page shows calls bump("posts") after its commit: create,
+update and delete of a post right away, likes/comments/bookmarks in the outbox worker at
+most every FEED_COUNTER_BUMP_SECONDS (see app/outbox.py). The version goes up, every later
+lookup builds new keys and the old entries are never read again; they simply expire or fall
+out of the LRU.
+
+Two backends:
+- memory (default): a TTLCache per process. Each process has its own versions, so with
+  several processes (or the outbox worker in its own process) a page can be up to
+  RESPONSE_CACHE_TTL_SECONDS old.
+- RESPONSE_CACHE_URL=redis://...: a Redis (or Redis-compatible) server shared by all
+  processes, versions included. Needs the redis package.
+If the cache backend fails, requests are answered from the database as if it was a miss.
+"""
+import logging
+import threading
+from functools import lru_cache
+from urllib.parse import urlencode
+from fastapi.responses import Response
+from .cache import TTLCache
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+class MemoryBackend:
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.versions = {}
+        self._lock = threading.Lock()
+
+    async def get_version(self, namespace: str) -> int:
+        return self.versions.get(namespace, 0)
+
+    async def bump(self, namespace: str):
+        with self._lock:
+            self.versions[namespace] = self.versions.get(namespace, 0) + 1
+
+    async def get(self, key: str):
+        return self.entries.get(key)
+
+    async def set(self, key: str, body: bytes):
+        self.entries.set(key, body)
+
+    def info(self) -> dict:
+        return {"backend": "memory", "size": self.entries.stats()["size"], "maxsize": self.entries.maxsize}
+
+
+class RedisBackend:
+    def __init__(self, url: str, ttl: float):
+        import redis.asyncio
+
+        self.client = redis.asyncio.Redis.from_url(url)
+        self.ttl = max(1, int(ttl))
+
+    async def get_version(self, namespace: str) -> int:
+        version = await self.client.get("version:" + namespace)
+        return int(version) if version is not None else 0
+
+    async def bump(self, namespace: str):
+        await self.client.incr("version:" + namespace)
+
+    async def get(self, key: str):
+        return await self.client.get("response:" + key)
+
+    async def set(self, key: str, body: bytes):
+        await self.client.set("response:" + key, body, ex=self.ttl)
+
+    def info(self) -> dict:
+        return {"backend": "redis"}
+
+
+# made on first use, from the RESPONSE_CACHE_* settings (see app/config.py)
+@lru_cache(maxsize=None)
+def get_backend():
+    settings = get_settings()
+    if settings.response_cache_url:
+        return RedisBackend(settings.response_cache_url, settings.response_cache_ttl_seconds)
+    return MemoryBackend(settings.response_cache_max_size, settings.response_cache_ttl_seconds)
+
+# namespace kind ("posts", "comments") -> {"hits": n, "misses": n}, for /api/status
+_counters = {}
+_counters_lock = threading.Lock()
+
+def _count(namespace: str, outcome: str):
+    kind = namespace.split(":", 1)[0]
+    with _counters_lock:
+        counters = _counters.setdefault(kind, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+
+"""
+Looks up the cached response for `namespace` and the request's parameters.
+Returns (key, body): body is the cached JSON (bytes) or None on a miss, in which case the
+caller builds the response and passes the key to store(). key is None when caching is off.
+"""
+async def lookup(namespace: str, **params):
+    if not get_settings().response_cache_enabled:
+        return None, None
+    try:
+        backend = get_backend()
+        version = await backend.get_version(namespace)
+        key = f"{namespace}:v{version}:" + urlencode(sorted((name, "" if value is None else value) for name, value in params.items()))
+        body = await backend.get(key)
+    except Exception:
+        logger.exception("Response cache lookup failed")
+        return None, None
+    _count(namespace, "misses" if body is None else "hits")
+    return key, body
+
+async def store(key, body: bytes):
+    if key is None:
+        return
+    try:
+        await get_backend().set(key, body)
+    except Exception:
+        logger.exception("Response cache store failed")
+
+# Makes every cached response of `namespace` stale. Call it after the change is committed.
+async def bump(namespace: str):
+    if not get_settings().response_cache_enabled:
+        return
+    try:
+        await get_backend().bump(namespace)
+    except Exception:
+        logger.exception("Response cache invalidation failed")
+
+async def bump_posts():
+    await bump("posts")
+
+
+def json_response(body: bytes, hit: bool, headers: dict = None) -> Response:
+    return Response(content=body, media_type="application/json", headers={"X-Cache": "HIT" if hit else "MISS", **(headers or {})})
+
+
+def stats() -> dict:
+    with _counters_lock:
+        counters = {}
+        for kind, numbers in _counters.items():
+            lookups = numbers["hits"] + numbers["misses"]
+            counters[kind] = dict(numbers, hit_ratio=round(numbers["hits"] / lookups, 4) if lookups else None)
+    settings = get_settings()
+    return {
+        "enabled": settings.response_cache_enabled, "ttl_seconds": settings.response_cache_ttl_seconds,
+        **get_backend().info(), "namespaces": counters,
+    }
@@ -1,190 +1,353 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Path
-from sqlalchemy.orm import Session
-from .. import models, schemas, database, auth
-from typing import Optional
-from sqlalchemy import or_
-
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Header, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, update, delete, func, literal, union_all
+from .. import models, schemas, database, auth, pagination, notifications, pubsub, outbox, response_cache, trending, upsert, fast_json, etags
+import asyncio
+from datetime import datetime
+from ..search import apply_search
+from typing import Optional, Union
+
+"""
+All the post routes are `async def` and get their session from database.get_async_db.
+That is a real AsyncSession when DB_ASYNC_MODE is on, and otherwise a ThreadedSession which
+runs each query on the thread pool, so every database call here has to be awaited:
+    result = await db.execute(select(...))
+    await db.commit()
+"""
 router = APIRouter(
     prefix="/posts",
     tags=["Posts"]
 )
 
+# What the list endpoints select: just the columns of their response models, read as plain
+# rows and encoded straight to JSON (see app/fast_json.py). Their response_model is only
+# there for the OpenAPI docs.
+POST_COLUMNS = fast_json.columns_of(models.Post, schemas.PostOut)
+COMMENT_COLUMNS = fast_json.columns_of(models.Comment, schemas.CommentOut)
+NOTIFICATION_COLUMNS = fast_json.columns_of(models.Notification, schemas.NotificationOut)
+
+# part of the ETags of the lists, so a new response format doesn't get 304s (see app/etags.py)
+POSTS_SCHEMA = etags.schema_fingerprint(schemas.PostOut, schemas.PostPage)
+COMMENTS_SCHEMA = etags.schema_fingerprint(schemas.CommentOut, schemas.CommentPage)
+NOTIFICATIONS_SCHEMA = etags.schema_fingerprint(schemas.NotificationOut, schemas.NotificationPage)
+
 @router.post("/", response_model=schemas.PostOut)
-def create_post(
+async def create_post(
     post: schemas.PostCreate,
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
-):
-    new_post = models.Post(**post.dict(), owner_id=current_user.id)
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+): 
+    # the trending score of a post without likes yet only depends on when it was made
+    created_at = datetime.utcnow()
+    new_post = models.Post(
+        **post.dict(), owner_id=current_user.id, created_at=created_at,
+        hot_score=trending.hot_score(0, 0, 0, created_at), hot_score_stale=False
+    )
     db.add(new_post)
-    db.commit()
-    db.refresh(new_post)
+    await db.flush()
+    # counts towards the owner's post total, see app/outbox.py
+    outbox.enqueue(db, "post.created", post_id=new_post.id, owner_id=current_user.id)
+    await db.execute(etags.bump_version())
+    await db.commit()
+    outbox.wake()
+    await response_cache.bump_posts()
+    await db.refresh(new_post)
     return new_post
 
+"""
+Every list endpoint supports two ways of paging, picked with the `paginate` query parameter:
+- "offset" (default): the old behaviour, a plain list of items.
+- "cursor": returns {"items": [...], "next_cursor": "..."}. Send next_cursor back as `cursor`
+  to get the next page, see app/pagination.py.
+Both modes return at most `limit` items. In offset mode the next page is asked for with
+`offset`; the lists that used to return everything (my posts, comments, notifications,
+bookmarks) now return their first `limit` items too, so clients page through them instead
+of getting one unbounded list.
+"""
+def is_cursor_mode(paginate: str) -> bool:
+    if paginate not in ("offset", "cursor"):
+        raise HTTPException(status_code=400, detail="paginate must be 'offset' or 'cursor'.")
+    return paginate == "cursor"
+
+# Only the first pages that everybody loads are cached: no search, no cursor or offset, one
+# of the usual sorts and page sizes. Every other combination would be a key of its own that
+# is hardly ever read again, and enough of them would push the popular pages out.
+CACHED_FEED_LIMITS = (10, pagination.DEFAULT_PAGE_SIZE)
+CACHED_FEED_SORTS = ("newest", "oldest", "trending")
+
+def is_cached_feed_page(search, sort, limit: int, offset: int, cursor) -> bool:
+    return not search and cursor is None and offset == 0 and sort in CACHED_FEED_SORTS and limit in CACHED_FEED_LIMITS
+
 # this returns all the posts even if they don't belong to you, like in the explore page of Insta 
-@router.get("/", response_model=list[schemas.PostOut])
-def get_posts(
+# The first pages are the same for everyone, so they are served from app/response_cache.py.
+# A client that already has the page (If-None-Match) gets a 304 while the feed's version in
+# content_versions stays the same, see app/etags.py. The version is also part of the cache
+# key, so a cached page is never older than its ETag says.
+@router.get("/", response_model=Union[list[schemas.PostOut], schemas.PostPage])
+async def get_posts(
     search: Optional[str] = None,
     sort: Optional[str] = "newest",
-    limit: int = 10,
-    offset: int = 0,
-    db: Session = Depends(database.get_db),    
+    limit: int = pagination.page_limit(10),
+    offset: int = Query(0, ge=0),
+    paginate: str = "offset",
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: database.AsyncDB = Depends(database.get_async_db),
     ):
-    query = db.query(models.Post)
+    cursor_mode = is_cursor_mode(paginate)
+    feed_version = await etags.feed_version(db)
+    etag = etags.weak_etag(POSTS_SCHEMA, feed_version)
+    if etags.matches(if_none_match, etag):
+        return etags.not_modified(etag)
+
+    cache_key, cached = None, None
+    if is_cached_feed_page(search, sort, limit, offset, cursor):
+        cache_key, cached = await response_cache.lookup(
+            "posts", feed_version=feed_version, sort=sort, limit=limit, paginate=paginate
+        )
+    if cached is not None:
+        return response_cache.json_response(cached, hit=True, headers=etags.headers(etag))
+
+    result = await query_posts(db, search, sort, limit, offset, cursor_mode, cursor)
+    body = fast_json.dumps(result)
+    await response_cache.store(cache_key, body)
+    return response_cache.json_response(body, hit=False, headers=etags.headers(etag))
+
+"""
+The statements of the list routes are built by the functions below, the feed_* ones and the
+*_query ones further down, so app/query_plans.py can explain exactly the SQL the routes run.
+"""
+
+# The feed before paging: the public posts, filtered by `search` if given. Returns the query
+# and the search rank (None without a search, or on databases that can't rank)
+def feed_query(search: Optional[str], dialect: str):
+    query = select(*POST_COLUMNS)
     # selects all the posts that have public visibility
-    query = query.filter(models.Post.visibility == "public")
-    # Apply filter if search is provided
+    query = query.where(models.Post.visibility == "public")
+    # Apply filter if search is provided, using the full-text index (see app/search.py)
+    rank = None
     if search:
-        # or_ allows filtering based on either condition
-        query = query.filter(
-            or_(
-                models.Post.title.ilike(f"%{search}%"),
-                models.Post.content.ilike(f"%{search}%")
-            )
-        )
+        query, rank = apply_search(query, search, dialect)
+    return query, rank
+
+# One page of the feed in offset mode
+def feed_offset_statement(query, rank, sort: Optional[str], limit: int, offset: int):
+    # sort=trending ranks by the precomputed score from app/trending.py
+    if sort == "trending":
+        query = query.order_by(models.Post.hot_score.desc(), models.Post.id.desc())
+    # sort=relevance puts the best matches first, so it needs a search to rank by
+    elif sort == "relevance" and rank is not None:
+        query = query.order_by(rank.desc(), models.Post.created_at.desc())
     # By default, returns posts in descending order , i.e. from latest ---> oldest    
-    if sort == "oldest":
+    elif sort == "oldest":
         query = query.order_by(models.Post.created_at.asc())
-    else:
+    else: 
         query = query.order_by(models.Post.created_at.desc())    
-    
-    query = query.offset(offset).limit(limit) 
-
-    all_posts = query.all()
-
-    # Build response manually with like counts
-    response = []
-    for post in all_posts:
-        response.append({
-            "id": post.id,
-            "title": post.title,
-            "content": post.content,
-            "created_at": post.created_at,
-            "owner_id": post.owner_id,
-            "like_count": len(post.likes), 
-            "visibility" : post.visibility
-        })
-
-    return response
+    return query.offset(offset).limit(limit)
+
+# Returns the page as plain dicts (a list, or {"items", "next_cursor"} in cursor mode)
+async def query_posts(db: database.AsyncDB, search, sort, limit, offset, cursor_mode, cursor):
+    query, rank = feed_query(search, db.bind.dialect.name)
+
+    if cursor_mode:
+        # trending and relevance are offset paging only
+        if sort in ("trending", "relevance"):
+            raise HTTPException(status_code=400, detail=f"sort={sort} only supports offset pagination.")
+        posts, next_cursor = await pagination.keyset_page(
+            db, query, models.Post.created_at, models.Post.id, cursor, limit,
+            descending=(sort != "oldest")
+        )
+        return {"items": fast_json.rows_as_dicts(posts, POST_COLUMNS), "next_cursor": next_cursor}
+
+    # like_count is stored on each post, so the posts can be returned as they are
+    result = await db.execute(feed_offset_statement(query, rank, sort, limit, offset))
+    return fast_json.rows_as_dicts(result.all(), POST_COLUMNS)
 
 # This function checks if a requested post exists or not. 
-def get_post_or_404(post_id: int, db: Session):
-    post = db.query(models.Post).filter(models.Post.id == post_id).first()
+async def get_post_or_404(post_id: int, db: database.AsyncDB):
+    post = await db.get(models.Post, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found.")
     return post
 
 # This function allow a user to update a post only if they are the owner
 @router.put("/{post_id}", response_model=schemas.PostOut)
-def update_post(
-    post_id: int,
+async def update_post(
+    post_id: int, 
     updated_post: schemas.PostCreate,        # the incoming data from the client — title and content.
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
-):
-    post = get_post_or_404(post_id, db)
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+): 
+    post = await get_post_or_404(post_id, db)
 
     if post.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="You are not authorized to update this post.")
 
     post.title = updated_post.title
     post.content = updated_post.content
+    await db.execute(etags.bump_version())
 
     # updating these changes in the database
-    db.commit()
-    db.refresh(post)
+    await db.commit()
+    await response_cache.bump_posts()
+    await db.refresh(post)
     return post
 
 # This function allows user to delete only their own posts, and return proper errors for others.
 @router.delete("/{post_id}", status_code=204)
-def delete_post(
-    post_id: int,
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
-):
-    post = get_post_or_404(post_id, db)
+async def delete_post(
+    post_id: int, 
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+): 
+    post = await get_post_or_404(post_id, db)
 
     if post.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="You are not authorized to delete this post.")
-    
+
+    # who loses a bookmark with it, for their user_stats (see app/outbox.py)
+    bookmarked_by = (await db.scalars(
+        select(models.PostBookmark.user_id).where(models.PostBookmark.post_id == post_id)
+    )).all()
+    # The database deletes everything that points at the post (ON DELETE CASCADE), except
+    # SQLite, which only does that with PRAGMA foreign_keys on. Deleting it here first works
+    # the same on both.
+    post_notifications = select(models.Notification.id).where(models.Notification.post_id == post_id)
+    await db.execute(
+        delete(models.NotificationActor)
+        .where(models.NotificationActor.notification_id.in_(post_notifications))
+        .execution_options(synchronize_session=False)
+    )
+    for model in (models.Notification, models.Comment, models.PostLike, models.PostBookmark):
+        await db.execute(delete(model).where(model.post_id == post_id).execution_options(synchronize_session=False))
+
     # making this update in the database
-    db.delete(post)
-    db.commit()
+    await db.delete(post)
+    outbox.enqueue(
+        db, "post.deleted", post_id=post_id, owner_id=post.owner_id,
+        like_count=post.like_count, bookmarked_by=list(bookmarked_by)
+    )
+    await db.execute(etags.bump_version())
+    # the post's notifications go with it
+    await etags.bump_notifications(db, post.owner_id)
+    await db.commit()
+    outbox.wake()
+    await response_cache.bump_posts()
+    await response_cache.bump(f"comments:{post_id}")
     return
 
-# This helps to return all the post owned by the user.
-@router.get("/me", response_model=list[schemas.PostOut])
-def get_my_posts(
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
-):
-    all_my_posts = db.query(models.Post).filter(models.Post.owner_id == current_user.id).all()
-
-    # Build response manually with like counts
-    response = []
-    for post in all_my_posts:
-        response.append({
-            "id": post.id,
-            "title": post.title,
-            "content": post.content,
-            "created_at": post.created_at,
-            "owner_id": post.owner_id,
-            "like_count": len(post.likes), 
-            "visibility" : post.visibility
-        })
+def my_posts_query(user_id: int):
+    return select(*POST_COLUMNS).where(models.Post.owner_id == user_id)
 
-    return response
+# This helps to return all the post owned by the user.
+@router.get("/me", response_model=Union[list[schemas.PostOut], schemas.PostPage])
+async def get_my_posts(
+    paginate: str = "offset",
+    cursor: Optional[str] = None,
+    limit: int = pagination.page_limit(),
+    offset: int = Query(0, ge=0),
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+): 
+    query = my_posts_query(current_user.id)
 
+    if is_cursor_mode(paginate):
+        posts, next_cursor = await pagination.keyset_page(
+            db, query, models.Post.created_at, models.Post.id, cursor, limit
+        )
+        return fast_json.json_response(fast_json.dumps(
+            {"items": fast_json.rows_as_dicts(posts, POST_COLUMNS), "next_cursor": next_cursor}
+        ))
+
+    # newest first, same as the cursor pages
+    query = query.order_by(models.Post.created_at.desc(), models.Post.id.desc()).offset(offset).limit(limit)
+    my_posts = (await db.execute(query)).all()
+    return fast_json.json_response(fast_json.dumps(fast_json.rows_as_dicts(my_posts, POST_COLUMNS)))
+
+
+
+"""
+Likes and bookmarks are saved with one statement each, so double taps and concurrent
+requests can't hit duplicate key errors or both think they made the change:
+- add: INSERT ... ON CONFLICT DO NOTHING (see app/upsert.py), which inserts 1 row or 0
+- remove: DELETE ... WHERE user_id = ? AND post_id = ?, which deletes 1 row or 0
+Returns whether a row was actually added/removed. Only then is the outbox event saved (in
+the same transaction), so the post's counters and the owner's notification change exactly
+once however many times the request is repeated.
+`kind` is "like" or "bookmark", `model` the matching PostLike or PostBookmark.
+"""
+async def set_post_flag(db: database.AsyncDB, kind: str, model, post: models.Post, user_id: int, on: bool) -> bool:
+    if on:
+        changed = await upsert.insert_ignore(db, model, {"user_id": user_id, "post_id": post.id})
+    else:
+        result = await db.execute(
+            delete(model)
+            .where(model.user_id == user_id, model.post_id == post.id)
+            .execution_options(synchronize_session=False)
+        )
+        changed = result.rowcount > 0
+
+    if changed:
+        topic = f"{kind}.created" if on else f"{kind}.deleted"
+        outbox.enqueue(db, topic, post_id=post.id, user_id=user_id, owner_id=post.owner_id)
+    await db.commit()
+    if changed:
+        outbox.wake()
+    return changed
+
+# Likes / unlikes a post. Repeating the same request changes nothing (changed=false).
+@router.put("/{post_id}/like", response_model=schemas.LikeState)
+async def like_post(
+    post_id: int,
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+):
+    post = await get_post_or_404(post_id, db)
+    changed = await set_post_flag(db, "like", models.PostLike, post, current_user.id, on=True)
+    return {"liked": True, "changed": changed}
 
+@router.delete("/{post_id}/like", response_model=schemas.LikeState)
+async def unlike_post(
+    post_id: int,
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+):
+    post = await get_post_or_404(post_id, db)
+    changed = await set_post_flag(db, "like", models.PostLike, post, current_user.id, on=False)
+    return {"liked": False, "changed": changed}
 
 # This helps to state the status of a post liked/unliked by an user. 
+# Kept for existing clients; PUT/DELETE /posts/{post_id}/like say what they want instead of
+# flipping, which is safe to retry. Removing first and only adding when nothing was removed
+# makes the flip two statements at most, without a SELECT beforehand.
 @router.post("/{post_id}/like")
-def toggle_like_post(
-    post_id: int,
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
-):
+async def toggle_like_post(
+    post_id: int, 
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+): 
     # Make sure the post exists
-    post = get_post_or_404(post_id, db)
-
-    # Check if the like already exists
-    existing_like = db.query(models.PostLike).filter_by(
-        user_id=current_user.id,
-        post_id=post_id
-    ).first()
-
-    if existing_like:
-        # User already liked it → unlike (remove)
-        db.delete(existing_like)
-        db.commit()
+    post = await get_post_or_404(post_id, db)
+
+    # The post's like_count and the owner's notification are updated afterwards by the
+    # outbox worker (see app/outbox.py), the request only saves the like and the event.
+    if await set_post_flag(db, "like", models.PostLike, post, current_user.id, on=False):
         return {"message": "Post unliked."}
-    else:
-        # User hasn't liked it yet → like it
-        new_like = models.PostLike(user_id=current_user.id, post_id=post_id)
-        db.add(new_like)
-        # Only notify if liker ≠ post owner
-        if current_user.id != post.owner_id:
-            notification = models.Notification(
-            user_id=post.owner_id,
-            post_id=post_id,
-            type="like"
-         )
-            db.add(notification)
-        db.commit()
-        return {"message": "Post liked."}
+    await set_post_flag(db, "like", models.PostLike, post, current_user.id, on=True)
+    return {"message": "Post liked."}
 
 # function that helps to create comments on a post
 @router.post("/{post_id}/comments", response_model=schemas.CommentOut)
-def create_comment(
+async def create_comment(
         post_id: int,
         # make sure the comment body has content
         comment: schemas.CommentCreate,
-        db: Session = Depends(database.get_db),
-        current_user: models.User = Depends(auth.get_current_user)
+        db: database.AsyncDB = Depends(database.get_async_db),
+        current_user: auth.UserSnapshot = Depends(auth.get_current_user)
 ): 
     # ensures the post exists 
-    post = get_post_or_404(post_id, db)
-    
+    post = await get_post_or_404(post_id, db)
+
     new_comment = models.Comment(
         content=comment.content, 
         post_id=post_id, 
@@ -192,61 +355,196 @@ def create_comment(
     )
     # Track this new object. It’s ready to be inserted into the database.
     db.add(new_comment)
-
-    # Only notify if commenter ≠ post owner
-    if current_user.id != post.owner_id:
-        notification = models.Notification(
-        user_id=post.owner_id,
-        post_id=post_id,
-        type="comment"
-    )
-        db.add(notification)
+    # comment_count and the owner's notification are taken care of by the outbox worker
+    outbox.enqueue(db, "comment.created", post_id=post_id, user_id=current_user.id, owner_id=post.owner_id)
 
     # actually changes the database by adding the new_comment
-    db.commit()
+    await db.commit()
+    outbox.wake()
+    await response_cache.bump(f"comments:{post_id}")
     # Reloads the object from the database to get all up-to-date values , like id and created_at
-    db.refresh(new_comment)
+    await db.refresh(new_comment)
 
     return new_comment
 
+def comments_query(post_id: int):
+    return select(*COMMENT_COLUMNS).where(models.Comment.post_id == post_id)
+
 # response_model returns the result as list of comments. 
-@router.get("/{post_id}/comments", response_model= list[schemas.CommentOut])
-def get_comments_for_post(
+@router.get("/{post_id}/comments", response_model= Union[list[schemas.CommentOut], schemas.CommentPage])
+async def get_comments_for_post(
         post_id : int , 
-        db: Session = Depends(database.get_db)
+        paginate: str = "offset",
+        cursor: Optional[str] = None,
+        limit: int = pagination.page_limit(),
+        offset: int = Query(0, ge=0),
+        if_none_match: Optional[str] = Header(None),
+        db: database.AsyncDB = Depends(database.get_async_db)
 ): 
-    get_post_or_404(post_id, db)
-    # sorting all the comments in that post in ascending order
-    comments = db.query(models.Comment).filter(models.Comment.post_id == post_id).order_by(models.Comment.created_at.asc()).all()
-    return comments
+    cursor_mode = is_cursor_mode(paginate)
+    # 304 if no comment was added since the client's copy, see app/etags.py
+    marker = await etags.comments_marker(db, post_id)
+    if marker is None:
+        raise HTTPException(status_code=404, detail="Post not found.")
+    etag = etags.weak_etag(COMMENTS_SCHEMA, marker)
+    if etags.matches(if_none_match, etag):
+        return etags.not_modified(etag)
+
+    # cached per post, see app/response_cache.py; only the first page with the default limit,
+    # for the same reason as the feed (see is_cached_feed_page)
+    cache_key, cached = None, None
+    if cursor is None and offset == 0 and limit == pagination.DEFAULT_PAGE_SIZE:
+        cache_key, cached = await response_cache.lookup(
+            f"comments:{post_id}", marker=marker, paginate=paginate, limit=limit
+        )
+    if cached is not None:
+        return response_cache.json_response(cached, hit=True, headers=etags.headers(etag))
+
+    query = comments_query(post_id)
+
+    if cursor_mode:
+        # oldest first, same as the offset pages below
+        comments, next_cursor = await pagination.keyset_page(
+            db, query, models.Comment.created_at, models.Comment.id, cursor, limit,
+            descending=False
+        )
+        body = fast_json.dumps({"items": fast_json.rows_as_dicts(comments, COMMENT_COLUMNS), "next_cursor": next_cursor})
+    else:
+        # sorting the comments in that post in ascending order
+        query = query.order_by(models.Comment.created_at.asc(), models.Comment.id.asc())
+        result = await db.execute(query.offset(offset).limit(limit))
+        body = fast_json.dumps(fast_json.rows_as_dicts(result.all(), COMMENT_COLUMNS))
+
+    await response_cache.store(cache_key, body)
+    return response_cache.json_response(body, hit=False, headers=etags.headers(etag))
+
+def notifications_query(user_id: int):
+    return select(*NOTIFICATION_COLUMNS).where(models.Notification.user_id == user_id)
 
 # returns notifications for a post to the owner
-@router.get("/notifications", response_model=list[schemas.NotificationOut])
-def get_notifications(
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+@router.get("/notifications", response_model=Union[list[schemas.NotificationOut], schemas.NotificationPage])
+async def get_notifications(
+    paginate: str = "offset",
+    cursor: Optional[str] = None,
+    limit: int = pagination.page_limit(),
+    offset: int = Query(0, ge=0),
+    if_none_match: Optional[str] = Header(None),
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+): 
+    # 304 while nothing changed in the user's notifications, see app/etags.py
+    marker = await etags.notifications_marker(db, current_user.id)
+    etag = etags.weak_etag(NOTIFICATIONS_SCHEMA, current_user.id, marker)
+    if etags.matches(if_none_match, etag):
+        return etags.not_modified(etag, private=True)
+    headers = etags.headers(etag, private=True)
+
+    query = notifications_query(current_user.id)
+
+    if is_cursor_mode(paginate):
+        notifications, next_cursor = await pagination.keyset_page(
+            db, query, models.Notification.created_at, models.Notification.id, cursor, limit
+        )
+        return fast_json.json_response(fast_json.dumps(
+            {"items": fast_json.rows_as_dicts(notifications, NOTIFICATION_COLUMNS), "next_cursor": next_cursor}
+        ), headers)
+
+    query = query.order_by(models.Notification.created_at.desc(), models.Notification.id.desc())
+    result = await db.execute(query.offset(offset).limit(limit))
+    return fast_json.json_response(fast_json.dumps(fast_json.rows_as_dicts(result.all(), NOTIFICATION_COLUMNS)), headers)
+
+"""
+Live notifications as Server-Sent Events (text/event-stream), instead of polling
+GET /posts/notifications. Each new like or comment on one of your posts arrives as:
+
+    event: notification
+    id: 42
+    data: {"id": 42, "user_id": 1, "post_id": 7, "type": "like", "seen": false, ...}
+
+A comment line is sent every notifications.HEARTBEAT_SECONDS so idle connections stay open.
+An open stream holds no database connection, only a small queue (see app/pubsub.py). If the
+client reads too slowly, the oldest undelivered events are dropped; GET /posts/notifications
+always has the full list.
+"""
+@router.get("/notifications/stream")
+async def stream_notifications(
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
 ):
-    notifications = (
-        db.query(models.Notification)
-        .filter(models.Notification.user_id == current_user.id)
-        .order_by(models.Notification.created_at.desc())
-        .all()
+    channel = notifications.channel_for(current_user.id)
+
+    async def events():
+        async with pubsub.get_broker().subscribe(channel) as subscription:
+            # tells the client the stream is open (and flushes any proxy buffers)
+            yield ": connected\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), notifications.HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield message
+
+    # the generator is cancelled when the client disconnects, which unsubscribes it
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def unseen_count_query(user_id: int):
+    return (
+        select(func.count())
+        .select_from(models.Notification)
+        .where(models.Notification.user_id == user_id, models.Notification.seen == False)
     )
-    return notifications
 
+# how many unseen notifications the user has, for the badge on the bell icon.
+# Only reads the partial index over unseen notifications (see models.Notification).
+@router.get("/notifications/unseen_count", response_model=schemas.UnseenCount)
+async def get_unseen_notification_count(
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+):
+    unseen = await db.scalar(unseen_count_query(current_user.id))
+    return {"unseen": unseen}
+
+"""
+Marks all of the user's notifications as seen, or only those up to (and including) the id
+`up_to_id`, e.g. the newest one the app has shown, so anything that arrived in the
+meantime stays unseen. Runs as a single UPDATE and returns how many rows it changed.
+"""
+@router.post("/notifications/seen", response_model=schemas.MarkedSeen)
+async def mark_notifications_as_seen(
+    up_to_id: Optional[int] = None,
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+):
+    statement = (
+        update(models.Notification)
+        .where(models.Notification.user_id == current_user.id, models.Notification.seen == False)
+        .values(seen=True)
+        .execution_options(synchronize_session=False)
+    )
+    if up_to_id is not None:
+        statement = statement.where(models.Notification.id <= up_to_id)
+    result = await db.execute(statement)
+    if result.rowcount:
+        await etags.bump_notifications(db, current_user.id)
+    await db.commit()
+    return {"updated": result.rowcount}
 
 # gives the status of whether a notification has been seen or not. 
 @router.patch("/notifications/{notification_id}", response_model=schemas.NotificationOut)
-def mark_notification_as_seen(
+async def mark_notification_as_seen(
     # function of FastAPI, that helps to extract parameters from a path.
     # here , int gives hint to Path for what type of parameter to extract from the path. 
     # so if the path is notifications/5/ , Path will extract 5 and pass it as notification_id's value
     # here description is just of help document the process, to make it easy to read and understand.
     notification_id: int = Path(..., description="ID of the notification to mark as seen"),
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
-):
-    notification = db.query(models.Notification).filter_by(id=notification_id).first()
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+): 
+    notification = await db.get(models.Notification, notification_id)
 
     if not notification:
         raise HTTPException(status_code=404, detail="Notification not found.")
@@ -254,76 +552,147 @@ def mark_notification_as_seen(
     if notification.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="You do not have permission to modify this notification.")
 
-    notification.seen = True
-    db.commit()
-    db.refresh(notification)
+    if not notification.seen:
+        notification.seen = True
+        await etags.bump_notifications(db, current_user.id)
+    await db.commit()
+    await db.refresh(notification)
 
     return notification
 
 # function for the bookmark button to show if that post has been bookmarked or not. 
+# Like the like toggle above: kept for existing clients, PUT/DELETE below are retry-safe.
 @router.post("/{post_id}/bookmark")
-def toggle_bookmark_post (
+async def toggle_bookmark_post (
     post_id : int, 
-    db : Session = Depends(database.get_db), 
-    current_user : models.User = Depends(auth.get_current_user)
+    db : database.AsyncDB = Depends(database.get_async_db),
+    current_user : auth.UserSnapshot = Depends(auth.get_current_user)
 ): 
-    post = get_post_or_404(post_id, db)
-
-    # Checking if the user has already bookmarked this post
-    existing_bookmark = db.query(models.PostBookmark).filter_by(
-        user_id = current_user.id, 
-        post_id = post_id
-    ).first()
-    
+    post = await get_post_or_404(post_id, db)
+
     # if post already bookmarked , then removing it from the bookmark
-    if existing_bookmark: 
-        db.delete(existing_bookmark)
-        db.commit()
+    if await set_post_flag(db, "bookmark", models.PostBookmark, post, current_user.id, on=False):
         return {"message": "Post removed from Bookmarks."}
-    
-    else: 
-        new_bookmark = models.PostBookmark(
-            user_id = current_user.id, 
-            post_id = post_id
-        )
-        # Here, as new_bookmark is an instance of models.PostBookmark and PostBookmark is related to tablename - "post_bookmarks"
-        # SQLAlchemy will know that these changes should be added to that table in the database. 
-        db.add(new_bookmark)
-        db.commit()
-
-        # Here, we are not using db.refresh(new_bookmark), because here we are not dealing with DB-generated fiels
-        # like id, created_at while returning , which may not be automatically updated by SQLAlchemy for which we 
-        # have to refresh. Since, here we are returning a message not the new_bookmark object, we don't have to refresh
-        return {"message" : "Post bookmarked"}
-    
-# returnig all the posts bookmarked by the user.      
-@router.get("/bookmarks", response_model= list[schemas.PostOut]) 
-def get_bookmarked_posts(
-    db : Session = Depends(database.get_db),
-    current_user : models.User = Depends(auth.get_current_user)
-) :
-    bookmarks = (
+    await set_post_flag(db, "bookmark", models.PostBookmark, post, current_user.id, on=True)
+    return {"message" : "Post bookmarked"}
+
+@router.put("/{post_id}/bookmark", response_model=schemas.BookmarkState)
+async def bookmark_post(
+    post_id: int,
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+):
+    post = await get_post_or_404(post_id, db)
+    changed = await set_post_flag(db, "bookmark", models.PostBookmark, post, current_user.id, on=True)
+    return {"bookmarked": True, "changed": changed}
+
+@router.delete("/{post_id}/bookmark", response_model=schemas.BookmarkState)
+async def unbookmark_post(
+    post_id: int,
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+):
+    post = await get_post_or_404(post_id, db)
+    changed = await set_post_flag(db, "bookmark", models.PostBookmark, post, current_user.id, on=False)
+    return {"bookmarked": False, "changed": changed}
+
+def bookmarks_query(user_id: int):
+    return (
         # temporarily creates a table bet Post and PostBookmark where their post_id are same.
-        db.query(models.Post)
+        select(*POST_COLUMNS)
         .join(models.PostBookmark, models.Post.id == models.PostBookmark.post_id)
         # then from that temporary table , if filters based on matching of the user_id
-        .filter(models.PostBookmark.user_id == current_user.id)
-        # this sorts the result from newest to oldest, as its based on the time they were created
-        .order_by(models.Post.created_at.desc())
-        .all()
+        .where(models.PostBookmark.user_id == user_id)
+    )
+
+# returnig all the posts bookmarked by the user.      
+@router.get("/bookmarks", response_model= Union[list[schemas.PostOut], schemas.PostPage]) 
+async def get_bookmarked_posts(
+    paginate: str = "offset",
+    cursor: Optional[str] = None,
+    limit: int = pagination.page_limit(),
+    offset: int = Query(0, ge=0),
+    db : database.AsyncDB = Depends(database.get_async_db),
+    current_user : auth.UserSnapshot = Depends(auth.get_current_user)
+) :
+    query = bookmarks_query(current_user.id)
+
+    if is_cursor_mode(paginate):
+        posts, next_cursor = await pagination.keyset_page(
+            db, query, models.Post.created_at, models.Post.id, cursor, limit
+        )
+        return fast_json.json_response(fast_json.dumps(
+            {"items": fast_json.rows_as_dicts(posts, POST_COLUMNS), "next_cursor": next_cursor}
+        ))
+
+    # this sorts the result from newest to oldest, as its based on the time they were created
+    query = query.order_by(models.Post.created_at.desc(), models.Post.id.desc())
+    result = await db.execute(query.offset(offset).limit(limit))
+    return fast_json.json_response(fast_json.dumps(fast_json.rows_as_dicts(result.all(), POST_COLUMNS)))
+
+# most posts a client can ask about in one GET /posts/engagement call
+MAX_ENGAGEMENT_IDS = 100
+
+"""
+Tells the logged in user, for a whole screen of posts at once, which ones they liked and
+bookmarked: GET /posts/engagement?ids=3,7,12 returns
+    {"items": [{"post_id": 3, "liked_by_me": true, "bookmarked_by_me": false}, ...]}
+in the order of `ids`. Replaces one is_bookmarked call per post.
+Both lookups run as one query (UNION ALL of two `post_id IN (...)` lookups), each answered
+from the (user_id, post_id) primary key of post_likes and post_bookmarks.
+"""
+def engagement_query(user_id: int, post_ids: list):
+    liked = select(models.PostLike.post_id, literal("like").label("kind")).where(
+        models.PostLike.user_id == user_id, models.PostLike.post_id.in_(post_ids)
+    )
+    bookmarked = select(models.PostBookmark.post_id, literal("bookmark").label("kind")).where(
+        models.PostBookmark.user_id == user_id, models.PostBookmark.post_id.in_(post_ids)
     )
-    return bookmarks
+    return union_all(liked, bookmarked)
+
+@router.get("/engagement", response_model=schemas.EngagementOut)
+async def get_engagement(
+    ids: str,
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+):
+    try:
+        post_ids = list(dict.fromkeys(int(post_id) for post_id in ids.split(",") if post_id.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of post ids.")
+    if len(post_ids) > MAX_ENGAGEMENT_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_ENGAGEMENT_IDS} ids per request.")
+    if not post_ids:
+        return {"items": []}
+
+    result = await db.execute(engagement_query(current_user.id, post_ids))
+    found = {(post_id, kind) for post_id, kind in result.all()}
+
+    return {"items": [
+        {
+            "post_id": post_id,
+            "liked_by_me": (post_id, "like") in found,
+            "bookmarked_by_me": (post_id, "bookmark") in found,
+        }
+        for post_id in post_ids
+    ]}
 
 # helps to know if the post is booked marked or not. 
+# /posts/{post_id}/is_bookmarked is the proper path; the old misspelled one (under a doubled
+# /posts prefix) still works for clients that use it. For several posts use /posts/engagement.
+@router.get("/{post_id}/is_bookmarked")
 @router.get("/posts/{post_id}/is_bookedmarked")
-def is_post_bookmarked(
+async def is_post_bookmarked(
     post_id: int, 
-    db: Session = Depends(database.get_db), 
-    current_user: models.User = Depends(auth.get_current_user)
-):
-    exists = db.query(models.PostBookmark).filter_by(
-        user_id=current_user.id, 
-        post_id=post_id
-    ).first()
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: auth.UserSnapshot = Depends(auth.get_current_user)
+): 
+    result = await db.execute(
+        select(models.PostBookmark).filter_by(
+            user_id=current_user.id,
+            post_id=post_id
+        )
+    )
+    exists = result.scalars().first()
 
-    return {"bookmarked": bool(exists)}
\ No newline at end of file
+    return {"bookmarked": bool(exists)}
@@ -1,43 +1,59 @@
-from fastapi import APIRouter, HTTPException, Depends, status, File, UploadFile 
+from fastapi import APIRouter, HTTPException, Depends, status, File, UploadFile, BackgroundTasks, Header 
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session 
-from uuid import uuid4
 import os
-from .. import models, auth, database, schemas
+from datetime import datetime, timedelta
+from typing import Optional
+from .. import models, auth, database, schemas, storage, avatars, pubsub, outbox, response_cache, etags, fast_json
+from ..config import get_settings
 
 # Creates a new router that can be included in your main app
 router = APIRouter()
 # Sets up bcrypt (industry-standard) as your password hashing algorithm
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Looks up a user by email. The async routes below run it with run_in_threadpool,
+# because the database session is blocking and must not hold up the event loop.
+def find_user_by_email(db: Session, email: str):
+    return db.scalars(auth.user_by_email_query(email)).first()
+
+def save_new_user(db: Session, new_user: models.User):
+    db.add(new_user)
+    db.commit()
+    db.refresh(new_user)
+
+"""
+register and login are `async def` so that waiting for bcrypt (see auth.hash_password_async)
+doesn't hold one of FastAPI's request threads. They answer 503 when too many hashes are
+already waiting.
+"""
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+async def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+    db_user = await run_in_threadpool(find_user_by_email, db, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = auth.hash_password(user.password)
+    hashed_password = await auth.hash_password_async(user.password)
     new_user = models.User(
         username=user.username,
         email=user.email,
         password=hashed_password
     )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await run_in_threadpool(save_new_user, db, new_user)
     return {"msg": "User registered successfully!"}
 
 
 @router.post("/login")
 # OAuth2PasswordRequestForm takes in username and password from the form. Here, username holds the email.
-def login_user(form_data: schemas.UserLogin, db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.email).first()
-    print(user.password)
+async def login_user(form_data: schemas.UserLogin, db: Session = Depends(database.get_db)):
+    user = await run_in_threadpool(find_user_by_email, db, form_data.email)
     
     if not user:
         raise HTTPException(status_code=400, detail="Invalid email")
 
-    if not auth.verify_password(form_data.password, user.password):
+    if not await auth.verify_password_async(form_data.password, user.password):
         raise HTTPException(status_code=400, detail="Incorrect password")
     
     access_token_expires = 30
@@ -50,7 +66,7 @@ def login_user(form_data: schemas.UserLogin, db: Session = Depends(database.get_
 
 
 @router.get("/me")
-def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
+def read_users_me(current_user: models.User = Depends(auth.get_current_db_user)):
     return {
         "username": current_user.username,
         "email": current_user.email,
@@ -59,24 +75,31 @@ def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
 
 @router.get("/dashboard")
 # Depends(get_current_user) extracts and verifies the JWT token
-def dashboard(current_user: models.User = Depends(auth.get_current_user)):
+def dashboard(current_user: models.User = Depends(auth.get_current_db_user)):
     return {
         "message": f"Welcome to your dashboard, {current_user.username}!",
         "email": current_user.email,
         "joined": current_user.created_at
     }
 
+# The profile is a single primary key lookup, so its ETag is simply a hash of the response and
+# a 304 (If-None-Match) saves sending it again, see app/etags.py
 @router.get("/me/profile", response_model=schemas.UserProfileOut)
 def get_my_profile(
-    current_user: models.User = Depends(auth.get_current_user)
+    if_none_match: Optional[str] = Header(None),
+    current_user: models.User = Depends(auth.get_current_db_user)
 ):
-    return current_user
+    body = fast_json.dumps(jsonable_encoder(schemas.UserProfileOut.from_orm(current_user)))
+    etag = etags.body_etag(body)
+    if etags.matches(if_none_match, etag):
+        return etags.not_modified(etag, private=True)
+    return fast_json.json_response(body, etags.headers(etag, private=True))
 
 @router.patch("/me/profile", response_model = schemas.UserProfileOut)
 def update_my_profile(
     update_data: schemas.UserProfileUpdate, 
     db: Session = Depends(database.get_db), 
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: models.User = Depends(auth.get_current_db_user)
 ):
     """
     If user wants to update their bio and favourite_genre, then update_data will hold that 
@@ -92,72 +115,107 @@ def update_my_profile(
 
     db.commit()
     db.refresh(current_user)
+    # the cached login snapshot of this user is out of date now
+    auth.invalidate_user(current_user.email)
     return current_user
 
 @router.post("/me/avatar", status_code = 200)
 def upload_avatar(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...), 
     db: Session = Depends(database.get_db), 
-    current_user : models.User = Depends(auth.get_current_user)
+    current_user : models.User = Depends(auth.get_current_db_user)
 ): 
  # checking for it the upload is a type of image i.e. image/jpeg, image/png
  if not file.content_type.startswith("image/"):
     raise HTTPException(status_code=400, detail="File must be an image.")
  # this is extracting the image extension like png, jpg, jpeg
- file_ext = os.path.splitext(file.filename)[1]  
- # giving a new file name to that image
- filename = f"avatar_{uuid4().hex}{file_ext}" 
- # placing that img with new name into the avatars folder. 
- file_path = os.path.join("../images/avatars", filename)
+ file_ext = os.path.splitext(file.filename or "")[1].lower()
+ if file_ext not in storage.ALLOWED_AVATAR_EXTENSIONS:
+    raise HTTPException(status_code=400, detail="Unsupported image type.")
 
  """
-    Now saving the file into the path we defined earlier, 
-    Since its not a plain text file, we use wb -> write binary mode
-
-    Here we are referring to a new file in that path as f and then 
-    we are reading the binary data of the file/image uploaded by the 
-    user. i.e. file.file.read() 
-
-    Then we are writing that binary code into that new file and saving it. 
-    So, f will now hold the image uploaded by user , in our defined file path
+    Now saving the file into the avatars folder (see app/storage.py).
+    The upload is copied in small chunks instead of file.file.read(), so a big file never
+    has to fit in memory, and it's cut off as soon as it goes over the size limit.
+    The file is named after the hash of its content, so if this exact picture was already
+    uploaded before, nothing new is written.
  """
- with open(file_path, "wb") as f: 
-    f.write(file.file.read())
-     # Store URL path in database (relative for now)
+ try:
+    filename = storage.save_avatar(file.file, file_ext)
+ except storage.UploadTooLarge:
+    raise HTTPException(
+       status_code=413,
+       detail=f"Image is too large, the limit is {get_settings().max_avatar_bytes // (1024 * 1024)} MB."
+    )
 
- current_user.avatar_url = f"/{file_path}"
+ current_user.avatar_url = storage.avatar_url(filename)
+ # the resized copies of the new picture are made in the background, see app/avatars.py
+ current_user.avatar_variants = None
  db.commit()
  db.refresh(current_user)
+ # the cached login snapshot of this user is out of date now
+ auth.invalidate_user(current_user.email)
+
+ # The old picture stays on disk for now: another user may have the very same one (same
+ # hash), or be uploading it right now. python -m app.avatars --sweep removes it later once
+ # nobody uses it (see app/storage.py).
+
+ avatars.queue_avatar_variants(background_tasks, current_user.id, current_user.avatar_url)
 
  return {"message": "Avatar uploaded!", "avatar_url": current_user.avatar_url}
 
 # gives back the total posts, likes and bookmarked stats for the current user
-@router.get("/me/analytics")
+# The totals come from the user's user_stats row and the series from user_daily_stats, both
+# kept up to date by the outbox worker, so this is two small indexed reads however popular
+# the user is. `days` is how far back likes_per_day goes (1 to 365).
+@router.get("/me/analytics", response_model=schemas.UserAnalytics)
 def get_user_analytics(
+   days: int = 30,
    db: Session = Depends(database.get_db), 
-   current_user: models.User = Depends(auth.get_current_user)
+   current_user: auth.UserSnapshot = Depends(auth.get_current_user)
 ): 
-   # getting total posts for the current user
-   total_posts = db.query(models.Post).filter(models.Post.owner_id == current_user.id).count()
-   total_likes_received = (
-    db.query(models.PostLike)
-    .join(models.Post)
-    .filter(models.Post.owner_id == current_user.id)
-    .count()
-    )
-   total_bookmarked_posts = (
-    db.query(models.PostBookmark)
-    .filter(models.PostBookmark.user_id == current_user.id)
-    .count()
-)
+   if days < 1 or days > 365:
+      raise HTTPException(status_code=400, detail="days must be between 1 and 365.")
+   stats = db.get(models.UserStats, current_user.id)
+
+   today = datetime.utcnow().date()
+   first_day = today - timedelta(days=days - 1)
+   daily_rows = (
+      db.query(models.UserDailyStats.day, models.UserDailyStats.likes_received)
+      .filter(models.UserDailyStats.user_id == current_user.id)
+      .filter(models.UserDailyStats.day >= first_day)
+      .all()
+   )
+   likes_by_day = dict(daily_rows)
+   likes_per_day = [
+      {"day": day, "count": likes_by_day.get(day, 0)}
+      for day in (first_day + timedelta(days=offset) for offset in range(days))
+   ]
+
    return schemas.UserAnalytics(
-      total_posts = total_posts, 
-      total_likes_received = total_likes_received, 
-      total_bookmarked_posts = total_bookmarked_posts
+      total_posts = stats.post_count if stats else 0, 
+      total_likes_received = stats.likes_received if stats else 0, 
+      total_bookmarked_posts = stats.bookmark_count if stats else 0,
+      likes_per_day = likes_per_day
    )
       
 
 @router.get("/api/status")
 def status():
- return {"status": "Backend is running"}
+ return {
+    "status": "Backend is running",
+    # hit/miss counters of the logged in user cache used by auth.get_current_user
+    "user_cache": auth.get_user_cache().stats(),
+    # how busy the bcrypt worker pool is
+    "bcrypt": auth.bcrypt_stats(),
+    # connections in use/idle/overflow and how long requests wait for one
+    "database": database.pool_status(),
+    # open notification streams, see app/pubsub.py
+    "pubsub": pubsub.get_broker().stats(),
+    # events waiting for the outbox worker and how far behind it is
+    "outbox": outbox.queue_stats(),
+    # hit ratio of the cached feed and comment pages
+    "response_cache": response_cache.stats()
+ }
 
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, date
+from typing import Optional, List, Dict
 
 # while registering a new user
 class UserCreate(BaseModel):
@@ -20,8 +20,10 @@ class UserProfileOut(BaseModel):
     name: Optional[str]
     bio: Optional[str]
     favorite_genre: Optional[str]
-    created_at: Optional[str]
+    created_at: Optional[datetime]
     avatar_url : Optional[str]
+    # resized copies of the avatar, size -> format -> url, e.g. avatar_variants["128"]["webp"]
+    avatar_variants : Optional[Dict[str, Dict[str, str]]]
 
     class Config:
         orm_mode = True
@@ -48,12 +50,19 @@ class PostOut(PostBase):
     created_at: datetime
     owner_id: int
     like_count : int
+    comment_count : int = 0
+    bookmark_count : int = 0
     visibility : str 
 
     class Config:
         #  allows Pydantic to work directly with SQLAlchemy objects
         orm_mode = True
 
+# one page of posts in cursor mode, next_cursor is None on the last page
+class PostPage(BaseModel):
+    items: List[PostOut]
+    next_cursor: Optional[str]
+
 # structure to write comment for the user
 class CommentBase(BaseModel): 
     content : str
@@ -70,6 +79,11 @@ class CommentOut(CommentBase):
     class Config : 
         orm_mode = True     
 
+# one page of comments in cursor mode
+class CommentPage(BaseModel):
+    items: List[CommentOut]
+    next_cursor: Optional[str]
+
 
 class NotificationOut(BaseModel):
     id: int
@@ -78,12 +92,51 @@ class NotificationOut(BaseModel):
     type: str
     seen: bool
     created_at: datetime
+    # number of people this notification stands for, e.g. 12 for "12 people liked your post"
+    actor_count: int = 1
+    updated_at: Optional[datetime]
 
     class Config:
         orm_mode = True
 
+# one page of notifications in cursor mode
+class NotificationPage(BaseModel):
+    items: List[NotificationOut]
+    next_cursor: Optional[str]
+
+# result of PUT/DELETE /posts/{id}/like: `changed` is false when it was already that way
+class LikeState(BaseModel):
+    liked: bool
+    changed: bool
+
+class BookmarkState(BaseModel):
+    bookmarked: bool
+    changed: bool
+
+# what the logged in user has done with one post, see GET /posts/engagement
+class PostEngagement(BaseModel):
+    post_id: int
+    liked_by_me: bool
+    bookmarked_by_me: bool
+
+class EngagementOut(BaseModel):
+    items: List[PostEngagement]
+
+class UnseenCount(BaseModel):
+    unseen: int
+
+# result of marking notifications as seen in bulk
+class MarkedSeen(BaseModel):
+    updated: int
+
 # helps to store total posts, likes, bookmarked value of a user.
+class DailyCount(BaseModel):
+    day: date
+    count: int
+
 class UserAnalytics(BaseModel): 
     total_posts: int
     total_likes_received: int 
-    total_bookmarked_posts: int        
\ No newline at end of file
+    total_bookmarked_posts: int        
+    # likes received on each of the last `days` days, oldest first (days without likes are 0)
+    likes_per_day: List[DailyCount] = []
\ No newline at end of file
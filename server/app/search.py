@@ -0,0 +1,123 @@
+"""
+Full-text search over post titles and contents.
+
+`title ILIKE '%q%'` can't use an index, so every search used to read the whole posts table.
+Instead we keep a search index next to the table, using whatever the database offers:
+- PostgreSQL: a generated `search_vector` tsvector column on posts (kept up to date by
+  Postgres itself on every insert/update) with a GIN index, ranked with ts_rank. Migration
+  0004 adds them.
+- SQLite (local development): an FTS5 virtual table `posts_fts` that mirrors posts through
+  triggers, ranked with bm25. install() makes them on startup.
+- anything else: falls back to the old ILIKE filter, without relevance ranking.
+
+The last word of the search is matched as a prefix, so results show up while the user is
+still typing ("incep" finds "Inception").
+"""
+import re
+from sqlalchemy import Float, Integer, false, func, inspect, literal_column, or_, text
+from . import models
+
+# "external content" FTS5 table: it only stores the index, the text stays in posts.
+# The triggers keep the index in sync with inserts, updates and deletes on posts.
+SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+        title, content, content='posts', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF title, content ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+]
+
+
+# Is this one of the search objects? The models don't know about them, so
+# `alembic revision --autogenerate` has to leave them alone (see migrations/env.py):
+# the posts_fts table and FTS5's posts_fts_* shadow tables (install() makes them), and
+# posts.search_vector with its index (migration 0004).
+def is_search_object(name: str, type_: str, table_name: str = None) -> bool:
+    if type_ == "table":
+        return name == "posts_fts" or name.startswith("posts_fts_")
+    if type_ == "column":
+        return table_name == "posts" and name == "search_vector"
+    if type_ == "index":
+        return name == "ix_posts_search_vector"
+    return False
+
+
+# Creates the FTS table and triggers on SQLite if missing, safe to call on every startup.
+# They aren't a migration because batch mode (see migrations/env.py) drops the triggers
+# whenever it rebuilds the posts table; this puts them back. On PostgreSQL there's nothing
+# to do, the search column comes with the migrations.
+def install(engine):
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        is_new = not inspect(conn).has_table("posts_fts")
+        for statement in SQLITE_DDL:
+            conn.execute(text(statement))
+        # index the posts that existed before the FTS table did
+        if is_new:
+            conn.execute(text("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')"))
+
+
+# Splits the search into plain words, dropping quotes, operators and other punctuation, so
+# user input can never break the search syntax of the database.
+def search_terms(search: str):
+    return re.findall(r"\w+", search)
+
+
+"""
+Filters `query` (a query over models.Post) down to the posts matching `search`.
+Returns the filtered query and a rank expression where higher means more relevant,
+or None when the database can't rank results.
+"""
+def apply_search(query, search: str, dialect: str):
+    terms = search_terms(search)
+    # nothing to search for (e.g. "!!!") matches nothing, not the whole feed
+    if not terms:
+        return query.where(false()), None
+
+    if dialect == "postgresql":
+        # "star & war:*" -> every word has to match, the last one as a prefix
+        ts_query = func.to_tsquery("english", " & ".join(terms) + ":*")
+        search_vector = literal_column("posts.search_vector")
+        query = query.filter(search_vector.op("@@")(ts_query))
+        return query, func.ts_rank(search_vector, ts_query)
+
+    if dialect == "sqlite":
+        # '"star" "war"*' -> every word has to match, the last one as a prefix
+        match = " ".join('"' + term + '"' for term in terms) + "*"
+        matches = (
+            text(
+                "SELECT rowid AS post_id, bm25(posts_fts, 10.0, 1.0) AS rank "
+                "FROM posts_fts WHERE posts_fts MATCH :match"
+            )
+            .bindparams(match=match)
+            .columns(post_id=Integer, rank=Float)
+            .subquery("post_matches")
+        )
+        query = query.join(matches, matches.c.post_id == models.Post.id)
+        # bm25 gives better matches a lower score, so flip it
+        return query, -matches.c.rank
+
+    query = query.filter(
+        or_(
+            models.Post.title.ilike(f"%{search}%"),
+            models.Post.content.ilike(f"%{search}%")
+        )
+    )
+    return query, None
@@ -0,0 +1,148 @@
+"""
+Serves /uploads (avatars and their resized copies) in a way clients and CDNs can cache.
+
+Plain StaticFiles makes the app ask for an avatar again on every profile view. Here:
+- files named after their content hash (everything app/storage.py writes) get a strong ETag
+  and `Cache-Control: public, max-age=31536000, immutable`, since the same URL can never
+  point to different bytes. Clients keep them for a year without asking again.
+- any other file gets an ETag plus `no-cache`, so clients revalidate before reusing it.
+- If-None-Match is answered with an empty 304 when the client already has the file.
+- `Range: bytes=...` requests get a 206 with just that part of the file.
+- the body is handed to the server as a file (zero-copy sendfile) when the ASGI server
+  supports the "http.response.zerocopy" or "http.response.pathsend" extensions, and is
+  read in chunks otherwise.
+"""
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from . import etags
+
+# <sha256>.<ext> or <sha256>_<size>.<ext>, see storage.save_avatar/avatar_variant_filename
+CONTENT_ADDRESSED_NAME = re.compile(r"^[0-9a-f]{64}(_\d+)?\.[a-z0-9]+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+CHUNK_SIZE = 64 * 1024
+
+
+"""
+Turns a `Range: bytes=...` header into (start, end), both included.
+Returns None when the header should be ignored (not bytes, several ranges, garbage), in which
+case the whole file is sent, and "unsatisfiable" when the range lies outside the file.
+"""
+def parse_range(range_header: str, file_size: int):
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if first == "":
+            # "bytes=-500": the last 500 bytes
+            length = int(last)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(0, file_size - length), file_size - 1
+        start = int(first)
+        end = int(last) if last else file_size - 1
+    except ValueError:
+        return None
+    if start >= file_size or start > end:
+        return "unsatisfiable"
+    return start, min(end, file_size - 1)
+
+
+class RangeFileResponse(Response):
+    """Sends bytes start..end (included) of a file, using sendfile when the server can."""
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        count = self.end - self.start + 1
+        if "http.response.zerocopy" in extensions:
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": file.fileno(),
+                    "offset": self.start,
+                    "count": count,
+                    "more_body": False,
+                })
+            return
+        if "http.response.pathsend" in extensions and self.status_code == 200:
+            await send({"type": "http.response.pathsend", "path": self.path})
+            return
+
+        async with await anyio.open_file(self.path, "rb") as file:
+            await file.seek(self.start)
+            remaining = count
+            while remaining > 0:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    # the file got shorter while we were sending it
+                    break
+                remaining -= len(chunk)
+                if remaining == 0:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": False})
+                    return
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class UploadStaticFiles(StaticFiles):
+    # StaticFiles calls this once it has found the file for the requested path
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        filename = os.path.basename(full_path)
+        file_size = stat_result.st_size
+
+        if CONTENT_ADDRESSED_NAME.match(filename):
+            etag = f'"{filename}"'
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            etag = f'"{int(stat_result.st_mtime):x}-{file_size:x}"'
+            cache_control = REVALIDATE_CACHE_CONTROL
+
+        headers = {
+            "etag": etag,
+            "cache-control": cache_control,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "accept-ranges": "bytes",
+        }
+
+        if_none_match = request_headers.get("if-none-match")
+        if etags.matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        start, end = 0, file_size - 1
+
+        # If-Range: only send the part if the client's copy is still the current file
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and file_size > 0 and (if_range is None or if_range.strip() == etag):
+            byte_range = parse_range(range_header, file_size)
+            if byte_range == "unsatisfiable":
+                headers["content-range"] = f"bytes */{file_size}"
+                return Response(status_code=416, headers=headers)
+            if byte_range is not None:
+                start, end = byte_range
+                headers["content-range"] = f"bytes {start}-{end}/{file_size}"
+                status_code = 206
+
+        return RangeFileResponse(full_path, start, end, status_code, headers, media_type)
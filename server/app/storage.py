@@ -0,0 +1,118 @@
+"""
+Where uploaded images live on disk and how they are saved.
+
+Avatars are stored under the SHA-256 hash of their content (e.g. avatars/3f2a...9c.png):
+- the same picture uploaded twice (or by two users) is written to disk only once
+- a file name never points to different content, so clients can cache it forever
+
+Uploads are copied to disk in small chunks while being hashed, so a big upload never has
+to fit in memory, and anything over MAX_AVATAR_BYTES (see app/config.py) is rejected halfway through.
+
+Replaced avatars aren't deleted right away: another user may have uploaded the same picture
+and be about to save it as theirs. sweep_orphaned_avatars (python -m app.avatars --sweep)
+removes the files nobody uses once they are old enough.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from typing import Optional
+from .config import get_settings
+
+# server/app/images, served by main.py under /uploads
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+AVATAR_DIR = os.path.join(IMAGES_DIR, "avatars")
+AVATAR_URL_PREFIX = "/uploads/avatars/"
+
+ALLOWED_AVATAR_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+"""
+Copies `fileobj` into the avatars folder chunk by chunk and returns the new file name.
+The data goes to a temporary file first and is only renamed to <sha256><extension> once it
+is complete, so a half written upload is never served. If a file with that hash already
+exists, the copy is simply thrown away and the file's modification time is set to now, so
+the sweep doesn't remove it while this upload is being saved.
+Raises UploadTooLarge (and keeps nothing) when the upload is bigger than MAX_AVATAR_BYTES.
+"""
+def save_avatar(fileobj, extension: str) -> str:
+    os.makedirs(AVATAR_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    max_bytes = get_settings().max_avatar_bytes
+
+    fd, tmp_path = tempfile.mkstemp(dir=AVATAR_DIR, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+
+        filename = f"{digest.hexdigest()}{extension}"
+        final_path = os.path.join(AVATAR_DIR, filename)
+        try:
+            os.utime(final_path)
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            os.replace(tmp_path, final_path)
+        return filename
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def avatar_url(filename: str) -> str:
+    return AVATAR_URL_PREFIX + filename
+
+
+# name of a resized copy of an avatar (see app/avatars.py), e.g. <sha256>_128.webp
+def avatar_variant_filename(digest: str, size: int, extension: str) -> str:
+    return f"{digest}_{size}{extension}"
+
+
+# The content hash an avatar file (or one of its resized copies, or their .tmp files) is named after
+def avatar_digest(filename: str) -> str:
+    return filename.split(".")[0].split("_")[0]
+
+
+"""
+Deletes the avatar files (originals and resized copies) whose hash isn't in any of
+`used_urls`, the avatar URLs the users have right now, and returns how many it deleted.
+Files modified less than `min_age_seconds` ago are kept: they may belong to an upload that
+hasn't been saved on its user yet (save_avatar touches a file it reuses). The same goes for
+left over .upload-* files of uploads that never finished.
+"""
+def sweep_orphaned_avatars(used_urls, min_age_seconds: Optional[float] = None) -> int:
+    if min_age_seconds is None:
+        min_age_seconds = get_settings().avatar_sweep_min_age_seconds
+    used_digests = {
+        avatar_digest(os.path.basename(url)) for url in used_urls
+        if url and url.startswith(AVATAR_URL_PREFIX)
+    }
+    now = time.time()
+    removed = 0
+    if not os.path.isdir(AVATAR_DIR):
+        return 0
+    for entry in os.scandir(AVATAR_DIR):
+        if not entry.is_file() or avatar_digest(entry.name) in used_digests:
+            continue
+        try:
+            if now - entry.stat().st_mtime < min_age_seconds:
+                continue
+            os.remove(entry.path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
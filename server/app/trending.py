@@ -0,0 +1,149 @@
+"""
+Scores for GET /posts/?sort=trending.
+
+Every post has a precomputed Post.hot_score (indexed together with visibility), so a
+trending page is just "ORDER BY hot_score DESC LIMIT n" on an index, the same cost as a
+newest page no matter how many likes there are.
+
+The score works like reddit's "hot" ranking:
+
+    hot_score = log10(1 + engagement) + seconds since 2020-01-01 / TRENDING_DECAY_SECONDS
+    engagement = likes + 2 * comments + 1.5 * bookmarks
+
+so a post that is TRENDING_DECAY_SECONDS (12.5 hours by default) newer needs 10 times less
+engagement to rank the same. The time part only depends on when the post was created, so
+older posts sink without anyone touching their score: it only has to be recomputed when
+the post's counters change.
+
+That's done incrementally. When the outbox worker changes a post's counters it also sets
+Post.hot_score_stale, and refresh_stale_scores() recomputes just those posts, from the
+server every TRENDING_REFRESH_SECONDS, or by hand from the server folder with:
+
+    python -m app.trending          # the stale posts
+    python -m app.trending --all    # every post, e.g. after changing the weights
+"""
+import asyncio
+import logging
+import math
+import sys
+from datetime import datetime
+from sqlalchemy import select, update, bindparam
+from starlette.concurrency import run_in_threadpool
+from . import models, database, response_cache, etags
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# the TRENDING_* knobs are in app/config.py
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+BOOKMARK_WEIGHT = 1.5
+EPOCH = datetime(2020, 1, 1)
+
+
+def hot_score(like_count: int, comment_count: int, bookmark_count: int, created_at: datetime) -> float:
+    engagement = LIKE_WEIGHT * like_count + COMMENT_WEIGHT * comment_count + BOOKMARK_WEIGHT * bookmark_count
+    age = (created_at - EPOCH).total_seconds()
+    return round(math.log10(1 + max(engagement, 0)) + age / get_settings().trending_decay_seconds, 7)
+
+
+# The next TRENDING_BATCH_SIZE (stale) posts after `last_id`, with what their score is made of
+def score_batch_query(last_id: int, everything: bool = False):
+    posts = models.Post.__table__
+    query = (
+        select(posts.c.id, posts.c.like_count, posts.c.comment_count, posts.c.bookmark_count, posts.c.created_at, posts.c.hot_score)
+        .where(posts.c.id > last_id)
+        .order_by(posts.c.id)
+        .limit(get_settings().trending_batch_size)
+    )
+    if not everything:
+        query = query.where(posts.c.hot_score_stale == True)
+    return query
+
+
+"""
+Recomputes hot_score for the stale posts, TRENDING_BATCH_SIZE per round (or every post with
+everything=True), and returns how many scores changed.
+A score is only saved if the post's counters are still the ones it was computed from; if a
+like came in meanwhile, the post stays stale and is picked up by the next round.
+The feed's ETags (app/etags.py) are bumped once at the end, and only if a score changed.
+"""
+def refresh_stale_scores(db, everything: bool = False) -> int:
+    posts = models.Post.__table__
+    save_score = (
+        update(posts)
+        .where(
+            posts.c.id == bindparam("post_id"),
+            posts.c.like_count == bindparam("likes"),
+            posts.c.comment_count == bindparam("comments"),
+            posts.c.bookmark_count == bindparam("bookmarks"),
+        )
+        .values(hot_score=bindparam("score"), hot_score_stale=False)
+    )
+
+    changed = 0
+    last_id = 0
+    while True:
+        rows = db.execute(score_batch_query(last_id, everything)).all()
+        if not rows:
+            break
+        scores = []
+        for post_id, likes, comments, bookmarks, created_at, old_score in rows:
+            score = hot_score(likes, comments, bookmarks, created_at or datetime.utcnow())
+            scores.append({"post_id": post_id, "likes": likes, "comments": comments, "bookmarks": bookmarks, "score": score})
+            if score != old_score:
+                changed += 1
+        db.execute(save_score, scores)
+        db.commit()
+        last_id = rows[-1][0]
+
+    if changed:
+        db.execute(etags.bump_version())
+        db.commit()
+    return changed
+
+
+def refresh_once(everything: bool = False) -> int:
+    db = database.SessionLocal()
+    try:
+        return refresh_stale_scores(db, everything)
+    finally:
+        db.close()
+
+
+# Runs refresh_once every TRENDING_REFRESH_SECONDS until cancelled (started by main.py)
+async def run_refresher():
+    while True:
+        try:
+            if await run_in_threadpool(refresh_once) > 0:
+                # the trending pages in the response cache are out of date now, like the
+                # ETags refresh_stale_scores bumped
+                await response_cache.bump_posts()
+        except Exception:
+            logger.exception("Refreshing trending scores failed")
+        await asyncio.sleep(get_settings().trending_refresh_seconds)
+
+
+_refresher_task = None
+
+def start_refresher():
+    global _refresher_task
+    if _refresher_task is None:
+        _refresher_task = asyncio.get_running_loop().create_task(run_refresher())
+
+async def stop_refresher():
+    global _refresher_task
+    if _refresher_task is not None:
+        _refresher_task.cancel()
+        try:
+            await _refresher_task
+        except asyncio.CancelledError:
+            pass
+        _refresher_task = None
+
+
+if __name__ == "__main__":
+    # loads .env, like main.py does for the API
+    get_settings()
+    count = refresh_once(everything="--all" in sys.argv[1:])
+    print(f"Updated the trending score of {count} posts.")
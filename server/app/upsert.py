@@ -0,0 +1,67 @@
+"""
+Single statement "insert or update" helpers, so concurrent requests can't both see "no row
+yet" and then collide on the primary key.
+
+increment(): "add to a counter row, creating the row if it doesn't exist yet":
+
+    INSERT INTO user_stats (user_id, likes_received) VALUES (7, 1)
+    ON CONFLICT (user_id) DO UPDATE SET likes_received = user_stats.likes_received + excluded.likes_received
+
+insert_ignore(): "insert this row unless it's already there" (INSERT ... ON CONFLICT DO NOTHING)
+
+PostgreSQL and SQLite both support ON CONFLICT. On other databases they fall back to an
+UPDATE/SELECT followed by an INSERT when no row was there yet.
+"""
+from sqlalchemy import insert, update, select
+
+
+def dialect_insert(dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert
+    return None
+
+
+"""
+Adds `increments` ({"column": amount}) to the row of `model` identified by `keys`
+({"column": value}, the primary key), inserting it with those amounts if it's missing.
+"""
+async def increment(db, model, keys: dict, **increments):
+    table = model.__table__
+    dialect_insert_func = dialect_insert(db.bind.dialect.name)
+    if dialect_insert_func is not None:
+        statement = dialect_insert_func(table).values(**keys, **increments)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: table.c[name] + statement.excluded[name] for name in increments},
+        )
+        await db.execute(statement)
+        return
+
+    statement = update(table).values({name: table.c[name] + amount for name, amount in increments.items()})
+    for name, value in keys.items():
+        statement = statement.where(table.c[name] == value)
+    result = await db.execute(statement)
+    if result.rowcount == 0:
+        await db.execute(insert(table).values(**keys, **increments))
+
+
+# Inserts `values` into `model`'s table unless a row with the same primary key exists.
+# Returns True if the row was inserted, False if it was already there.
+async def insert_ignore(db, model, values: dict) -> bool:
+    table = model.__table__
+    dialect_insert_func = dialect_insert(db.bind.dialect.name)
+    if dialect_insert_func is not None:
+        result = await db.execute(dialect_insert_func(table).values(**values).on_conflict_do_nothing())
+        return result.rowcount == 1
+
+    existing = select(*table.primary_key.columns)
+    for column in table.primary_key.columns:
+        existing = existing.where(column == values[column.name])
+    if (await db.execute(existing)).first() is not None:
+        return False
+    await db.execute(insert(table).values(**values))
+    return True
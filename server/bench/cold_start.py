@@ -0,0 +1,131 @@
+"""
+Measures how long a fresh server process takes until it can answer requests, which is what
+every new worker (a deploy, a restart, autoscaling) pays before it serves anything.
+
+Every run starts a new Python process, so nothing is cached from the run before, and in it
+times
+- import: `import main` (FastAPI, SQLAlchemy, the routes; no database work happens here)
+- startup: the app's lifespan startup (migrations check, search index, DB_POOL_PREWARM
+  connections, the background workers), see main.py
+- ready: from starting the process to the end of startup, Python's own start included
+- first_request / second_request: two GET /posts/?limit=20 right after startup; the first
+  one also opens its database connection unless the pool was pre-warmed
+
+The results are the median (and min/max) over --runs runs, for every DB_POOL_PREWARM value
+in --prewarm. Run it from the server folder, against a database that is migrated already
+(e.g. one filled by bench/seed.py) so the runs don't include creating the schema:
+
+    DATABASE_URL=sqlite:///./bench.db python -m bench.cold_start --runs 10 --prewarm 0,5 --out cold.json
+    ... change something ...
+    DATABASE_URL=sqlite:///./bench.db python -m bench.cold_start --prewarm 0,5 --baseline cold.json
+
+Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# set by the parent process to its time.time() right before starting the child
+START_ENV = "COLD_START_T0"
+PHASES = ("import", "startup", "ready", "first_request", "second_request")
+
+
+# Runs inside the new process: one cold start, printed as a line of JSON
+async def measure_once() -> dict:
+    started = time.perf_counter()
+    import main as server
+    import httpx
+    imported = time.perf_counter()
+    timings = {"import": imported - started}
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.app.router.lifespan_context(server.app):
+        timings["startup"] = time.perf_counter() - imported
+        if START_ENV in os.environ:
+            timings["ready"] = time.time() - float(os.environ[START_ENV])
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in ("first_request", "second_request"):
+                request_started = time.perf_counter()
+                response = await client.get("/posts/", params={"limit": 20})
+                response.raise_for_status()
+                timings[name] = time.perf_counter() - request_started
+    return {name: round(seconds * 1000, 2) for name, seconds in timings.items()}
+
+
+def run_child(prewarm: int) -> dict:
+    env = dict(os.environ, DB_POOL_PREWARM=str(prewarm), **{START_ENV: repr(time.time())})
+    completed = subprocess.run(
+        [sys.executable, "-m", "bench.cold_start", "--child"],
+        env=env, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise SystemExit(f"cold start run failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs: list) -> dict:
+    summary = {}
+    for phase in PHASES:
+        values = [run[phase] for run in runs if phase in run]
+        if values:
+            summary[phase] = {
+                "median_ms": round(statistics.median(values), 2),
+                "min_ms": min(values),
+                "max_ms": max(values),
+            }
+    return summary
+
+
+# Prints how the median of every phase changed compared to an earlier results file
+def compare(report: dict, baseline: dict):
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    for prewarm, phases in report["results"].items():
+        before = baseline.get("results", {}).get(prewarm)
+        if not before:
+            continue
+        changes = []
+        for phase, result in phases.items():
+            old, new = before.get(phase, {}).get("median_ms"), result["median_ms"]
+            if old:
+                changes.append(f"{phase} {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+        print(f"  prewarm={prewarm:<4} " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per prewarm value")
+    parser.add_argument("--prewarm", default="0", help="DB_POOL_PREWARM values to compare, e.g. 0,5")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare with")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(measure_once())))
+        return
+
+    from bench.scenarios import git_commit
+    report = {**git_commit(), "runs": args.runs, "results": {}}
+    for prewarm in [int(value) for value in args.prewarm.split(",")]:
+        runs = [run_child(prewarm) for _ in range(args.runs)]
+        summary = summarize(runs)
+        report["results"][str(prewarm)] = summary
+        print(f"DB_POOL_PREWARM={prewarm}: " + "  ".join(
+            f"{phase}={result['median_ms']}ms" for phase, result in summary.items()
+        ))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Finds the concurrency ceiling of a running API: keeps `concurrency` clients hitting one
+endpoint as fast as they can for a few seconds, at several concurrency levels, and reports
+throughput and latency for each level.
+
+Use it to compare the threaded and the asyncio database modes. Start the server once per
+mode, with the same database and worker count, and point this at it:
+
+    DB_ASYNC_MODE=0 uvicorn main:app --port 8000
+    python bench/concurrency.py --url http://localhost:8000 --label threaded --out threaded.json
+
+    DB_ASYNC_MODE=1 uvicorn main:app --port 8000
+    python bench/concurrency.py --url http://localhost:8000 --label async --out async.json
+
+The level where throughput stops growing (and p95 latency starts climbing) is the ceiling.
+Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run_level(client, path, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/posts/?limit=20")
+    parser.add_argument("--levels", default="1,8,32,64,128,256")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--label", default="run", help="name of this run in the results, e.g. threaded/async")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(",")]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    results = []
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30.0) as client:
+        for level in levels:
+            result = await run_level(client, args.path, level, args.duration)
+            results.append(result)
+            print(f"[{args.label}] concurrency={level:4d}  {result['throughput_rps']:8.1f} req/s  "
+                  f"p95={result['p95_ms']} ms  errors={result['errors']}")
+
+    report = {"label": args.label, "url": args.url, "path": args.path, "levels": results}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,374 @@
+"""
+Benchmarks the API over the things people actually do, on a database filled by
+bench/seed.py, and saves the results as JSON so two commits can be compared.
+
+Scenarios (pick some with --scenarios, all run by default):
+- feed_scroll: anonymous users paging through the public feed with cursors, 10 pages deep
+- search: searches for one or two words, the popular ones more often than the rare ones
+- like_storm: many users liking and unliking the 10 most liked posts at the same time
+- login_burst: everybody logging in at once (bcrypt bound, see app/auth.py)
+- notification_polling: users with notifications checking their unseen count, and every
+  fifth time their notification list
+
+Each scenario keeps --concurrency clients busy for --duration seconds (after --warmup
+seconds that aren't counted) and reports throughput, p50/p95/p99 latency, errors and how
+many SQL queries a request ran on average.
+
+By default it runs the app from main.py in this process (through httpx's ASGI transport, no
+network), which is what makes counting queries possible. With --url it drives a running
+server instead; query counts are then left out, and the server must use the same
+JWT_SECRET, since the benchmark users' tokens are made here. Run it from the server folder:
+
+    DATABASE_URL=sqlite:///./bench.db python -m bench.seed --scale small
+    DATABASE_URL=sqlite:///./bench.db python -m bench.scenarios --out before.json
+    ... change something ...
+    DATABASE_URL=sqlite:///./bench.db python -m bench.scenarios --out after.json --baseline before.json
+
+The response cache (app/response_cache.py) stays on like in production; set
+RESPONSE_CACHE_ENABLED=0 to measure the database work behind every request.
+Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import httpx
+from sqlalchemy import event, func, select
+
+from app import models, database, auth
+from app.config import get_settings
+from bench.concurrency import percentile
+from bench.seed import BENCH_PASSWORD, EMAIL_DOMAIN, WORDS, SkewedPicker
+
+# how many of the seeded users the scenarios act as
+USERS_PER_SCENARIO = 200
+FEED_PAGES = 10
+PAGE_SIZE = 20
+
+
+"""
+Counts the SQL statements each request runs. An ASGI wrapper around the app gives every
+request its own counter in a context variable, and a before_cursor_execute listener on the
+engines adds one to it. Context variables follow the request into the threadpool and into
+the async engine's greenlets, and queries of the background workers (outbox, trending)
+aren't counted because they run outside any request.
+"""
+class QueryCounter:
+    def __init__(self, app):
+        self.app = app
+        self.current = contextvars.ContextVar("bench_query_count", default=None)
+        self.per_request = []
+        engines = [database.engine]
+        if database.async_engine is not None:
+            engines.append(database.async_engine.sync_engine)
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self.count)
+
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        counter = self.current.get()
+        if counter is not None:
+            counter[0] += 1
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        counter = [0]
+        token = self.current.set(counter)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.current.reset(token)
+            self.per_request.append(counter[0])
+
+
+class Context:
+    def __init__(self, client, rng, users, polling_users, hot_posts):
+        self.client = client
+        self.rng = rng
+        # [(email, auth headers)]
+        self.users = users
+        self.polling_users = polling_users
+        self.hot_posts = hot_posts
+        self.words = SkewedPicker(rng, WORDS, 1.1)
+
+
+def bearer(email: str) -> dict:
+    token = auth.create_access_token(data={"sub": email}, expires_delta=24 * 60)
+    return {"Authorization": f"Bearer {token}"}
+
+
+# Picks the benchmark users and posts out of the seeded database
+def load_context(client, seed_value: int) -> Context:
+    db = database.SessionLocal()
+    try:
+        emails = db.execute(
+            select(models.User.email)
+            .where(models.User.email.like(f"%@{EMAIL_DOMAIN}"))
+            .order_by(models.User.id)
+            .limit(USERS_PER_SCENARIO * 10)
+        ).scalars().all()
+        polling_emails = db.execute(
+            select(models.User.email)
+            .join(models.Notification, models.Notification.user_id == models.User.id)
+            .group_by(models.User.id, models.User.email)
+            .order_by(func.count().desc())
+            .limit(USERS_PER_SCENARIO)
+        ).scalars().all()
+        hot_posts = db.execute(
+            select(models.Post.id).order_by(models.Post.like_count.desc()).limit(10)
+        ).scalars().all()
+    finally:
+        db.close()
+    if not emails or not hot_posts:
+        raise SystemExit("No benchmark data found, run `python -m bench.seed` first.")
+
+    rng = random.Random(seed_value)
+    sample = rng.sample(emails, min(USERS_PER_SCENARIO, len(emails)))
+    return Context(
+        client, rng,
+        users=[(email, bearer(email)) for email in sample],
+        polling_users=[(email, bearer(email)) for email in polling_emails or sample],
+        hot_posts=hot_posts,
+    )
+
+
+# Every scenario is a loop of one client: it sends requests and calls record() for each
+async def feed_scroll(ctx: Context, record):
+    while True:
+        cursor = None
+        for _ in range(FEED_PAGES):
+            params = {"paginate": "cursor", "limit": PAGE_SIZE}
+            if cursor:
+                params["cursor"] = cursor
+            response = await record(ctx.client.get("/posts/", params=params))
+            cursor = response.json().get("next_cursor") if response.status_code == 200 else None
+            if not cursor:
+                break
+
+
+async def search(ctx: Context, record):
+    while True:
+        words = [ctx.words.pick() for _ in range(ctx.rng.choice((1, 1, 2)))]
+        # now and then a half typed word, like the search box sends while typing
+        if ctx.rng.random() < 0.2:
+            words[-1] = words[-1][:max(3, len(words[-1]) // 2)]
+        await record(ctx.client.get("/posts/", params={"search": " ".join(words), "limit": PAGE_SIZE}))
+
+
+async def like_storm(ctx: Context, record):
+    while True:
+        _, headers = ctx.rng.choice(ctx.users)
+        post_id = ctx.rng.choice(ctx.hot_posts)
+        method = ctx.client.put if ctx.rng.random() < 0.7 else ctx.client.delete
+        await record(method(f"/posts/{post_id}/like", headers=headers))
+
+
+async def login_burst(ctx: Context, record):
+    while True:
+        email, _ = ctx.rng.choice(ctx.users)
+        await record(ctx.client.post("/login", json={"email": email, "password": BENCH_PASSWORD}))
+
+
+async def notification_polling(ctx: Context, record):
+    polls = 0
+    while True:
+        _, headers = ctx.rng.choice(ctx.polling_users)
+        polls += 1
+        if polls % 5 == 0:
+            await record(ctx.client.get("/posts/notifications", params={"limit": PAGE_SIZE}, headers=headers))
+        else:
+            await record(ctx.client.get("/posts/notifications/unseen_count", headers=headers))
+
+
+SCENARIOS = {
+    "feed_scroll": feed_scroll,
+    "search": search,
+    "like_storm": like_storm,
+    "login_burst": login_burst,
+    "notification_polling": notification_polling,
+}
+
+
+class ScenarioFinished(Exception):
+    pass
+
+
+"""
+Runs one scenario with `concurrency` clients: `warmup` seconds first that aren't counted,
+then `duration` seconds that are. Returns the scenario's results.
+"""
+async def run_scenario(name, ctx: Context, counter, concurrency: int, duration: float, warmup: float) -> dict:
+    latencies = []
+    statuses = {}
+    errors = 0
+    measuring = False
+    stopping = False
+
+    async def record(request):
+        nonlocal errors
+        # at the end the clients stop before their next request instead of being cancelled
+        # in the middle of one, which in process would also cancel the request's handler
+        if stopping:
+            request.close()
+            raise ScenarioFinished()
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            if measuring:
+                errors += 1
+            raise
+        if measuring:
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code >= 400:
+                errors += 1
+        return response
+
+    async def client_loop():
+        while True:
+            try:
+                await SCENARIOS[name](ctx, record)
+            except ScenarioFinished:
+                return
+            except httpx.HTTPError:
+                # a client that lost its connection starts over
+                continue
+
+    clients = [asyncio.ensure_future(client_loop()) for _ in range(concurrency)]
+    try:
+        await asyncio.sleep(warmup)
+        measuring = True
+        if counter is not None:
+            counter.per_request.clear()
+        started = time.perf_counter()
+        await asyncio.sleep(duration)
+        measuring = False
+        elapsed = time.perf_counter() - started
+    finally:
+        stopping = True
+        await asyncio.gather(*clients, return_exceptions=True)
+
+    result = {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "queries_per_request": None,
+        "queries_per_request_p95": None,
+    }
+    if counter is not None and counter.per_request:
+        result["queries_per_request"] = round(statistics.mean(counter.per_request), 2)
+        result["queries_per_request_p95"] = percentile(counter.per_request, 95)
+    return result
+
+
+def git_commit() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain"], capture_output=True, text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def dataset_sizes() -> dict:
+    db = database.SessionLocal()
+    try:
+        return {
+            model.__tablename__: db.execute(select(func.count()).select_from(model)).scalar()
+            for model in (models.User, models.Post, models.PostLike, models.Comment, models.PostBookmark, models.Notification)
+        }
+    finally:
+        db.close()
+
+
+# Prints how every scenario changed compared to an earlier results file
+def compare(report: dict, baseline: dict):
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p95_ms", "p99_ms", "queries_per_request"):
+            old, new = before.get(key), result.get(key)
+            if old and new is not None:
+                changes.append(f"{key} {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+        print(f"  {name:<22} " + ", ".join(changes))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--url", help="benchmark a running server instead of main.py in this process")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    report = {
+        "label": args.label,
+        **git_commit(),
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "target": args.url or "in-process",
+        "database": database.engine.dialect.name,
+        "async_mode": get_settings().db_async_mode,
+        "dataset": dataset_sizes(),
+        "settings": {"concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup, "seed": args.seed},
+        "scenarios": {},
+    }
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async def run_all(client, counter):
+        ctx = load_context(client, args.seed)
+        for name in names:
+            result = await run_scenario(name, ctx, counter, args.concurrency, args.duration, args.warmup)
+            report["scenarios"][name] = result
+            print(f"{name:<22} {result['throughput_rps']:8.1f} req/s  p50={result['p50_ms']} p95={result['p95_ms']} "
+                  f"p99={result['p99_ms']} ms  queries/req={result['queries_per_request']}  errors={result['errors']}")
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30.0) as client:
+            await run_all(client, None)
+    else:
+        import main as server
+        counter = QueryCounter(server.app)
+        # errors in the app come back as 500 responses like from a real server, instead of raising
+        transport = httpx.ASGITransport(app=counter, raise_app_exceptions=False)
+        # runs the app's startup/shutdown (outbox worker, trending refresher) around the run
+        async with server.app.router.lifespan_context(server.app):
+            # a rough cold start number; bench/cold_start.py measures it properly in new processes
+            report["startup_seconds"] = round(server.app.state.startup_seconds, 3)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30.0) as client:
+                await run_all(client, counter)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,279 @@
+"""
+Fills the database with synthetic users, posts, likes, comments, bookmarks and
+notifications, so the benchmarks (bench/scenarios.py) run against a realistically sized and
+shaped dataset instead of an empty one.
+
+Real activity is very uneven: a few users write most of the posts, a few posts get most of
+the likes and comments, and most people only ever like things. So every "who" and "which
+post" below is drawn from a Zipf-like distribution (the n-th most popular gets 1 / n^skew of
+the attention) instead of uniformly. --skew 0 makes everything uniform, higher is more uneven.
+
+Run it from the server folder against an empty database (it migrates it first), e.g.:
+
+    DATABASE_URL=sqlite:///./bench.db python -m bench.seed --scale small
+    DATABASE_URL=postgresql://localhost/movieshare_bench python -m bench.seed --scale large
+
+The same --seed and sizes always produce the same rows (with dates relative to when it
+runs). Every user can log in as
+user<N>@bench.example.com with the password BENCH_PASSWORD ("benchpass"). --reset deletes the
+existing rows of these tables first.
+
+Afterwards the post counters, user_stats and trending scores are recomputed with
+app/reconcile.py and app/trending.py, the way they'd be after a backfill.
+"""
+import argparse
+import bisect
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, delete, func, select, text
+
+from app import models, database, migrate, search, auth, reconcile, trending
+
+BENCH_PASSWORD = "benchpass"
+EMAIL_DOMAIN = "bench.example.com"
+
+# sizes of each table for --scale, any of them can be overridden on the command line
+SCALES = {
+    "tiny": dict(users=200, posts=2_000, likes=10_000, comments=4_000, bookmarks=2_000, notifications=4_000),
+    "small": dict(users=2_000, posts=20_000, likes=200_000, comments=40_000, bookmarks=20_000, notifications=40_000),
+    "medium": dict(users=20_000, posts=200_000, likes=2_000_000, comments=400_000, bookmarks=200_000, notifications=400_000),
+    "large": dict(users=100_000, posts=1_000_000, likes=10_000_000, comments=2_000_000, bookmarks=1_000_000, notifications=2_000_000),
+}
+
+# words for titles, comments and search terms; a few of them are much more common than the
+# rest (they're drawn with the same skew), so searches match anything from a handful of
+# posts to a big part of the table
+WORDS = """
+movie film night review classic sequel director actor actress story ending twist horror
+comedy drama thriller romance action sci-fi fantasy animated documentary indie cinema
+scene soundtrack score camera villain hero plot character trailer premiere festival
+remake franchise series season episode binge streaming theater popcorn ticket cult
+masterpiece disappointing overrated underrated favourite rewatch spoiler recommend
+inception interstellar matrix godfather parasite alien gladiator titanic avatar joker
+batman spiderman starwars jaws psycho vertigo casablanca amelie oldboy arrival dune
+""".split()
+VISIBILITIES = ["public"] * 9 + ["private"]
+NOTIFICATION_TYPES = ["like"] * 7 + ["comment"] * 3
+
+
+"""
+Picks ids out of `ids` with a Zipf-like skew: the first id in a shuffled copy of the list
+is the most popular, the second gets 1/2^skew as much attention, and so on.
+Shuffling first keeps popularity from lining up with the id (user 1 isn't always the star).
+"""
+class SkewedPicker:
+    def __init__(self, rng: random.Random, ids, skew: float):
+        self.rng = rng
+        self.ids = list(ids)
+        rng.shuffle(self.ids)
+        total = 0.0
+        self.cumulative = []
+        for rank in range(1, len(self.ids) + 1):
+            total += 1.0 / rank ** skew
+            self.cumulative.append(total)
+        self.total = total
+
+    def pick(self):
+        index = bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+        return self.ids[min(index, len(self.ids) - 1)]
+
+
+def sentence(rng: random.Random, words: SkewedPicker, min_words: int, max_words: int) -> str:
+    return " ".join(words.pick() for _ in range(rng.randint(min_words, max_words)))
+
+
+# Inserts the rows from `rows` (a generator of dicts) in batches, each in its own transaction
+def insert_rows(engine, model, rows, batch_size: int) -> int:
+    table = model.__table__
+    count = 0
+    started = time.perf_counter()
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        with engine.begin() as conn:
+            conn.execute(insert(table), batch)
+        count += len(batch)
+    elapsed = time.perf_counter() - started
+    print(f"  {table.name:<16} {count:>10,} rows  {elapsed:7.1f}s  ({count / max(elapsed, 1e-9):,.0f} rows/s)")
+    return count
+
+
+# Pairs (user, post) without repeats, for the tables where the pair is the primary key.
+# Gives up after 10x as many tries as rows asked for, if the skew makes repeats too likely.
+def unique_pairs(users: SkewedPicker, posts: SkewedPicker, count: int):
+    seen = set()
+    tries = 0
+    while len(seen) < count and tries < count * 10:
+        tries += 1
+        pair = (users.pick(), posts.pick())
+        if pair not in seen:
+            seen.add(pair)
+            yield pair
+
+
+# Empties the seeded tables, children first because of the foreign keys
+def reset(engine):
+    with engine.begin() as conn:
+        for model in (
+            models.OutboxEvent, models.NotificationActor, models.Notification, models.UserDailyStats,
+            models.UserStats, models.PostBookmark, models.Comment, models.PostLike, models.Post, models.User,
+        ):
+            conn.execute(delete(model.__table__))
+
+
+# Ids are given explicitly below, so on PostgreSQL the id sequences must be moved past them
+def fix_sequences(engine):
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        for table in ("users", "posts", "comments", "notifications"):
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 0) + 1, false) FROM {table}"
+            ))
+
+
+def seed(engine, sizes: dict, skew: float, days: int, seed_value: int, batch_size: int):
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    start = now - timedelta(days=days)
+    span = (now - start).total_seconds()
+    # one bcrypt hash for everybody, hashing a million passwords would take days
+    password = auth.hash_password(BENCH_PASSWORD)
+    words = SkewedPicker(rng, WORDS, skew)
+
+    user_ids = range(1, sizes["users"] + 1)
+    insert_rows(engine, models.User, (
+        {
+            "id": user_id,
+            "email": f"user{user_id}@{EMAIL_DOMAIN}",
+            "username": f"user{user_id}",
+            "password": password,
+            "name": f"Bench User {user_id}",
+            "created_at": start,
+        }
+        for user_id in user_ids
+    ), batch_size)
+
+    # posts in time order, so ids grow with created_at like real ones do
+    post_times = sorted(start + timedelta(seconds=rng.random() * span) for _ in range(sizes["posts"]))
+    authors = SkewedPicker(rng, user_ids, skew)
+    post_owner = {}
+
+    def posts():
+        for post_id, created_at in enumerate(post_times, start=1):
+            owner_id = authors.pick()
+            post_owner[post_id] = (owner_id, created_at)
+            yield {
+                "id": post_id,
+                "title": sentence(rng, words, 2, 5).title(),
+                "content": sentence(rng, words, 10, 60),
+                "created_at": created_at,
+                "visibility": rng.choice(VISIBILITIES),
+                "owner_id": owner_id,
+                "hot_score_stale": True,
+            }
+    insert_rows(engine, models.Post, posts(), batch_size)
+
+    post_ids = range(1, sizes["posts"] + 1)
+    popular_posts = SkewedPicker(rng, post_ids, skew)
+    # likes and bookmarks come from most users, so they're less skewed than posting
+    active_users = SkewedPicker(rng, user_ids, skew / 2)
+
+    insert_rows(engine, models.PostLike, (
+        {"user_id": user_id, "post_id": post_id}
+        for user_id, post_id in unique_pairs(active_users, popular_posts, sizes["likes"])
+    ), batch_size)
+
+    def after(created_at: datetime) -> datetime:
+        return created_at + timedelta(seconds=rng.random() * (now - created_at).total_seconds())
+
+    def comments():
+        for comment_id in range(1, sizes["comments"] + 1):
+            post_id = popular_posts.pick()
+            yield {
+                "id": comment_id,
+                "content": sentence(rng, words, 3, 30),
+                "created_at": after(post_owner[post_id][1]),
+                "user_id": active_users.pick(),
+                "post_id": post_id,
+            }
+    insert_rows(engine, models.Comment, comments(), batch_size)
+
+    insert_rows(engine, models.PostBookmark, (
+        {"user_id": user_id, "post_id": post_id, "created_at": after(post_owner[post_id][1])}
+        for user_id, post_id in unique_pairs(active_users, popular_posts, sizes["bookmarks"])
+    ), batch_size)
+
+    # mostly read already, with a few unseen ones per user for the unseen count to find
+    def notifications():
+        for notification_id in range(1, sizes["notifications"] + 1):
+            post_id = popular_posts.pick()
+            owner_id, created_at = post_owner[post_id]
+            created_at = after(created_at)
+            yield {
+                "id": notification_id,
+                "user_id": owner_id,
+                "post_id": post_id,
+                "type": rng.choice(NOTIFICATION_TYPES),
+                "seen": rng.random() < 0.8,
+                "created_at": created_at,
+                "actor_count": min(int(rng.paretovariate(1.5)), 500),
+                "updated_at": created_at,
+            }
+    insert_rows(engine, models.Notification, notifications(), batch_size)
+
+    fix_sequences(engine)
+
+
+# the same work the outbox worker would have done for all these rows
+def rebuild_derived_data():
+    db = database.SessionLocal()
+    try:
+        started = time.perf_counter()
+        reconcile.reconcile_post_counters(db)
+        reconcile.reconcile_user_stats(db)
+        trending.refresh_stale_scores(db, everything=True)
+        print(f"  counters, user_stats and trending scores rebuilt in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    for table in SCALES["small"]:
+        parser.add_argument(f"--{table}", type=int, help=f"number of {table} (overrides --scale)")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent, 0 = uniform")
+    parser.add_argument("--days", type=int, default=365, help="spread the posts over this many past days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--reset", action="store_true", help="delete the existing rows first")
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for table in sizes:
+        if getattr(args, table) is not None:
+            sizes[table] = getattr(args, table)
+
+    engine = database.engine
+    migrate.upgrade_to_head()
+    search.install(engine)
+    if args.reset:
+        reset(engine)
+    with engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(models.User)).scalar():
+            parser.error("the database already has users, use --reset to replace them")
+
+    print(f"Seeding {engine.url.render_as_string(hide_password=True)} (skew {args.skew}, seed {args.seed})")
+    started = time.perf_counter()
+    seed(engine, sizes, args.skew, args.days, args.seed, args.batch_size)
+    rebuild_derived_data()
+    print(f"Done in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
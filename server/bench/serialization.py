@@ -0,0 +1,116 @@
+"""
+Microbenchmark of the list endpoints' response path: how long it takes to turn one page of
+posts into JSON bytes, from the query to the body, the old way and the fast_json way.
+
+- orm+fastapi: select(Post) as ORM objects, validated against response_model by FastAPI's
+  serialize_response (orm_mode) and rendered by JSONResponse (what the routes used to do)
+- rows+orjson: select(*columns) as plain rows, zipped into dicts and encoded by orjson
+  (app/fast_json.py, what the routes do now)
+- rows+json: the same with the standard json module, the fallback without orjson
+
+It uses its own in-memory SQLite database, so it measures the Python side only. Run it from
+the server folder:
+
+    python -m bench.serialization --sizes 20,100 --out serialization.json
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from app import models, schemas, fast_json
+
+
+def make_database(rows: int):
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"id": 1, "email": "a@example.com", "username": "a", "password": "x"}])
+        conn.execute(insert(models.Post), [
+            {
+                "id": post_id, "title": f"Post number {post_id}", "content": "Some words about a movie. " * 10,
+                "created_at": now - timedelta(minutes=post_id), "visibility": "public", "owner_id": 1,
+                "like_count": post_id % 50, "comment_count": post_id % 7, "bookmark_count": post_id % 3,
+            }
+            for post_id in range(1, rows + 1)
+        ])
+    return engine
+
+
+async def orm_fastapi(session, field, size: int) -> bytes:
+    posts = session.execute(select(models.Post).order_by(models.Post.created_at.desc()).limit(size)).scalars().all()
+    content = await serialize_response(field=field, response_content=posts)
+    body = JSONResponse(content).body
+    # a fresh session per request, like the routes get, so objects aren't reused from the identity map
+    session.expunge_all()
+    return body
+
+
+async def rows_fast(session, field, size: int) -> bytes:
+    columns = fast_json.columns_of(models.Post, schemas.PostOut)
+    rows = session.execute(select(*columns).order_by(models.Post.created_at.desc()).limit(size)).all()
+    return fast_json.dumps(fast_json.rows_as_dicts(rows, columns))
+
+
+async def time_path(path, session, field, size: int, rounds: int) -> dict:
+    # warm up the statement caches first
+    for _ in range(5):
+        await path(session, field, size)
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await path(session, field, size)
+        timings.append(time.perf_counter() - start)
+    median = statistics.median(timings)
+    return {"median_us": round(median * 1e6, 1), "per_row_us": round(median * 1e6 / size, 2), "pages_per_s": round(1 / median, 1)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="20,100", help="page sizes to time")
+    parser.add_argument("--rounds", type=int, default=300)
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    engine = make_database(max(sizes))
+    field = create_response_field(name="Response_get_posts", type_=list[schemas.PostOut])
+    orjson = fast_json.orjson
+    results = {}
+
+    with Session(engine) as session:
+        # both paths have to give the same JSON
+        assert json.loads(await orm_fastapi(session, field, 5)) == json.loads(await rows_fast(session, field, 5))
+
+        for size in sizes:
+            results[size] = {"orm+fastapi": await time_path(orm_fastapi, session, field, size, args.rounds)}
+            if orjson is not None:
+                results[size]["rows+orjson"] = await time_path(rows_fast, session, field, size, args.rounds)
+            fast_json.orjson = None
+            try:
+                results[size]["rows+json"] = await time_path(rows_fast, session, field, size, args.rounds)
+            finally:
+                fast_json.orjson = orjson
+
+    for size, paths in results.items():
+        baseline = paths["orm+fastapi"]["median_us"]
+        print(f"page of {size} posts:")
+        for name, result in paths.items():
+            print(f"  {name:<12} {result['median_us']:>9.1f} us/page  {result['per_row_us']:>7.2f} us/row  "
+                  f"x{baseline / result['median_us']:.2f}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({str(size): paths for size, paths in results.items()}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,13 +1,65 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+import logging
+import os
+import time
+from app.config import get_settings
 from app.routes import routes
-from app.database import engine
-from app import models
+from app import database, migrate, search, storage, outbox, trending, avatars, profiling, compression
+from app.static import UploadStaticFiles
 from app.routes import post
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
 
-models.Base.metadata.create_all(bind=engine)
+# reads .env; a bad setting stops the server here instead of on some request later
+settings = get_settings()
+
+
+# The database work of startup. Blocking, so the lifespan runs it on the thread pool.
+def prepare_database():
+    # creates/updates the tables with the Alembic migrations in migrations/ (see app/migrate.py).
+    # With AUTO_MIGRATE=0 run `python -m app.migrate` yourself before starting the server.
+    if settings.auto_migrate:
+        migrate.upgrade_to_head()
+    # full-text search table for posts on SQLite, see app/search.py
+    search.install(database.get_engine())
+
+
+"""
+Everything the server does on startup and shutdown. Importing main.py doesn't touch the
+database any more; this runs when the server (or a TestClient used in a with-block, or
+bench/scenarios.py) starts the app, before the first request is let in:
+- migrations and the search index (prepare_database)
+- DB_POOL_PREWARM connections opened ahead of the first requests (database.prewarm_pools)
+- the outbox worker (likes/comments side effects, see app/outbox.py), the trending score
+  refresh (app/trending.py) and the sweep of unused avatar files (app/avatars.py) started
+  next to the API
+
+On shutdown the workers are stopped and the pooled connections closed.
+app.state.startup_seconds is how long startup took, bench/cold_start.py reports it.
+"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    await run_in_threadpool(prepare_database)
+    if settings.db_pool_prewarm > 0:
+        await database.prewarm_pools(settings.db_pool_prewarm)
+    outbox.start_inline_worker()
+    trending.start_refresher()
+    avatars.start_sweeper()
+    app.state.startup_seconds = time.perf_counter() - started
+    logger.info("Startup took %.3fs", app.state.startup_seconds)
+    try:
+        yield
+    finally:
+        await outbox.stop_inline_worker()
+        await trending.stop_refresher()
+        await avatars.stop_sweeper()
+        await database.dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Include the existing router (probably for /signup, /login etc.)
 app.include_router(routes.router)
@@ -15,20 +67,31 @@ app.include_router(routes.router)
 # Include the post router
 app.include_router(post.router)
 
+# PROFILING_ENABLED=1: query counts and timings per route in Server-Timing headers and at
+# /metrics, see app/profiling.py
+if settings.profiling_enabled:
+    profiling.install(app)
+
+# gzip/brotli for JSON responses of COMPRESSION_MIN_SIZE bytes and up, see app/compression.py
+if settings.compression_enabled:
+    app.add_middleware(compression.CompressionMiddleware)
+
 """
 This helps to make our image files accessible over the web through your FastAPI app.
 app.mount(...) tells FastAPI that make static folders from a certain folder to be accessible 
 at a specific URL path. 
 /uploads: serves as a URL prefix
-StaticFiles(directory="server/app/images"): tells FastAPI where on your server the actual files are stored. 
+UploadStaticFiles(directory=storage.IMAGES_DIR): tells FastAPI where on your server the actual files are stored (server/app/images). 
 name = "uploads": This gives a name to this mounted static route. You don’t really use this unless you're doing 
 reverse routing or want to reference this route elsewhere in FastAPI.
 
 So, now : 
-http://localhost:8000/uploads/avatars/avatar_123.png -> server/app/images/avatars/avatar_123.png
+http://localhost:8000/uploads/avatars/3f2a...9c.png -> server/app/images/avatars/3f2a...9c.png
 
+UploadStaticFiles is StaticFiles plus caching headers, 304s and byte ranges, see app/static.py.
 """
-app.mount("/uploads", StaticFiles(directory="server/app/images"), name="uploads")
+os.makedirs(storage.AVATAR_DIR, exist_ok=True)
+app.mount("/uploads", UploadStaticFiles(directory=storage.IMAGES_DIR), name="uploads")
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,63 @@
+"""
+Alembic environment: connects to the app's database (DATABASE_URL) and compares it with the
+models in app/models.py when autogenerating migrations.
+"""
+from logging.config import fileConfig
+
+from alembic import context
+from app import models, database, search
+from app.config import get_settings
+
+config = context.config
+
+# Set up logging from alembic.ini when run as `alembic ...`, but leave the server's logging
+# alone when app/migrate.py runs the migrations on startup.
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = models.Base.metadata
+
+
+# Leaves out the full-text search objects (see app/search.py), which the models don't know
+# about, so autogenerate doesn't write migrations that drop them
+def include_object(object, name, type_, reflected, compare_to):
+    table_name = object.table.name if type_ == "column" else None
+    return not search.is_search_object(name, type_, table_name)
+
+
+# SQLite can't ALTER most things, so Alembic rebuilds the table instead ("batch mode")
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+# `alembic upgrade head --sql`: prints the SQL instead of running it
+def run_migrations_offline():
+    url = get_settings().database_url
+    context.configure(
+        url=url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=is_sqlite(url),
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    with database.get_engine().connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            render_as_batch=is_sqlite(get_settings().database_url),
+            include_object=include_object,
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,36 @@
+"""content versions for feed ETags
+
+Adds content_versions (see models.ContentVersion and app/etags.py) with the row of the
+feed's version in it, so the routes only ever have to UPDATE it.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 07:02:11
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    content_versions = op.create_table('content_versions',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(content_versions, [{'name': 'posts', 'version': 0}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('content_versions')
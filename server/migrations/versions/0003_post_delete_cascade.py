@@ -0,0 +1,51 @@
+"""cascade post deletes
+
+Makes the post_id foreign keys of post_likes, comments, notifications and post_bookmarks
+ON DELETE CASCADE, so deleting a post also deletes the rows that point at it.
+
+The constraints were created without names. PostgreSQL names them <table>_post_id_fkey. SQLite
+keeps no names, so batch mode names the reflected ones with NAMING_CONVENTION to be able to
+drop them while it rebuilds the table.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:40:25
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('post_likes', 'comments', 'notifications', 'post_bookmarks')
+NAMING_CONVENTION = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+def constraint_name(table: str) -> str:
+    if op.get_context().dialect.name == 'sqlite':
+        return f'fk_{table}_post_id_posts'
+    return f'{table}_post_id_fkey'
+
+
+def set_post_fk(ondelete) -> None:
+    for table in TABLES:
+        name = constraint_name(table)
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, 'posts', ['post_id'], ['id'], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    set_post_fk('CASCADE')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    set_post_fk(None)
@@ -0,0 +1,51 @@
+"""full-text search column for posts on PostgreSQL
+
+Adds posts.search_vector, a generated tsvector of the title and the content (words in the
+title weigh more), and its GIN index, see app/search.py. PostgreSQL keeps the column up to
+date on every insert and update.
+
+app/search.py used to add these on every startup. IF NOT EXISTS leaves the databases it did
+that for as they are.
+
+Nothing to do on SQLite: its FTS5 table and triggers are made by search.install(), since
+batch mode drops the triggers whenever a migration rebuilds the posts table.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 11:02:37
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.execute(
+        """
+        ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(content, '')), 'B')
+        ) STORED
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_posts_search_vector ON posts USING GIN (search_vector)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS ix_posts_search_vector")
+    op.execute("ALTER TABLE posts DROP COLUMN IF EXISTS search_vector")
@@ -0,0 +1,76 @@
+"""
+Fixtures shared by the tests. Run them from the server folder:
+
+    python -m pytest tests
+
+Every test gets its own SQLite database in a temporary folder, migrated the same way the
+server does on startup (app/migrate.py), so nothing needs a .env file or a running database.
+"""
+import pytest
+from app import auth, database, migrate, outbox, pubsub, response_cache, search
+from app.config import get_settings
+
+
+@pytest.fixture
+def settings_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv("JWT_SECRET", "test-secret-that-is-long-enough-for-hs256")
+    monkeypatch.setenv("JWT_ALGORITHM", "HS256")
+    monkeypatch.setenv("DB_ASYNC_MODE", "0")
+    monkeypatch.setenv("DB_POOL_PREWARM", "0")
+    # the avatar files in app/images belong to the dev database, not to the test ones
+    monkeypatch.setenv("AVATAR_SWEEP_SECONDS", "0")
+    reset_app_state(monkeypatch)
+    yield
+    if database._engine is not None:
+        database._engine.dispose()
+    reset_app_state(monkeypatch)
+
+
+# Forgets the settings, engines and caches the app builds on first use, so each test
+# starts with its own database and empty caches
+def reset_app_state(monkeypatch):
+    get_settings.cache_clear()
+    for name in ("_engine", "_session_factory", "_async_engine", "_async_session_factory"):
+        monkeypatch.setattr(database, name, None)
+    auth.get_user_cache.cache_clear()
+    response_cache.get_backend.cache_clear()
+    pubsub.get_broker.cache_clear()
+
+
+@pytest.fixture
+def engine(settings_env):
+    migrate.upgrade_to_head()
+    engine = database.get_engine()
+    search.install(engine)
+    return engine
+
+
+
+# The app, started with its lifespan. The outbox worker doesn't run in it: the tests call
+# run_outbox() when they want the events handled, so they can look at them before that.
+@pytest.fixture
+def client(settings_env, monkeypatch):
+    monkeypatch.setenv("OUTBOX_INLINE_WORKER", "0")
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+
+# Registers and logs in `name`, returns the headers for its requests
+def login(client, name: str) -> dict:
+    client.post("/register", json={"username": name, "email": f"{name}@example.com", "password": "password123"})
+    response = client.post("/login", json={"email": f"{name}@example.com", "password": "password123"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+# Handles the waiting outbox events, on the app's event loop, like the inline worker would
+def run_outbox(client) -> int:
+    async def process():
+        db = database.new_async_session()
+        try:
+            return await outbox.process_batch(db)
+        finally:
+            await db.close()
+    return client.portal.call(process)
@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime
+from sqlalchemy import func, select
+from app import database, models, outbox
+from conftest import login, run_outbox
+
+
+def count_events(topic: str) -> int:
+    with database.get_session_factory()() as db:
+        return db.scalar(select(func.count()).select_from(models.OutboxEvent).where(models.OutboxEvent.topic == topic))
+
+
+def test_repeated_like_and_bookmark_change_nothing(client):
+    alice, bob = login(client, "alice"), login(client, "bob")
+    post_id = client.post("/posts/", json={"title": "Hello", "content": "First post"}, headers=alice).json()["id"]
+
+    assert client.put(f"/posts/{post_id}/like", headers=bob).json() == {"liked": True, "changed": True}
+    assert client.put(f"/posts/{post_id}/like", headers=bob).json() == {"liked": True, "changed": False}
+    assert client.put(f"/posts/{post_id}/bookmark", headers=bob).json() == {"bookmarked": True, "changed": True}
+    assert client.put(f"/posts/{post_id}/bookmark", headers=bob).json() == {"bookmarked": True, "changed": False}
+    # only the requests that changed something left an event for the worker
+    assert count_events("like.created") == 1
+    assert count_events("bookmark.created") == 1
+
+    run_outbox(client)
+    assert client.delete(f"/posts/{post_id}/like", headers=bob).json() == {"liked": False, "changed": True}
+    assert client.delete(f"/posts/{post_id}/like", headers=bob).json() == {"liked": False, "changed": False}
+    assert count_events("like.deleted") == 1
+    run_outbox(client)
+
+    with database.get_session_factory()() as db:
+        post = db.get(models.Post, post_id)
+        assert (post.like_count, post.bookmark_count) == (0, 1)
+
+
+def test_failing_event_does_not_hold_back_the_batch(engine, monkeypatch):
+    handled = []
+
+    async def handle_ok(db, payload, after_commit):
+        handled.append(payload["n"])
+
+    async def handle_broken(db, payload, after_commit):
+        raise ValueError("boom")
+
+    monkeypatch.setitem(outbox.HANDLERS, "test.ok", handle_ok)
+    monkeypatch.setitem(outbox.HANDLERS, "test.broken", handle_broken)
+    with database.get_session_factory()() as db:
+        outbox.enqueue(db, "test.ok", n=1)
+        outbox.enqueue(db, "test.broken", n=2)
+        outbox.enqueue(db, "test.ok", n=3)
+        db.commit()
+
+    async def process():
+        db = database.new_async_session()
+        try:
+            return await outbox.process_batch(db)
+        finally:
+            await db.close()
+
+    assert asyncio.run(process()) == 3
+    # the batch was rolled back and redone one event at a time
+    assert handled == [1, 1, 3]
+
+    with database.get_session_factory()() as db:
+        events = db.scalars(select(models.OutboxEvent).order_by(models.OutboxEvent.id)).all()
+        ok_first, broken, ok_last = events
+        assert ok_first.processed_at is not None and ok_last.processed_at is not None
+        assert broken.processed_at is None
+        assert broken.attempts == 1
+        assert "boom" in broken.last_error
+        assert broken.available_at > datetime.utcnow()
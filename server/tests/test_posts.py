@@ -0,0 +1,73 @@
+from datetime import datetime
+from conftest import login, run_outbox
+
+
+def create_posts(client, headers, count: int) -> list:
+    return [
+        client.post("/posts/", json={"title": f"Post {n}", "content": "Some text"}, headers=headers).json()["id"]
+        for n in range(count)
+    ]
+
+
+def test_cursor_pages_cover_the_feed_once(client):
+    alice = login(client, "alice")
+    post_ids = create_posts(client, alice, 5)
+
+    seen, cursor = [], None
+    while True:
+        params = {"paginate": "cursor", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/posts/", params=params).json()
+        assert len(page["items"]) <= 2
+        seen += [post["id"] for post in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == post_ids[::-1]
+
+
+def test_feed_etag_answers_304_until_the_feed_changes(client):
+    alice = login(client, "alice")
+    create_posts(client, alice, 1)
+
+    response = client.get("/posts/")
+    etag = response.headers["ETag"]
+    assert client.get("/posts/", headers={"If-None-Match": etag}).status_code == 304
+
+    create_posts(client, alice, 1)
+    response = client.get("/posts/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == 2
+
+
+def test_analytics_days(client):
+    alice, bob = login(client, "alice"), login(client, "bob")
+    post_id = create_posts(client, alice, 1)[0]
+    client.put(f"/posts/{post_id}/like", headers=bob)
+    run_outbox(client)
+
+    assert client.get("/me/analytics", params={"days": 0}, headers=alice).status_code == 400
+    assert client.get("/me/analytics", params={"days": 366}, headers=alice).status_code == 400
+
+    analytics = client.get("/me/analytics", params={"days": 7}, headers=alice).json()
+    assert (analytics["total_posts"], analytics["total_likes_received"]) == (1, 1)
+    days = analytics["likes_per_day"]
+    assert len(days) == 7
+    # oldest first, ending today with the like
+    assert days[-1] == {"day": datetime.utcnow().date().isoformat(), "count": 1}
+    assert sum(day["count"] for day in days) == 1
+
+
+def test_offset_lists_return_one_page(client):
+    alice = login(client, "alice")
+    post_ids = create_posts(client, alice, 5)
+    for n in range(5):
+        client.post(f"/posts/{post_ids[0]}/comments", json={"content": f"Comment {n}"}, headers=alice)
+
+    pages = [client.get("/posts/me", params={"limit": 2, "offset": offset}, headers=alice).json() for offset in (0, 2, 4)]
+    assert [[post["id"] for post in page] for page in pages] == [post_ids[4:2:-1], post_ids[2:0:-1], post_ids[:1]]
+
+    comments = client.get(f"/posts/{post_ids[0]}/comments", params={"limit": 3, "offset": 1}).json()
+    assert [comment["content"] for comment in comments] == ["Comment 1", "Comment 2", "Comment 3"]
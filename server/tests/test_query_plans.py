@@ -0,0 +1,8 @@
+from app import query_plans
+
+
+def test_hot_queries_use_an_index(engine):
+    results = query_plans.check_plans(engine)
+    assert results
+    scans = {name: found for name, (plan_lines, found) in results.items() if found}
+    assert scans == {}